@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the GitHub Models chat completions endpoint
+
+Answers every POST with a completion whose content is the top losers from
+api/map_perf.ashx in this directory, wrapped in a ```json block like the
+real model often does. Each request is logged with the client connection
+it arrived on, so connection reuse by the pooled client is visible.
+
+Requests with "stream": true get the same content as server-sent events,
+a few characters per chunk with --token-delay between chunks, so early
+termination by the streaming client shows up as a closed connection.
+--cut-after N ends each stream after N chunks without [DONE], like an
+answer cut off by the model's token limit.
+
+Throttling can be simulated for the client's rate limiter: --rpm answers
+429 with Retry-After once more than N requests arrive in a minute (or in
+--window seconds), and
+--fail-every N answers every Nth request with a 503. Every response carries
+x-ratelimit-limit-requests and x-ratelimit-remaining-requests headers.
+
+--model-delay MODEL=SECONDS gives one model its own latency, so hedged
+requests (a slow primary model and a fast second model) can be exercised
+against a single server.
+
+    python skills/finviz-map/fixtures/mock_models_server.py --port 8090
+    python skills/finviz-map/scripts/analyze_map.py -i spy.png -i world.png \
+        --token test --endpoint http://127.0.0.1:8090/chat/completions
+"""
+
+import argparse
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES_DIR = Path(__file__).parent
+
+
+def load_losers(limit=10):
+    with open(FIXTURES_DIR / "api" / "map_perf.ashx", "r", encoding="utf-8") as f:
+        nodes = json.load(f)["nodes"]
+    losers = sorted(((t, c) for t, c in nodes.items() if c < 0), key=lambda item: item[1])[:limit]
+    return {"top_losers": [{"ticker": t, "change": f"{c:.2f}%"} for t, c in losers]}
+
+
+class MockModelsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Shared across handler instances
+    lock = threading.Lock()
+    connections = {}
+    delay = 0.0
+    model_delays = {}
+    token_delay = 0.02
+    chunk_size = 8
+    cut_after = 0
+    rpm = 0
+    window = 60.0
+    fail_every = 0
+    request_times = []
+    request_count = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_rate_limit_headers()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_rate_limit_headers(self):
+        if not self.rpm:
+            return
+        with self.lock:
+            remaining = max(0, self.rpm - len(self.request_times))
+        self.send_header("x-ratelimit-limit-requests", str(self.rpm))
+        self.send_header("x-ratelimit-remaining-requests", str(remaining))
+
+    def throttle(self):
+        """Return (status, retry_after) when this request should be rejected"""
+        now = time.monotonic()
+        with self.lock:
+            MockModelsHandler.request_count += 1
+            count = MockModelsHandler.request_count
+            if self.rpm:
+                self.request_times[:] = [t for t in self.request_times if now - t < self.window]
+                if len(self.request_times) >= self.rpm:
+                    return 429, math.ceil(self.window - (now - self.request_times[0]))
+                self.request_times.append(now)
+        if self.fail_every and count % self.fail_every == 0:
+            return 503, None
+        return None, None
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def stream_content(self, content, model):
+        """Send content as chat.completion.chunk events, then [DONE]"""
+        self.send_response(200)
+        self.send_rate_limit_headers()
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        pieces = [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)]
+        if self.cut_after:
+            pieces = pieces[:self.cut_after]
+        sent = 0
+        try:
+            for piece in pieces:
+                event = {
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                self.write_chunk(f"data: {json.dumps(event)}\n\n")
+                sent += 1
+                time.sleep(self.token_delay)
+            if self.cut_after:
+                self.wfile.write(b"0\r\n\r\n")
+                print(f"   ✂️  cut the stream off after {sent} chunks")
+                return
+            self.write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            print(f"   streamed all {sent} chunks")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            print(f"   ✂️  client closed the stream after {sent} of {len(pieces)} chunks")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self.send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+
+        connection = f"{self.client_address[0]}:{self.client_address[1]}"
+        with self.lock:
+            self.connections[connection] = self.connections.get(connection, 0) + 1
+            count = self.connections[connection]
+        print(f"📨 POST {self.path} from {connection} (request {count} on this connection, "
+              f"{len(body):,} bytes, {len(self.connections)} connections total)")
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.send_json(401, {"error": {"message": "missing bearer token"}})
+            return
+
+        status, wait = self.throttle()
+        if status == 429:
+            print(f"   🚦 429 rate limited, Retry-After {wait}s")
+            self.send_json(429, {"error": {"code": "RateLimitReached",
+                                           "message": f"Rate limit exceeded, retry after {wait} seconds"}},
+                           {"Retry-After": str(wait)})
+            return
+        if status == 503:
+            print("   💥 503 simulated failure")
+            self.send_json(503, {"error": {"message": "service unavailable"}})
+            return
+
+        delay = self.model_delays.get(request.get("model"), self.delay)
+        if delay:
+            time.sleep(delay)
+
+        content = "```json\n" + json.dumps(load_losers(), indent=2) + "\n```"
+        if request.get("stream"):
+            self.stream_content(content, request.get("model"))
+            return
+        self.send_json(200, {
+            "id": f"mock-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "model": request.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(content) // 4},
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock GitHub Models chat completions server")
+    parser.add_argument("--host", default="127.0.0.1", help="Listen address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8090, help="Listen port (default: 8090)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before each answer")
+    parser.add_argument("--token-delay", type=float, default=0.02,
+                        help="Seconds between streamed chunks (default: 0.02)")
+    parser.add_argument("--cut-after", type=int, default=0,
+                        help="End streams after N chunks without [DONE] (default: off)")
+    parser.add_argument("--rpm", type=int, default=0,
+                        help="Answer 429 once more than RPM requests arrive within a minute (default: off)")
+    parser.add_argument("--window", type=float, default=60.0,
+                        help="Length of the --rpm window in seconds (default: 60)")
+    parser.add_argument("--fail-every", type=int, default=0,
+                        help="Answer every Nth request with a 503 (default: off)")
+    parser.add_argument("--model-delay", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="Per-model delay overriding --delay, repeatable")
+    args = parser.parse_args()
+
+    MockModelsHandler.delay = args.delay
+    for item in args.model_delay:
+        model, _, seconds = item.partition("=")
+        MockModelsHandler.model_delays[model] = float(seconds)
+    MockModelsHandler.token_delay = args.token_delay
+    MockModelsHandler.cut_after = args.cut_after
+    MockModelsHandler.rpm = args.rpm
+    MockModelsHandler.window = args.window
+    MockModelsHandler.fail_every = args.fail_every
+    server = ThreadingHTTPServer((args.host, args.port), MockModelsHandler)
+    print(f"🤖 Mock models server on http://{args.host}:{args.port}/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Mock models server stopped")
+
+
+if __name__ == "__main__":
+    main()
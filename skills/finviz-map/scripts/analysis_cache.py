@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+分析結果的磁碟快取
+以圖片內容、提示詞、模型與參數的 SHA-256 為鍵，儲存解析後的 JSON，
+同一張圖片重跑 (workflow 重試、提交失敗後手動重跑) 時不必再呼叫付費且有速率限制的 API
+
+淘汰策略: 建立 (created_at) 超過 max_age 的項目直接刪除，不論是否常被命中；
+總大小超過 max_bytes 時依最近使用時間 (檔案 mtime，命中時更新) 由舊到新刪除 (LRU)
+"""
+
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from instrumentation import atomic_write
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 7
+
+STATS_FILE = "stats.json"
+
+
+def created_timestamp(entry):
+    """項目的建立時間 (epoch 秒)，沒有或無法解析時回傳 None"""
+    try:
+        return datetime.fromisoformat(entry["created_at"].replace("Z", "+00:00")).timestamp()
+    except (KeyError, AttributeError, TypeError, ValueError):
+        return None
+
+
+class AnalysisCache:
+    """每個項目一個 <key>.json 檔案的內容定址快取"""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image_bytes, prompt, model, params):
+        """圖片位元組、提示詞、模型與參數的 SHA-256"""
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(image_bytes).digest())
+        digest.update(json.dumps(
+            {"prompt": prompt, "model": model, "params": params},
+            sort_keys=True, ensure_ascii=False
+        ).encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key):
+        """回傳快取的結果 (新的 dict)，沒有或已過期時回傳 None"""
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if self.expired(entry, path):
+                path.unlink()
+                raise FileNotFoundError
+            # 更新 mtime 作為最近使用時間 (只用於 LRU 排序，不影響過期)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            self.record_stats(hit=False)
+            return None
+
+        self.hits += 1
+        self.record_stats(hit=True)
+        return entry["result"]
+
+    def put(self, key, result, model=None):
+        """以原子寫入儲存結果，之後執行淘汰"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "key": key,
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "result": result,
+        }
+        atomic_write(self.path(key), json.dumps(entry, ensure_ascii=False))
+        self.evict()
+
+    def expired(self, entry, path):
+        """以項目內的 created_at 判斷是否超過 max_age；舊格式沒有 created_at 時退回檔案 mtime"""
+        created = created_timestamp(entry)
+        if created is None:
+            created = path.stat().st_mtime
+        return time.time() - created > self.max_age
+
+    def entries(self):
+        """(path, size, mtime) 依最近使用時間由舊到新排序"""
+        if not self.cache_dir.exists():
+            return []
+        items = []
+        for path in self.cache_dir.glob("*.json"):
+            if path.name == STATS_FILE:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            items.append((path, stat.st_size, stat.st_mtime))
+        return sorted(items, key=lambda item: item[2])
+
+    def evict(self):
+        """刪除過期項目，再依 LRU 刪到總大小不超過 max_bytes；回傳刪除數量"""
+        removed = 0
+        kept = []
+        for path, size, _ in self.entries():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    expired = self.expired(json.load(f), path)
+            except (OSError, ValueError):
+                expired = True
+            if expired:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                kept.append((path, size))
+
+        total = sum(size for _, size in kept)
+        for path, size in kept:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def record_stats(self, hit):
+        """累計跨次執行的命中/未命中次數"""
+        if not self.cache_dir.exists():
+            return
+        stats_path = self.cache_dir / STATS_FILE
+        try:
+            with open(stats_path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {"hits": 0, "misses": 0}
+        stats["hits" if hit else "misses"] += 1
+        atomic_write(stats_path, json.dumps(stats))
+
+    def stats(self):
+        entries = self.entries()
+        try:
+            with open(self.cache_dir / STATS_FILE, "r", encoding="utf-8") as f:
+                lifetime = json.load(f)
+        except (OSError, ValueError):
+            lifetime = {"hits": 0, "misses": 0}
+        now = time.time()
+        return {
+            "cache_dir": str(self.cache_dir),
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "oldest_hours": round((now - entries[0][2]) / 3600, 1) if entries else None,
+            "newest_hours": round((now - entries[-1][2]) / 3600, 1) if entries else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "lifetime_hits": lifetime.get("hits", 0),
+            "lifetime_misses": lifetime.get("misses", 0),
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(f"💾 分析快取: {stats['cache_dir']}")
+        print(f"   {stats['entries']} 筆，{stats['bytes']:,} / {stats['max_bytes']:,} bytes")
+        if stats["entries"]:
+            print(f"   最舊 {stats['oldest_hours']}h，最新 {stats['newest_hours']}h 前使用")
+        print(f"   本次命中 {stats['hits']}、未命中 {stats['misses']}；"
+              f"累計命中 {stats['lifetime_hits']}、未命中 {stats['lifetime_misses']}")
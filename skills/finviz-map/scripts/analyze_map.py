@@ -5,122 +5,91 @@
 """
 
 import os
+import asyncio
+import atexit
 import sys
 import json
-import base64
 from datetime import datetime
 from pathlib import Path
 import argparse
 
+from analysis_cache import DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_BYTES, AnalysisCache
+from history_store import DEFAULT_PATH as DEFAULT_HISTORY_PATH, HistoryStore, map_type_for
+from instrumentation import add_metrics_arguments, atomic_write, finish_metrics, setup_metrics, stage
+from rate_limiter import DEFAULT_MAX_RETRIES, DEFAULT_MAX_WAIT, DEFAULT_REQUESTS_PER_MINUTE, RateLimiter
 
-def encode_image(image_path):
-    """將圖片編碼為 base64 字串"""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+def default_output_path(image_name, fmt="json"):
+    """
+    依圖片名稱決定預設輸出路徑: spy.png -> api/top_losers.json, world.png -> api/world_losers.json
+
+    fmt 為 ndjson 或 columnar 時副檔名改為 .ndjson 或 .fcol
+    """
+    stem = Path(image_name).stem
+    path = "api/top_losers.json" if stem == "spy" else f"api/{stem}_losers.json"
+    if fmt != "json":
+        from snapshot_formats import output_path_for
+        return str(output_path_for(path, fmt))
+    return path
 
 
-def analyze_with_github_models(image_path, api_token):
+def load_map_data(image_path):
     """
-    使用 GitHub Models API 分析市場地圖
+    讀取截圖程式 (--data) 存在圖片旁的地圖資料 JSON，例如 spy.png -> spy.json
 
-    GitHub Models 提供免費的 AI 模型存取，包括 GPT-4o with vision
-    詳見: https://github.com/marketplace/models
+    不存在、格式不符或比圖片舊時回傳 None。截圖程式在圖片之後才寫入資料，
+    資料較舊表示圖片是之後沒有 --data 的截圖，資料已不是這張圖片的內容
     """
-    import requests
+    data_path = Path(image_path).with_suffix(".json")
+    if not data_path.exists():
+        return None
+    image_path = Path(image_path)
+    if image_path.exists() and data_path.stat().st_mtime < image_path.stat().st_mtime:
+        print(f"⚠️  {data_path.name} 比 {image_path.name} 舊，不使用地圖資料")
+        return None
 
-    # 編碼圖片
-    base64_image = encode_image(image_path)
+    with open(data_path, 'r', encoding='utf-8') as f:
+        map_data = json.load(f)
 
-    # GitHub Models API endpoint
-    # 使用 gpt-4o 模型 (支援 vision)
-    url = "https://models.inference.ai.azure.com/chat/completions"
+    if not isinstance(map_data, dict) or not map_data.get("tiles"):
+        return None
+    return map_data
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_token}"
-    }
 
-    # 構建提示詞
-    prompt = """分析這張 Finviz 市場地圖截圖。
-
-這是一個股票市場熱力圖，每個方塊代表一個股票：
-- 紅色方塊 = 下跌的股票
-- 綠色方塊 = 上漲的股票
-- 每個方塊顯示股票代碼和漲跌幅百分比
-
-請找出跌幅最大的十檔股票（最紅/最深紅色的方塊）。如果不足十檔，則返回所有符合條件的股票。
-
-要求：
-1. 只返回 JSON 格式，不要其他文字
-2. JSON 格式如下：
-{
-  "top_losers": [
-    {"ticker": "股票代碼", "change": "跌幅百分比"},
-    ...
-  ]
-}
-
-3. 跌幅應該是負數（例如 "-2.10%"）
-4. 按跌幅從大到小排序（最大跌幅在前）
-5. 準確識別每個方塊上的文字"""
-
-    payload = {
-        "model": "gpt-4o",  # 使用支援 vision 的模型
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
-                        }
-                    }
-                ]
-            }
-        ],
-        "max_tokens": 1000,
-        "temperature": 0.1  # 降低溫度以獲得更準確的結果
-    }
+def top_losers_from_map_data(map_data, limit=10):
+    """
+    直接從地圖資料排名，不需呼叫 API
 
-    try:
-        print("📤 正在呼叫 GitHub Models API...")
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
+    除了 top_losers，也回傳 top_gainers、biggest_movers (市值變動)、
+    sectors (產業彙總) 與 breadth，作為 JSON API 的額外區段
+    """
+    from rankings import TileTable, rank_tiles
 
-        result = response.json()
-        content = result["choices"][0]["message"]["content"]
+    return rank_tiles(TileTable.from_tiles(map_data["tiles"]), limit)
 
-        print("✅ API 呼叫成功")
-        print(f"📝 回應內容:\n{content}\n")
 
-        # 嘗試解析 JSON
-        # 有時 AI 會在 JSON 外包裝 markdown 代碼區塊
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
+def analyze_with_github_models(image, api_token, cache=None, endpoint=None, **options):
+    """
+    使用 GitHub Models API 分析市場地圖
 
-        data = json.loads(content)
-        return data
+    GitHub Models 提供免費的 AI 模型存取，包括 GPT-4o with vision
+    詳見: https://github.com/marketplace/models
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ API 請求失敗: {e}")
-        if hasattr(e.response, 'text'):
-            print(f"回應內容: {e.response.text}")
-        raise
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON 解析失敗: {e}")
-        print(f"原始內容: {content}")
-        raise
+    image 可以是圖片路徑或記憶體中的 PIL Image
+    cache 為 AnalysisCache 時，同一張圖片、提示詞、模型與參數的結果直接從快取回傳
 
+    單張圖片的同步包裝，多張圖片請用 models_client.analyze_images 共用連線；
+    其他參數 (payload、stream、limiter、hedge_model...) 直接傳給 analyze_images
+    """
+    from models_client import analyze_images
+
+    result = asyncio.run(analyze_images({"image": image}, api_token, endpoint, cache=cache, **options))["image"]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
-def save_json_api(data, output_path):
-    """儲存 JSON API 回應檔案"""
+
+def api_envelope(data):
+    """補上生成時間與來源，包成 API 回應格式"""
 
     # 使用實際時間（不依賴 AI 回傳的時間）
     now = datetime.utcnow().isoformat() + "Z"
@@ -128,90 +97,371 @@ def save_json_api(data, output_path):
     data["source"] = "finviz"
 
     # 添加 API 中繼資料
-    api_response = {
+    return {
         "status": "success",
         "data": data,
         "version": "1.0",
         "last_updated": now
     }
 
-    # 儲存為美化的 JSON
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(api_response, f, indent=2, ensure_ascii=False)
+
+def save_json_api(data, output_path):
+    """儲存 JSON API 回應檔案"""
+    api_response = api_envelope(data)
+
+    # 儲存為美化的 JSON，先寫暫存檔再改名
+    with stage("save") as record:
+        text = json.dumps(api_response, indent=2, ensure_ascii=False)
+        atomic_write(output_path, text)
+        record["bytes"] = len(text.encode("utf-8"))
 
     print(f"✅ JSON API 已儲存: {output_path}")
 
     return api_response
 
 
+def record_history(history_path, map_type, data, source, tiles=None):
+    """歷史庫只新增快照，有地圖資料時連同每個方塊一起保存"""
+    with stage("history"), HistoryStore(history_path) as history:
+        return history.record(map_type, data, source, tiles=tiles)
+
+
+def save_snapshot(data, output_path, fmt, map_type, tiles=None):
+    """以 NDJSON 或二進位欄式格式儲存結果 (漲跌幅為數值)，回傳與 save_json_api 相同的 API 回應"""
+    from snapshot_formats import write_snapshot
+
+    api_response = api_envelope(data)
+    with stage("save", format=fmt) as record:
+        record["bytes"] = write_snapshot(output_path, fmt, api_response["data"], map_type, tiles)
+
+    print(f"✅ {fmt} 快照已儲存: {output_path}")
+
+    return api_response
+
+
+def analyze_locally(image_path, engine="local", ocr_top=20, workers=None):
+    """以本地方塊切割引擎 (engine="ocr" 時再加上文字辨識) 分析圖片，不需網路"""
+    from tile_engine import segment_tiles, top_losers_from_tiles
+
+    prefix = f"[{Path(image_path).name}] "
+    print(f"{prefix}🧩 使用本地方塊切割引擎...")
+    with stage("segment"):
+        tiles = segment_tiles(str(image_path))
+    print(f"{prefix}✅ 找到 {len(tiles)} 個方塊")
+
+    if engine == "ocr":
+        from tile_ocr import ocr_available, ocr_tiles
+
+        if ocr_available():
+            print(f"{prefix}🔤 辨識跌幅最大的 {ocr_top} 個方塊文字...")
+            with stage("ocr"):
+                tiles = ocr_tiles(str(image_path), tiles, ocr_top, workers)
+            checked = [tile for tile in tiles if "verified" in tile]
+            verified = sum(tile["verified"] for tile in checked)
+            print(f"{prefix}✅ OCR 完成: {verified}/{len(checked)} 個方塊與填色估計一致")
+        else:
+            print(f"{prefix}⚠️  找不到 pytesseract 或 Tesseract，只使用填色估計")
+            engine = "local"
+    return top_losers_from_tiles(tiles, engine=engine)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="使用 GitHub Models API 分析 Finviz 市場地圖"
     )
     parser.add_argument(
         "-i", "--input",
-        default="spy.png",
-        help="輸入圖片路徑 (預設: spy.png)"
+        action="append",
+        help="輸入圖片路徑，可重複指定以同時分析多張地圖 (預設: spy.png)"
     )
     parser.add_argument(
         "-o", "--output",
-        default="api/top_losers.json",
-        help="輸出 JSON 路徑 (預設: api/top_losers.json)"
+        help="輸出 JSON 路徑，只能搭配單一輸入 (預設依圖片名稱: spy.png -> api/top_losers.json, "
+             "world.png -> api/world_losers.json)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "ndjson", "columnar"],
+        default="json",
+        help="輸出格式: json (API 回應，預設)、ndjson (每行一個方塊) 或 columnar (二進位欄式 .fcol)，"
+             "後兩者的漲跌幅為數值"
     )
     parser.add_argument(
         "--token",
         help="GitHub Models API token (或使用環境變數 GITHUB_TOKEN)"
     )
+    parser.add_argument(
+        "--no-map-data",
+        action="store_true",
+        help="忽略圖片旁的地圖資料 JSON，一律使用 AI 分析圖片"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["models", "local", "ocr"],
+        default="models",
+        help="圖片分析引擎: models = GitHub Models API, local = 本地方塊切割與色階換算，"
+             "ocr = local 加上本地文字辨識讀取代碼與漲跌幅，皆不需網路 (預設: models)"
+    )
+    parser.add_argument(
+        "--ocr-top",
+        type=int,
+        default=20,
+        help="OCR 只辨識跌幅最大的前 N 個方塊 (預設: 20)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="OCR 行程數 (預設: CPU 核心數)"
+    )
+    parser.add_argument(
+        "--endpoint",
+        help="Chat completions 端點，例如本地模擬伺服器 (或使用環境變數 GITHUB_MODELS_ENDPOINT)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="同時進行的 API 請求數，也是連線池大小 (預設: 4)"
+    )
+    parser.add_argument(
+        "--payload",
+        choices=["full", "mosaic", "parts"],
+        default="full",
+        help="送給模型的圖片: full = 整張截圖, mosaic = 只裁出最紅方塊的標籤拼成一張, "
+             "parts = 同樣的裁切各自作為一個圖片部分 (預設: full)"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="以串流 (SSE) 接收回應，邊收邊解析 top_losers，取得足夠筆數就提前結束"
+    )
+    parser.add_argument(
+        "--stream-limit",
+        type=int,
+        default=10,
+        help="串流模式取得幾筆有效項目後結束請求 (預設: 10)"
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=DEFAULT_REQUESTS_PER_MINUTE,
+        help=f"每分鐘請求數上限，0 = 不限制 (預設: {DEFAULT_REQUESTS_PER_MINUTE}，gpt-4o 的 High 等級)"
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        help="每分鐘 token 數上限 (依請求大小估計，回應後以 usage 校正；預設不限制)"
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help=f"429/5xx 與連線錯誤的重試次數 (預設: {DEFAULT_MAX_RETRIES})"
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=DEFAULT_MAX_WAIT,
+        help=f"速率限制單次最長等待秒數，超過即失敗 (預設: {DEFAULT_MAX_WAIT:.0f})"
+    )
+    parser.add_argument(
+        "--hedge-model",
+        help="避險模型: 主要模型太慢時同一個請求也送給此模型，先回應且格式正確者勝出 (例如 gpt-4o-mini)"
+    )
+    parser.add_argument(
+        "--hedge-endpoint",
+        help="避險模型的端點 (預設與 --endpoint 相同)"
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=95,
+        help="主要模型超過過去延遲的此百分位數仍未回應時送出避險請求 (預設: 95)"
+    )
+    parser.add_argument(
+        "--hedge-delay",
+        type=float,
+        default=10.0,
+        help="延遲紀錄不足 5 筆時，等待幾秒後送出避險請求 (預設: 10)"
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=10,
+        help="有地圖資料時，跌幅、漲幅與市值變動排名各列出幾檔 (預設: 10)"
+    )
+    parser.add_argument(
+        "--history",
+        default=str(DEFAULT_HISTORY_PATH),
+        help="每次分析新增一筆快照的 SQLite 歷史庫 (預設: data/history.sqlite)"
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="不寫入歷史庫"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="不讀取也不寫入分析快取，一律呼叫 API"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="分析快取目錄 (預設: .cache/analysis)"
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / 1024 / 1024,
+        help=f"快取大小上限 MB，超過時刪除最久未使用的項目 (預設: {DEFAULT_MAX_BYTES // 1024 // 1024})"
+    )
+    parser.add_argument(
+        "--cache-max-age",
+        type=float,
+        default=DEFAULT_MAX_AGE_DAYS,
+        help=f"快取項目保留天數 (預設: {DEFAULT_MAX_AGE_DAYS})"
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="顯示分析快取統計後結束"
+    )
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
+    # 各個結束路徑都經過 sys.exit，在程式結束時寫出指標
+    setup_metrics(args, "analyze")
+    atexit.register(finish_metrics, args)
+
+    script_dir = Path(__file__).parent.parent.parent.parent
+
+    cache = None
+    if not args.no_cache:
+        cache = AnalysisCache(
+            args.cache_dir or script_dir / ".cache" / "analysis",
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            max_age_days=args.cache_max_age,
+        )
+    if args.cache_stats:
+        if cache is None:
+            print("💾 分析快取已停用 (--no-cache)")
+        else:
+            cache.report()
+        sys.exit(0)
+
+    inputs = args.input or ["spy.png"]
+    if args.output and len(inputs) > 1:
+        parser.error("-o/--output 只能搭配單一 --input")
+    image_paths = {name: script_dir / name for name in inputs}
+
+    # 截圖時已擷取地圖資料 (--data) 就直接排序，不需要 token 與 API 呼叫
+    map_data = {
+        name: None if args.no_map_data else load_map_data(path)
+        for name, path in image_paths.items()
+    }
+    needs_models = [
+        name for name in inputs if map_data[name] is None and args.engine == "models"
+    ]
+
     # 取得 API token
     api_token = args.token or os.environ.get("GITHUB_TOKEN")
-    if not api_token:
+    if needs_models and not api_token:
         print("❌ 錯誤: 需要 GitHub token")
         print("   方法1: --token YOUR_TOKEN")
         print("   方法2: 設定環境變數 GITHUB_TOKEN")
         sys.exit(1)
 
     # 檢查圖片是否存在
-    script_dir = Path(__file__).parent.parent.parent.parent
-    image_path = script_dir / args.input
-
-    if not image_path.exists():
-        print(f"❌ 錯誤: 找不到圖片 {image_path}")
-        sys.exit(1)
+    for name, path in image_paths.items():
+        if map_data[name] is None and not path.exists():
+            print(f"❌ 錯誤: 找不到圖片 {path}")
+            sys.exit(1)
 
     print(f"📊 Finviz 市場地圖分析器")
-    print(f"輸入圖片: {image_path}")
-    print(f"輸出路徑: {args.output}\n")
+    print(f"輸入圖片: {', '.join(str(path) for path in image_paths.values())}\n")
 
+    results = {}
+    # 每張圖片的結果來源，記錄到歷史庫
+    sources = {name: "models" for name in needs_models}
     try:
-        # 分析圖片
-        result = analyze_with_github_models(str(image_path), api_token)
-
-        # 儲存 JSON
-        output_path = script_dir / args.output
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+        for name, path in image_paths.items():
+            if map_data[name] is not None:
+                print(f"[{name}] 📈 使用地圖資料: {path.with_suffix('.json')} ({len(map_data[name]['tiles'])} 檔)")
+                with stage("rank"):
+                    results[name] = top_losers_from_map_data(map_data[name], args.top_k)
+                sources[name] = "map_data"
+            elif args.engine in ("local", "ocr"):
+                results[name] = analyze_locally(path, args.engine, args.ocr_top, args.workers)
+                sources[name] = results[name]["engine"]
+
+        if needs_models:
+            # 多張圖片共用同一個連線池同時分析
+            from models_client import analyze_images
+
+            results.update(asyncio.run(analyze_images(
+                {name: str(image_paths[name]) for name in needs_models}, api_token,
+                args.endpoint, args.concurrency,
+                cache=cache,
+                payload=args.payload,
+                stream=args.stream,
+                stream_limit=args.stream_limit,
+                limiter=RateLimiter(args.rpm, args.tpm, args.max_wait),
+                max_retries=args.max_retries,
+                hedge_model=args.hedge_model,
+                hedge_endpoint=args.hedge_endpoint,
+                hedge_delay=args.hedge_delay,
+                hedge_percentile=args.hedge_percentile,
+                latency_path=script_dir / ".cache" / "latency.json"
+            )))
+    except Exception as e:
+        print(f"\n❌ 分析失敗: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
 
-        api_response = save_json_api(result, str(output_path))
+    failed = []
+    for name in inputs:
+        result = results[name]
+        if isinstance(result, Exception):
+            print(f"\n[{name}] ❌ 分析失敗: {result}")
+            failed.append(name)
+            continue
 
-        # 顯示結果
-        print(f"\n🎉 分析完成!")
-        print(f"\n跌幅最大的股票:")
-        for i, stock in enumerate(result.get("top_losers", []), 1):
-            print(f"  {i}. {stock.get('ticker', 'N/A')}: {stock.get('change', 'N/A')}")
+        map_type = map_data[name].get("map_type", map_type_for(name)) if map_data[name] else map_type_for(name)
+        tiles = map_data[name]["tiles"] if map_data[name] else None
 
-        print(f"\n📡 API 端點已準備好:")
-        print(f"   {output_path}")
+        # 儲存 JSON (或 --format 指定的格式)
+        output_path = script_dir / (args.output or default_output_path(name, args.format))
+        if args.format == "json":
+            api_response = save_json_api(result, str(output_path))
+        else:
+            api_response = save_snapshot(result, output_path, args.format, map_type, tiles)
 
-        sys.exit(0)
+        if not args.no_history:
+            record_history(args.history, map_type, api_response["data"], sources[name], tiles)
 
-    except Exception as e:
-        print(f"\n❌ 分析失敗: {e}")
-        import traceback
-        traceback.print_exc()
+        # 顯示結果
+        print(f"\n[{name}] 跌幅最大的股票:")
+        for i, stock in enumerate(result.get("top_losers", []), 1):
+            location = f" (方塊 {stock['bbox']})" if stock.get("bbox") else ""
+            print(f"  {i}. {stock.get('ticker') or 'N/A'}: {stock.get('change', 'N/A')}{location}")
+        if result.get("top_gainers"):
+            gainers = ", ".join(f"{stock['ticker']} {stock['change']}" for stock in result["top_gainers"][:5])
+            print(f"  漲幅最大: {gainers}")
+        if result.get("sectors"):
+            breadth = result["breadth"]
+            print(f"  {len(result['sectors'])} 個產業，上漲 {breadth['advancers']} / 下跌 {breadth['decliners']}，"
+                  f"最弱: {result['sectors'][0]['sector']} ({result['sectors'][0]['weighted_change']}%)")
+        print(f"📡 API 端點已準備好: {output_path}")
+
+    if failed:
+        print(f"\n❌ 分析失敗: {', '.join(failed)}")
         sys.exit(1)
 
+    print(f"\n🎉 分析完成!")
+    sys.exit(0)
+
 
 if __name__ == "__main__":
     main()
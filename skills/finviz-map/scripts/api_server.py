@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Local API Server
+Serves the API files and snapshot-history queries from an in-memory cache,
+for dashboards that poll far more often than the data changes:
+
+    GET /api/<file>                 any file under api/ (top_losers.json, latest.json, ...)
+    GET /history/<TICKER>?days=30   one change per day
+    GET /worst/<TICKER>?days=90     the ticker's worst days (&limit=N)
+    GET /day/<YYYY-MM-DD>           that day's top losers
+    GET /frequent?days=30           most frequent top losers (&limit=N)
+    GET /events                     server-sent events whenever an API file or the history changes
+    GET /stats                      cache hits, misses and 304s
+
+Every query route takes &map=sec. Responses carry an ETag (the sha256 of the
+body, so it matches the publish_api manifest for shards) and Last-Modified
+(the source file's mtime). If-None-Match / If-Modified-Since get a bodyless
+304. Bodies are gzipped once when cached, not per request.
+
+A watcher thread stats the cached sources every --poll seconds. Writers
+(save_json_api, publish_api, the history store) replace files or commit to
+the database, which changes the mtime, size or inode, so a new snapshot is
+served, and pushed to /events, within one poll interval. Requests themselves
+never touch the disk on a cache hit.
+
+    python skills/finviz-map/scripts/api_server.py --port 8000
+    curl -i http://127.0.0.1:8000/api/top_losers.json
+    curl -N http://127.0.0.1:8000/events
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Fix Windows console encoding issues
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+from history_store import DEFAULT_PATH as DEFAULT_HISTORY_PATH, HistoryStore
+
+DEFAULT_PORT = 8000
+DEFAULT_POLL = 1.0
+DEFAULT_MAX_ENTRIES = 1024
+KEEPALIVE_SECONDS = 15
+GZIP_MIN_BYTES = 1024
+
+CONTENT_TYPES = {
+    ".json": "application/json",
+    ".ndjson": "application/x-ndjson",
+    ".fcol": "application/octet-stream",
+}
+
+# Top-level API files are watched even before anyone requests them, so
+# /events also announces snapshots that no client has fetched yet
+WATCHED_SUFFIXES = tuple(CONTENT_TYPES)
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def file_version(path):
+    """What changes when a file is rewritten or replaced; None when it's missing."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def minify(document):
+    return json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class Entry:
+    """One cached response: the body, its gzip variant and the validators."""
+
+    def __init__(self, body, content_type, source, version):
+        self.body = body
+        self.content_type = content_type
+        self.source = source
+        self.version = version
+        self.etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        self.mtime = int(version[0] // 1_000_000_000) if version else int(time.time())
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.gzip_body = None
+        self.gzip_etag = None
+        if len(body) >= GZIP_MIN_BYTES:
+            self.gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+            self.gzip_etag = self.etag[:-1] + '-gzip"'
+
+    def not_modified(self, headers):
+        """Whether the request's validators match (If-None-Match wins over If-Modified-Since)."""
+        if_none_match = headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or self.etag in tags or self.gzip_etag in tags
+        if_modified_since = headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return self.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class ResponseCache:
+    """
+    Responses keyed by route, each tied to the source file it was built from.
+
+    lookup() never touches the disk. refresh() drops entries whose source
+    changed and returns the changed sources; the watcher thread calls it
+    every poll interval.
+    """
+
+    def __init__(self, api_dir, history_path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.api_dir = Path(api_dir).resolve()
+        self.history_path = Path(history_path)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+        for path in self.watched_files():
+            self.versions[path] = file_version(path)
+
+    def watched_files(self):
+        files = [path for path in self.api_dir.glob("*") if path.suffix in WATCHED_SUFFIXES]
+        return files + [self.history_path]
+
+    def lookup(self, key):
+        """The cached entry for key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def fill(self, key, source, build):
+        """Build the entry for key from source and cache it."""
+        # Take the version before reading, so a write that lands in between
+        # leaves a stale version behind and the next refresh drops the entry
+        version = file_version(source)
+        body, content_type = build()
+        entry = Entry(body, content_type, source, version)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.versions.setdefault(source, version)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def refresh(self):
+        """Drop entries built from files that changed; returns the changed files."""
+        with self.lock:
+            sources = set(self.versions) | set(self.watched_files())
+        changed = []
+        for source in sources:
+            version = file_version(source)
+            if version != self.versions.get(source):
+                changed.append(source)
+
+        # Compare every entry, not just those of changed sources: a miss that
+        # read the old file while it was being replaced is caught here too
+        with self.lock:
+            for source in changed:
+                self.versions[source] = file_version(source)
+            stale = [key for key, entry in self.entries.items() if entry.version != self.versions.get(entry.source)]
+            for key in stale:
+                del self.entries[key]
+            self.stats["invalidations"] += len(stale)
+        return changed
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def snapshot_stats(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries)}
+
+
+class EventHub:
+    """Fan-out of server-sent events to every connected /events client."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = set()
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=100)
+        with self.lock:
+            self.clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {minify(data).decode('utf-8')}\n\n".encode("utf-8")
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # A client that stopped reading misses events instead of blocking the watcher
+                pass
+        return len(clients)
+
+
+def read_api_file(path):
+    content_type = CONTENT_TYPES.get(path.suffix) or mimetypes.guess_type(path.name)[0]
+    return path.read_bytes(), content_type or "application/octet-stream"
+
+
+def query_int(params, name, default):
+    try:
+        return int(params.get(name, [default])[0])
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FinvizMapAPI/1.0"
+    # Headers and body are separate writes; with Nagle on, keep-alive clients
+    # wait out a delayed ACK on every request
+    disable_nagle_algorithm = True
+
+    # Set by main()
+    cache = None
+    hub = None
+    verbose = False
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+    def end_headers(self):
+        # Same as GitHub Pages, so dashboards on other origins can fetch and subscribe
+        self.send_header("Access-Control-Allow-Origin", "*")
+        super().end_headers()
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        params = parse_qs(url.query)
+        if path == "/events":
+            return self.stream_events()
+        if path == "/stats":
+            return self.send_body(200, minify(self.cache.snapshot_stats()), "application/json", head)
+
+        try:
+            entry = self.route(path, params)
+        except NotFound as e:
+            return self.send_body(404, minify({"status": "error", "error": str(e)}), "application/json", head)
+        except BadRequest as e:
+            return self.send_body(400, minify({"status": "error", "error": str(e)}), "application/json", head)
+
+        if entry.not_modified(self.headers):
+            self.cache.count("not_modified")
+            self.send_response(304)
+            self.send_validators(entry)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body, etag = entry.body, entry.etag
+        use_gzip = entry.gzip_body is not None and "gzip" in self.headers.get("Accept-Encoding", "")
+        if use_gzip:
+            body, etag = entry.gzip_body, entry.gzip_etag
+        self.send_response(200)
+        self.send_header("Content-Type", entry.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_validators(entry, etag)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def route(self, path, params):
+        """The response for a route; only a cache miss reads the disk."""
+        cache = self.cache
+        if path.startswith("/api/"):
+            entry = cache.lookup(path)
+            if entry is not None:
+                return entry
+            file_path = (cache.api_dir / path[len("/api/"):]).resolve()
+            if cache.api_dir not in file_path.parents or not file_path.is_file():
+                raise NotFound(f"no such API file: {path}")
+            return cache.fill(path, file_path, lambda: read_api_file(file_path))
+
+        parts = [part for part in path.split("/") if part]
+        if not parts or parts[0] not in ("history", "worst", "day", "frequent"):
+            raise NotFound(f"no such route: {path}")
+        if parts[0] != "frequent" and len(parts) != 2:
+            raise NotFound(f"usage: /{parts[0]}/<{'date' if parts[0] == 'day' else 'ticker'}>")
+
+        map_type = params.get("map", ["sec"])[0]
+        if parts[0] == "history":
+            ticker, days = parts[1].upper(), query_int(params, "days", 30)
+            key = f"/history/{ticker}?days={days}&map={map_type}"
+            query = lambda store: {"ticker": ticker, "map_type": map_type, "days": days,
+                                   "history": store.ticker_history(ticker, days, map_type)}
+        elif parts[0] == "worst":
+            ticker, days, limit = parts[1].upper(), query_int(params, "days", 90), query_int(params, "limit", 1)
+            key = f"/worst/{ticker}?days={days}&limit={limit}&map={map_type}"
+            query = lambda store: {"ticker": ticker, "map_type": map_type, "days": days,
+                                   "worst": store.worst_days(ticker, days, map_type, limit)}
+        elif parts[0] == "day":
+            date = parts[1]
+            key = f"/day/{date}?map={map_type}"
+            query = lambda store: {"date": date, "map_type": map_type, **(store.losers_on(date, map_type) or {})}
+        else:
+            days, limit = query_int(params, "days", 30), query_int(params, "limit", 10)
+            key = f"/frequent?days={days}&limit={limit}&map={map_type}"
+            query = lambda store: {"map_type": map_type, "days": days,
+                                   "losers": store.frequent_losers(days, map_type, limit)}
+
+        entry = cache.lookup(key)
+        if entry is not None:
+            return entry
+        if not cache.history_path.exists():
+            raise NotFound(f"history database not found: {cache.history_path.name}")
+
+        def build():
+            # sqlite connections belong to one thread, and misses are rare enough to open one per miss
+            with HistoryStore(cache.history_path) as store:
+                return minify(query(store)), "application/json"
+
+        return cache.fill(key, cache.history_path, build)
+
+    def send_validators(self, entry, etag=None):
+        self.send_header("ETag", etag or entry.etag)
+        self.send_header("Last-Modified", entry.last_modified)
+        # Clients may keep the body but must revalidate, which is the cheap 304 path
+        self.send_header("Cache-Control", "no-cache")
+        if entry.gzip_body is not None:
+            self.send_header("Vary", "Accept-Encoding")
+
+    def send_body(self, status, body, content_type, head=False):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def stream_events(self):
+        client = self.hub.subscribe()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            self.wfile.write(b"retry: 3000\n\n")
+            self.wfile.flush()
+            while True:
+                try:
+                    message = client.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    message = b": keepalive\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.hub.unsubscribe(client)
+
+
+def watch(cache, hub, poll):
+    """Invalidate changed sources and announce them on /events; runs forever."""
+    while True:
+        time.sleep(poll)
+        for source in cache.refresh():
+            if source == cache.history_path:
+                version = file_version(source)
+                modified = formatdate(version[0] / 1e9 if version else time.time(), usegmt=True)
+                listeners = hub.publish("history", {"last_modified": modified})
+                print(f"🔄 History changed ({listeners} listeners notified)")
+                continue
+            path = "/api/" + source.relative_to(cache.api_dir).as_posix()
+            if not source.exists():
+                hub.publish("removed", {"path": path})
+                continue
+            # Warm the cache so the pushed ETag matches what a follow-up GET returns
+            entry = cache.fill(path, source, lambda: read_api_file(source))
+            event = {"path": path, "etag": entry.etag, "last_modified": entry.last_modified}
+            if source.suffix == ".json":
+                try:
+                    event["document"] = json.loads(entry.body)
+                except ValueError:
+                    pass
+            listeners = hub.publish("update", event)
+            print(f"🔄 {path} changed ({listeners} listeners notified)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the API files and history queries from an in-memory cache with ETags and SSE"
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to listen on (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port to listen on (default: {DEFAULT_PORT})"
+    )
+    parser.add_argument(
+        "--api-dir",
+        default="api",
+        help="API directory, relative to the project root (default: api)"
+    )
+    parser.add_argument(
+        "--history",
+        default=str(DEFAULT_HISTORY_PATH),
+        help="Snapshot history database (default: data/history.sqlite)"
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=DEFAULT_POLL,
+        help=f"Seconds between checks for changed files (default: {DEFAULT_POLL})"
+    )
+    parser.add_argument(
+        "--max-entries",
+        type=int,
+        default=DEFAULT_MAX_ENTRIES,
+        help=f"Cached responses kept before the least recently used is dropped (default: {DEFAULT_MAX_ENTRIES})"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Log every request"
+    )
+    args = parser.parse_args()
+
+    root_dir = Path(__file__).parent.parent.parent.parent.resolve()
+    api_dir = root_dir / args.api_dir
+    if not api_dir.is_dir():
+        print(f"❌ API directory not found: {api_dir}")
+        sys.exit(1)
+
+    APIHandler.cache = ResponseCache(api_dir, args.history, args.max_entries)
+    APIHandler.hub = EventHub()
+    APIHandler.verbose = args.verbose
+    threading.Thread(target=watch, args=(APIHandler.cache, APIHandler.hub, args.poll), daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), APIHandler)
+    server.daemon_threads = True
+    print(f"📡 Local API server on http://{args.host}:{args.port}")
+    print(f"API: {api_dir}")
+    print(f"History: {args.history}")
+    print(f"Watching for changes every {args.poll}s\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
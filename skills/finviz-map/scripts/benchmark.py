@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+分析引擎的效能與準確度基準測試
+對 fixtures/corpus 中已核對答案的地圖截圖執行各個引擎，回報延遲 (p50/p95)、
+記憶體、請求大小，以及代碼與漲跌幅的 precision/recall
+
+結果以 JSON 寫入 .cache/benchmarks/<commit>.json，並可用 --baseline 與之前的結果比較，
+退步時以非零狀態結束
+
+    python scripts/benchmark.py
+    python scripts/benchmark.py --engine local --engine models-mosaic --repeat 10
+    python scripts/benchmark.py --baseline .cache/benchmarks/7f563bb0a1b2.json
+
+models 引擎預設呼叫行程內啟動的 fixtures/mock_models_server.py，其回答固定來自
+fixtures/api/map_perf.ashx (與正確答案同源) 而不看圖片，因此只量測用戶端 (編碼、裁切、
+請求、解析) 的成本與請求大小，準確度回報為 N/A。
+以 --endpoint 指向正式端點並加上 --record，會把每張圖片的模型回答錄製到
+fixtures/corpus/responses/<地圖>.<引擎>.json；之後使用 mock 時改以錄製的回答計分，
+但只在請求本文與錄製時相同時採用 (裁切或提示詞改變後錄製即失效)
+
+    python scripts/benchmark.py --engine models-mosaic --endpoint https://models.inference.ai.azure.com/chat/completions --record
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from analyze_map import analyze_locally, analyze_with_github_models
+from history_store import parse_change
+from instrumentation import atomic_write, peak_rss_bytes, percentile
+from models_common import read_image_bytes
+
+SKILL_DIR = Path(__file__).parent.parent
+CORPUS_DIR = SKILL_DIR / "fixtures" / "corpus"
+REPO_ROOT = SKILL_DIR.parent.parent
+
+ENGINES = ["models", "models-mosaic", "local", "ocr"]
+MODELS_ENGINES = ("models", "models-mosaic")
+
+# 漲跌幅以兩位小數顯示，誤差在此範圍內視為相同
+DEFAULT_TOLERANCE = 0.01
+
+# 與基準比較時，p50 延遲變慢超過此倍數、請求大小增加超過此比例視為退步
+DEFAULT_MAX_SLOWDOWN = 1.25
+MAX_PAYLOAD_GROWTH = 0.10
+
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    """讀取 manifest.json，回傳 [{"name", "image" (絕對路徑), "top_losers"}, ...]"""
+    corpus_dir = Path(corpus_dir)
+    with open(corpus_dir / "manifest.json", "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    maps = []
+    for entry in manifest["maps"]:
+        maps.append({**entry, "image": corpus_dir / entry["image"], "responses": corpus_dir / "responses"})
+    return maps
+
+
+def recording_path(entry, engine):
+    return Path(entry["responses"]) / f"{entry['name']}.{engine}.json"
+
+
+def load_recording(entry, engine, request_sha256):
+    """
+    讀取錄製的模型回答
+
+    Returns:
+        top_losers 列表；沒有錄製或錄製時的請求本文不同 (已失效) 時回傳 None
+    """
+    try:
+        with open(recording_path(entry, engine), "r", encoding="utf-8") as f:
+            recording = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if recording.get("request_sha256") != request_sha256:
+        return None
+    return recording.get("top_losers", [])
+
+
+def save_recording(entry, engine, request_sha256, result, endpoint):
+    recording = {
+        "request_sha256": request_sha256,
+        "endpoint": endpoint,
+        "recorded_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "top_losers": result.get("top_losers", []),
+    }
+    atomic_write(recording_path(entry, engine), json.dumps(recording, indent=2, ensure_ascii=False) + "\n")
+
+
+def git_commit():
+    """(HEAD 提交雜湊, 工作區是否有未提交的變更)，不在 git 中時為 (None, None)"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=SKILL_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=SKILL_DIR, capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def score(predicted, expected, tolerance=DEFAULT_TOLERANCE):
+    """
+    比對預測與正確答案的命中數
+
+    ticker: 代碼相同；change: 不看代碼，漲跌幅一對一配對；
+    pair: 代碼相同且漲跌幅在誤差內
+    """
+    predictions = [((entry.get("ticker") or "").strip().upper(), parse_change(entry.get("change")))
+                   for entry in predicted]
+    answers = {entry["ticker"]: parse_change(entry["change"]) for entry in expected}
+
+    tickers = {ticker for ticker, _ in predictions if ticker}
+    remaining = list(answers.values())
+    change_hits = 0
+    for _, change in predictions:
+        if change is None:
+            continue
+        match = next((value for value in remaining if abs(value - change) <= tolerance + 1e-9), None)
+        if match is not None:
+            remaining.remove(match)
+            change_hits += 1
+
+    pair_hits = sum(
+        1 for ticker, change in predictions
+        if ticker in answers and change is not None and abs(answers[ticker] - change) <= tolerance + 1e-9
+    )
+    return {
+        "predicted": len(predictions),
+        "expected": len(answers),
+        "ticker_hits": len(tickers & set(answers)),
+        "change_hits": change_hits,
+        "pair_hits": pair_hits,
+    }
+
+
+def precision_recall(counts, kind):
+    """整體的 precision/recall；沒有可計分的地圖時回傳 None (N/A)"""
+    if not counts:
+        return None
+    hits = sum(c[f"{kind}_hits"] for c in counts)
+    predicted = sum(c["predicted"] for c in counts)
+    expected = sum(c["expected"] for c in counts)
+    return {
+        "precision": round(hits / predicted, 4) if predicted else 0.0,
+        "recall": round(hits / expected, 4) if expected else 0.0,
+    }
+
+
+@contextlib.contextmanager
+def mock_endpoint():
+    """在背景執行緒啟動 mock_models_server，回傳其端點"""
+    from http.server import ThreadingHTTPServer
+
+    sys.path.insert(0, str(SKILL_DIR / "fixtures"))
+    from mock_models_server import MockModelsHandler
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockModelsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def engine_runner(engine, endpoint, token):
+    """回傳 (分析函式, 請求本文函式)；引擎無法使用時回傳 (None, 原因)"""
+    if engine in MODELS_ENGINES:
+        from models_client import ModelsClient
+        from rate_limiter import RateLimiter
+
+        payload = "mosaic" if engine == "models-mosaic" else "full"
+
+        def run(image):
+            # 基準測試不受本地速率限制影響，也不重試
+            return analyze_with_github_models(
+                str(image), token, endpoint=endpoint, payload=payload,
+                limiter=RateLimiter(None), max_retries=0
+            )
+
+        def request_body(image):
+            return ModelsClient(token, endpoint, payload=payload).build_body(read_image_bytes(str(image)))
+
+        return run, request_body
+
+    if engine == "ocr":
+        from tile_ocr import ocr_available
+
+        if not ocr_available():
+            return None, "找不到 pytesseract 或 Tesseract"
+
+    return (lambda image: analyze_locally(image, engine)), None
+
+
+def benchmark_engine(engine, corpus, endpoint, token, repeat, warmup, tolerance, verbose,
+                     mock=False, record=False):
+    """
+    對整個語料執行一個引擎，回傳結果 dict
+
+    mock: models 引擎呼叫的是 mock 端點，其回答與圖片無關，只以錄製的回答計分，
+    沒有有效錄製的地圖不計入準確度；record: 把 models 引擎的回答錄製下來
+    """
+    run, body_fn = engine_runner(engine, endpoint, token)
+    if run is None:
+        return {"skipped": body_fn}
+
+    quiet = contextlib.nullcontext if verbose else (lambda: contextlib.redirect_stdout(io.StringIO()))
+    latencies = []
+    memory_peaks = []
+    payloads = []
+    counts = []
+    per_map = []
+
+    for entry in corpus:
+        image = entry["image"]
+        samples = []
+        with quiet():
+            for _ in range(warmup):
+                run(image)
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = run(image)
+                samples.append(time.perf_counter() - started)
+
+            # 另外跑一次量測記憶體，tracemalloc 會拖慢計時
+            tracemalloc.start()
+            run(image)
+            memory_peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            body = body_fn(image) if body_fn else None
+
+        predicted = result.get("top_losers", [])
+        accuracy = "live"
+        if body is not None:
+            request_sha256 = hashlib.sha256(body).hexdigest()
+            if mock:
+                predicted = load_recording(entry, engine, request_sha256)
+                accuracy = "replay" if predicted is not None else "n/a"
+            elif record:
+                save_recording(entry, engine, request_sha256, result, endpoint)
+
+        latencies.extend(samples)
+        payload = len(body) if body is not None else None
+        if payload is not None:
+            payloads.append(payload)
+        counted = {}
+        if predicted is not None:
+            counted = score(predicted, entry["top_losers"], tolerance)
+            counts.append(counted)
+        per_map.append({
+            "name": entry["name"],
+            "p50_seconds": round(percentile(samples, 0.5), 4),
+            "payload_bytes": payload,
+            "accuracy": accuracy,
+            **counted,
+        })
+
+    return {
+        "runs": len(latencies),
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.5), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "mean": round(sum(latencies) / len(latencies), 4),
+            "min": round(min(latencies), 4),
+            "max": round(max(latencies), 4),
+        },
+        "tracemalloc_peak_bytes": max(memory_peaks),
+        "payload_bytes": sum(payloads) // len(payloads) if payloads else None,
+        "scored_maps": len(counts),
+        "ticker": precision_recall(counts, "ticker"),
+        "change": precision_recall(counts, "change"),
+        "pair": precision_recall(counts, "pair"),
+        "maps": per_map,
+    }
+
+
+def compare(results, baseline, max_slowdown=DEFAULT_MAX_SLOWDOWN):
+    """與之前的結果比較，回傳退步項目的說明列表"""
+    regressions = []
+    for engine, current in results["engines"].items():
+        previous = baseline.get("engines", {}).get(engine)
+        if not previous or "skipped" in previous or "skipped" in current:
+            continue
+
+        before = previous["latency_seconds"]["p50"]
+        after = current["latency_seconds"]["p50"]
+        if before and after / before > max_slowdown:
+            regressions.append(f"{engine}: p50 {before:.3f}s → {after:.3f}s ({after / before:.2f}×)")
+
+        before = previous.get("payload_bytes")
+        after = current.get("payload_bytes")
+        if before and after and after / before - 1 > MAX_PAYLOAD_GROWTH:
+            regressions.append(f"{engine}: 請求大小 {before:,} → {after:,} bytes")
+
+        for kind in ("ticker", "change", "pair"):
+            for metric in ("precision", "recall"):
+                if not previous.get(kind) or not current.get(kind):
+                    continue
+                before = previous[kind][metric]
+                after = current[kind][metric]
+                if after < before - 1e-4:
+                    regressions.append(f"{engine}: {kind} {metric} {before:.3f} → {after:.3f}")
+    return regressions
+
+
+def format_accuracy(metrics):
+    if metrics is None:
+        return f"{'N/A':>13}"
+    return f"{metrics['precision']:>8.2f}/{metrics['recall']:.2f}"
+
+
+def print_summary(results):
+    print(f"\n{'引擎':<15}{'p50':>9}{'p95':>9}{'記憶體':>11}{'請求':>11}"
+          f"{'代碼 P/R':>13}{'漲跌幅 P/R':>13}")
+    for engine, result in results["engines"].items():
+        if "skipped" in result:
+            print(f"{engine:<15}略過: {result['skipped']}")
+            continue
+        latency = result["latency_seconds"]
+        payload = f"{result['payload_bytes'] / 1024:.0f}KB" if result["payload_bytes"] else "-"
+        print(f"{engine:<15}{latency['p50']:>8.3f}s{latency['p95']:>8.3f}s"
+              f"{result['tracemalloc_peak_bytes'] / 1024 / 1024:>9.1f}MB{payload:>11}"
+              f"{format_accuracy(result['ticker'])}{format_accuracy(result['change'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析引擎的效能與準確度基準測試")
+    parser.add_argument(
+        "--engine",
+        action="append",
+        choices=ENGINES,
+        help=f"要測試的引擎，可重複指定 (預設: 全部，{', '.join(ENGINES)})"
+    )
+    parser.add_argument("--corpus", default=str(CORPUS_DIR), help="語料目錄 (含 manifest.json)")
+    parser.add_argument("--repeat", type=int, default=5, help="每張圖片計時的次數 (預設: 5)")
+    parser.add_argument("--warmup", type=int, default=1, help="計時前的暖身次數 (預設: 1)")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f"漲跌幅視為相同的誤差 (預設: {DEFAULT_TOLERANCE})"
+    )
+    parser.add_argument(
+        "--endpoint",
+        help="models 引擎的端點 (預設: 行程內的 mock_models_server)"
+    )
+    parser.add_argument("--token", help="API token (預設: 環境變數 GITHUB_TOKEN，使用 mock 時不需要)")
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="把 --endpoint 的回答錄製到語料的 responses/，供之後以 mock 計分"
+    )
+    parser.add_argument("-o", "--output", help="結果 JSON 路徑 (預設: .cache/benchmarks/<commit>.json)")
+    parser.add_argument("--baseline", help="之前的結果 JSON，退步時以狀態 1 結束")
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=DEFAULT_MAX_SLOWDOWN,
+        help=f"p50 延遲可接受的變慢倍數 (預設: {DEFAULT_MAX_SLOWDOWN})"
+    )
+    parser.add_argument("--verbose", action="store_true", help="顯示引擎本身的輸出")
+    args = parser.parse_args()
+
+    engines = args.engine or ENGINES
+    if args.record and not args.endpoint:
+        parser.error("--record 需要 --endpoint (mock 的回答與圖片無關，不能錄製)")
+    corpus = load_corpus(args.corpus)
+    # 先讀取基準，結果可能寫到同一個檔案
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    commit, dirty = git_commit()
+    print(f"📏 基準測試: {len(corpus)} 張地圖 × {args.repeat} 次，引擎: {', '.join(engines)}")
+    print(f"   提交: {commit[:12] if commit else '未知'}{' (有未提交的變更)' if dirty else ''}")
+
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": [entry["name"] for entry in corpus],
+        "repeat": args.repeat,
+        "tolerance": args.tolerance,
+        "endpoint": args.endpoint or "mock",
+        "engines": {},
+    }
+
+    needs_models = any(engine.startswith("models") for engine in engines)
+    with (contextlib.nullcontext(args.endpoint) if args.endpoint or not needs_models
+          else mock_endpoint()) as endpoint:
+        token = args.token or os.environ.get("GITHUB_TOKEN") or "benchmark"
+        for engine in engines:
+            print(f"⏱️  {engine}...")
+            results["engines"][engine] = benchmark_engine(
+                engine, corpus, endpoint, token, args.repeat, args.warmup, args.tolerance, args.verbose,
+                mock=not args.endpoint, record=args.record
+            )
+
+    results["peak_rss_bytes"] = peak_rss_bytes()
+    print_summary(results)
+
+    output = Path(args.output) if args.output else (
+        REPO_ROOT / ".cache" / "benchmarks" / f"{(commit or 'unknown')[:12]}{'-dirty' if dirty else ''}.json"
+    )
+    atomic_write(output, json.dumps(results, indent=2, ensure_ascii=False) + "\n")
+    print(f"\n💾 結果已儲存: {output}")
+
+    if baseline is not None:
+        print(f"🔍 與 {(baseline.get('commit') or '未知')[:12]} 比較...")
+        regressions = compare(results, baseline, args.max_slowdown)
+        if regressions:
+            for regression in regressions:
+                print(f"   ❌ {regression}")
+            sys.exit(1)
+        print("   ✅ 沒有退步")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,30 @@ Finviz Map Canvas Screenshot - Playwright Version
 """
 
 import argparse
+import asyncio
+import atexit
+import base64
+import json
 import sys
 import subprocess
 import time
 import os
 import io
+import random
+from datetime import datetime, timezone
 from pathlib import Path
+from urllib.parse import urlsplit
 
-# Fix Windows console encoding issues
+from history_store import DEFAULT_PATH as DEFAULT_HISTORY_PATH
+from instrumentation import add_metrics_arguments, atomic_write, finish_metrics, setup_metrics, stage
+
+# Fix Windows console encoding issues. reconfigure() changes the streams in
+# place: replacing them with new wrappers would close the shared buffer when
+# this module is imported a second time (capture_server under --serve,
+# postprocess_images --html) and the first wrapper is garbage-collected
 if sys.platform == 'win32':
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
 
 
 def check_dependencies():
@@ -46,172 +59,1064 @@ def check_dependencies():
             subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"], check=True)
 
 
-def capture_finviz_canvas_playwright(map_type="sec", output_path="spy.png", headless=True):
+CANVAS_SELECTOR = 'canvas, #canvas-wrapper canvas, .canvas-wrapper canvas'
+
+# True once the Cloudflare interstitial has been replaced by the real page
+CHALLENGE_CLEARED_JS = """
+() => {
+    const title = document.title || '';
+    if (/just a moment|attention required|checking your browser/i.test(title)) {
+        return false;
+    }
+    const challenge = document.querySelector(
+        '#challenge-running, #challenge-form, #cf-challenge-running, ' +
+        '.cf-browser-verification, iframe[src*="challenges.cloudflare.com"]'
+    );
+    return !challenge && document.readyState !== 'loading';
+}
+"""
+
+# Resolves true once the canvas has drawn the same non-blank pixels for
+# `frames` consecutive animation frames, false if `timeout` ms pass first.
+CANVAS_STABLE_JS = """
+async (canvas, {frames, timeout}) => {
+    const probe = document.createElement('canvas');
+    probe.width = 64;
+    probe.height = 64;
+    const ctx = probe.getContext('2d', {willReadFrequently: true});
+
+    const fingerprint = () => {
+        if (!canvas.width || !canvas.height) return null;
+        ctx.clearRect(0, 0, 64, 64);
+        ctx.drawImage(canvas, 0, 0, 64, 64);
+        const data = ctx.getImageData(0, 0, 64, 64).data;
+        let hash = 2166136261;
+        let painted = false;
+        for (let i = 0; i < data.length; i++) {
+            hash = Math.imul(hash ^ data[i], 16777619);
+            if ((i & 3) === 3 && data[i]) painted = true;
+        }
+        return painted ? hash >>> 0 : null;
+    };
+
+    const started = performance.now();
+    let last = null;
+    let streak = 0;
+    while (performance.now() - started < timeout) {
+        await new Promise(resolve => requestAnimationFrame(resolve));
+        let current;
+        try {
+            current = fingerprint();
+        } catch (e) {
+            // Tainted canvas: pixels cannot be read, fall back to frame count
+            current = 'tainted';
+        }
+        if (current !== null && current === last) {
+            if (++streak >= frames) return true;
+        } else {
+            streak = 0;
+        }
+        last = current;
+    }
+    return false;
+}
+"""
+
+
+MAP_URLS = {
+    "sec": "https://finviz.com/map.ashx",
+    "world": "https://finviz.com/map.ashx?t=geo",
+    "etf": "https://finviz.com/map.ashx?t=etf",
+    "crypto": "https://finviz.com/map.ashx?t=crypto"
+}
+
+# Map type to filename mapping
+FILENAME_MAP = {
+    "sec": "spy.png",      # S&P 500 -> SPY ETF ticker
+    "world": "world.png",
+    "etf": "etf.png",
+    "crypto": "crypto.png"
+}
+
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-blink-features=AutomationControlled',
+    '--disable-dev-shm-usage',
+    '--disable-web-security',
+    '--disable-features=IsolateOrigins,site-per-process',
+]
+
+CONTEXT_OPTIONS = {
+    "viewport": {'width': 1920, 'height': 1080},
+    "user_agent": 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    "locale": 'en-US',
+    "timezone_id": 'America/New_York',
+    "permissions": ['geolocation'],
+    "color_scheme": 'dark',
+}
+
+ANTI_DETECTION_JS = """
+    // Remove webdriver property
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+    
+    // Mock plugins
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5]
+    });
+    
+    // Mock languages
+    Object.defineProperty(navigator, 'languages', {
+        get: () => ['en-US', 'en']
+    });
+"""
+
+CLEAR_HOVER_JS = """
+    // Hide all high z-index elements (tooltips, popups)
+    document.querySelectorAll('*').forEach(el => {
+        const style = window.getComputedStyle(el);
+        const zIndex = parseInt(style.zIndex) || 0;
+        if (zIndex > 100) {
+            el.style.display = 'none';
+        }
+    });
+    
+    // Trigger mouseout on canvas
+    const canvas = document.querySelector('canvas');
+    if (canvas) {
+        const event = new MouseEvent('mouseout', {
+            view: window,
+            bubbles: true,
+            cancelable: true
+        });
+        canvas.dispatchEvent(event);
+    }
+"""
+
+# Raw RGBA backing store of the canvas, base64-encoded so it crosses the
+# protocol as one string instead of a JSON array of numbers. Canvases
+# without a 2D context (WebGL) are copied into a 2D canvas first.
+CANVAS_PIXELS_JS = """
+(canvas) => {
+    const width = canvas.width;
+    const height = canvas.height;
+    let ctx = canvas.getContext('2d');
+    if (!ctx) {
+        const copy = document.createElement('canvas');
+        copy.width = width;
+        copy.height = height;
+        ctx = copy.getContext('2d');
+        ctx.drawImage(canvas, 0, 0);
+    }
+    const data = ctx.getImageData(0, 0, width, height).data;
+    const chunks = [];
+    for (let i = 0; i < data.length; i += 0x8000) {
+        chunks.push(String.fromCharCode.apply(null, data.subarray(i, i + 0x8000)));
+    }
+    return {width, height, data: btoa(chunks.join(''))};
+}
+"""
+
+# Default request routing for --block: resource types and domains the map
+# canvas never needs. Allowed domains win over both deny rules so the
+# Cloudflare challenge keeps working.
+DEFAULT_BLOCK_TYPES = ["image", "media", "font"]
+DEFAULT_BLOCK_DOMAINS = [
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googletagservices.com",
+    "googletagmanager.com",
+    "google-analytics.com",
+    "adservice.google.com",
+    "amazon-adsystem.com",
+    "adnxs.com",
+    "criteo.com",
+    "pubmatic.com",
+    "rubiconproject.com",
+    "taboola.com",
+    "outbrain.com",
+    "scorecardresearch.com",
+    "quantserve.com",
+    "facebook.net",
+    "hotjar.com",
+]
+DEFAULT_ALLOW_DOMAINS = ["challenges.cloudflare.com"]
+
+# Exit code for --exit-unchanged when no map differs from the previous snapshot
+EXIT_UNCHANGED = 3
+
+# Escalation for each retry of a failed capture: reload the same page,
+# then start over in a fresh context, then in a freshly launched browser
+RETRY_STEPS = ["reload", "context", "browser"]
+
+# URL fragments of the JSON the map page downloads to draw the canvas:
+# the sector/industry/ticker tree with market caps and the % changes
+MAP_DATA_URL_PATTERNS = ["/maps/", "map_perf"]
+
+
+def remaining_ms(deadline):
+    """Milliseconds left until a time.monotonic() deadline (at least 1, since 0 disables Playwright timeouts)."""
+    return max(1, int((deadline - time.monotonic()) * 1000))
+
+
+async def timed_wait(label, wait_fn, timings, map_type=None):
+    """Await a wait step, record its duration in `timings` and the metrics trace, and report it."""
+    prefix = f"[{map_type}] " if map_type else ""
+    started = time.monotonic()
+    try:
+        with stage(label, map=map_type):
+            return await wait_fn()
+    finally:
+        elapsed = time.monotonic() - started
+        timings[label] = round(elapsed, 3)
+        print(f"{prefix}⏱️  {label}: {elapsed:.2f}s")
+
+
+async def wait_for_challenge(page, deadline):
+    """Wait until the Cloudflare challenge page is gone."""
+    await page.wait_for_function(CHALLENGE_CLEARED_JS, timeout=remaining_ms(deadline), polling=250)
+
+
+async def wait_for_canvas(page, deadline):
+    """Wait for the map canvas element to be attached and visible."""
+    return await page.wait_for_selector(CANVAS_SELECTOR, state='visible', timeout=remaining_ms(deadline))
+
+
+async def wait_for_canvas_stable(canvas, deadline, frames=3):
     """
-    Capture Finviz map canvas element as screenshot using Playwright.
+    Wait until the canvas pixels stop changing across `frames` animation frames.
 
-    Args:
-        map_type: Type of map (sec, world, etf, crypto)
-        output_path: Path to save the screenshot
-        headless: Run in headless mode (default: True)
+    Returns:
+        True if the canvas settled before the deadline, False otherwise
+    """
+    return await canvas.evaluate(CANVAS_STABLE_JS, {"frames": frames, "timeout": remaining_ms(deadline)})
+
+
+def load_storage_state(path, max_age_hours):
+    """
+    Return `path` if it holds a storage state younger than `max_age_hours`.
+
+    Prints a cache hit or miss (with the reason) and returns None on a miss,
+    so the caller falls back to a fresh context and the full challenge wait.
+    """
+    if not path:
+        return None
+
+    path = Path(path)
+    if not path.exists():
+        print(f"🍪 Storage state cache miss: {path} not found")
+        return None
+
+    age_hours = (time.time() - path.stat().st_mtime) / 3600
+    if age_hours > max_age_hours:
+        print(f"🍪 Storage state cache miss: expired ({age_hours:.1f}h old, max {max_age_hours}h)")
+        return None
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"🍪 Storage state cache miss: unreadable ({e})")
+        return None
+
+    print(f"🍪 Storage state cache hit: {path} ({age_hours:.1f}h old)")
+    return str(path)
+
+
+async def save_storage_state(context, path):
+    """Write the context's cookies and localStorage to `path` atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    state = await context.storage_state()
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    if sys.platform != 'win32':
+        os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+    print(f"🍪 Storage state saved: {path} ({len(state.get('cookies', []))} cookies)")
+
+
+async def read_canvas_pixels(canvas):
+    """
+    Read the canvas backing store as raw RGBA bytes.
 
     Returns:
-        True if successful, False otherwise
+        (width, height, rgba_bytes) with rows packed top to bottom
     """
-    check_dependencies()
+    pixels = await canvas.evaluate(CANVAS_PIXELS_JS)
+    return pixels["width"], pixels["height"], base64.b64decode(pixels["data"])
+
 
-    from playwright.sync_api import sync_playwright
+def pixels_to_image(width, height, rgba):
+    """Wrap raw RGBA bytes as a PIL image that shares the buffer (no copy)."""
     from PIL import Image
-    import io as iolib
-
-    # Map type URLs
-    map_urls = {
-        "sec": "https://finviz.com/map.ashx",
-        "world": "https://finviz.com/map.ashx?t=geo",
-        "etf": "https://finviz.com/map.ashx?t=etf",
-        "crypto": "https://finviz.com/map.ashx?t=crypto"
-    }
 
-    url = map_urls.get(map_type, map_urls["sec"])
+    return Image.frombuffer('RGBA', (width, height), rgba, 'raw', 'RGBA', 0, 1)
 
-    print(f"📊 Finviz Canvas Screenshot (Playwright)")
-    print(f"Map type: {map_type}")
-    print(f"URL: {url}")
-    print(f"Output: {output_path}")
-    print(f"Headless: {headless}\n")
 
+async def grab_canvas_frame(canvas, map_type=None):
+    """
+    Read the rendered canvas straight from its backing store as a PIL image.
+
+    Falls back to an element screenshot when the pixels cannot be read,
+    e.g. a canvas tainted by cross-origin images.
+    """
+    prefix = f"[{map_type}] " if map_type else ""
     try:
-        with sync_playwright() as p:
-            # Launch browser with anti-detection settings
-            print("🔧 Launching Chromium browser...")
-            browser = p.chromium.launch(
-                headless=headless,
-                args=[
-                    '--no-sandbox',
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-dev-shm-usage',
-                    '--disable-web-security',
-                    '--disable-features=IsolateOrigins,site-per-process',
-                ]
-            )
-            
-            # Create context with realistic settings
-            context = browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                locale='en-US',
-                timezone_id='America/New_York',
-                permissions=['geolocation'],
-                color_scheme='dark',
-            )
-            
-            # Additional anti-detection measures
-            context.add_init_script("""
-                // Remove webdriver property
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-                
-                // Mock plugins
-                Object.defineProperty(navigator, 'plugins', {
-                    get: () => [1, 2, 3, 4, 5]
-                });
-                
-                // Mock languages
-                Object.defineProperty(navigator, 'languages', {
-                    get: () => ['en-US', 'en']
-                });
-            """)
-            
-            page = context.new_page()
-            
-            # Navigate to Finviz map
-            print("🌐 Loading Finviz map page...")
-            page.goto(url, wait_until='domcontentloaded', timeout=60000)
-            
-            # Wait for Cloudflare verification
-            print("⏳ Waiting for Cloudflare verification (45 seconds)...")
-            time.sleep(45)
-            
-            # Check if page loaded successfully
+        with stage("pixels", map=map_type) as record:
+            width, height, rgba = await read_canvas_pixels(canvas)
+            record["bytes"] = len(rgba)
+        return pixels_to_image(width, height, rgba)
+    except Exception as e:
+        from PIL import Image
+
+        print(f"{prefix}⚠️  Could not read canvas pixels ({e}), using screenshot")
+        with stage("screenshot", map=map_type) as record:
+            png = await canvas.screenshot(type='png')
+            record["bytes"] = len(png)
+        return Image.open(io.BytesIO(png))
+
+
+class MapDataCollector:
+    """
+    Keep the page's map data responses so they can be saved as normalized JSON.
+
+    Responses are only recorded while the page loads; bodies are read
+    afterwards with collect(), once the canvas has rendered.
+    """
+
+    def __init__(self, patterns=MAP_DATA_URL_PATTERNS):
+        self.patterns = list(patterns)
+        self.responses = []
+
+    def on_response(self, response):
+        if response.ok and any(p in response.url for p in self.patterns):
+            self.responses.append(response)
+
+    async def collect(self):
+        """Return (url, parsed JSON) for every recorded response that held JSON."""
+        payloads = []
+        for response in self.responses:
             try:
-                page_title = page.title()
-                print(f"✓ Page loaded: {page_title}")
-            except:
-                print("⚠️  Could not get page title")
-            
-            # Wait for canvas element
-            print("🔍 Looking for canvas element...")
+                payloads.append((response.url, json.loads(await response.body())))
+            except Exception:
+                continue
+        return payloads
+
+
+def walk_map_tree(node, path, tiles):
+    """Collect the leaves of a Finviz map tree ({name, children|value}) with their ancestors."""
+    children = node.get("children")
+    if not children:
+        tiles[node.get("name")] = {
+            "sector": path[0] if len(path) > 0 else None,
+            "industry": path[1] if len(path) > 1 else None,
+            "market_cap": node.get("value"),
+        }
+        return
+    for child in children:
+        walk_map_tree(child, path + [child.get("name")], tiles)
+
+
+def normalize_map_data(map_type, payloads):
+    """
+    Merge the map structure and performance payloads into one tile list.
+
+    Structure payloads are trees of {name, children} ending in {name, value}
+    (value = market cap); performance payloads hold {"nodes": {ticker: %change}}.
+
+    Returns:
+        Dict with map_type, captured_at, sources and tiles sorted by change
+    """
+    structure = {}
+    changes = {}
+    for url, payload in payloads:
+        if not isinstance(payload, dict):
+            continue
+        if isinstance(payload.get("nodes"), dict):
+            changes.update(payload["nodes"])
+        elif "children" in payload:
+            # The root node is the map itself, not a sector
+            for child in payload["children"]:
+                walk_map_tree(child, [child.get("name")], structure)
+
+    tiles = []
+    for ticker, change in changes.items():
+        if not isinstance(change, (int, float)):
+            continue
+        info = structure.get(ticker, {})
+        tiles.append({
+            "ticker": ticker,
+            "sector": info.get("sector"),
+            "industry": info.get("industry"),
+            "market_cap": info.get("market_cap"),
+            "change": round(float(change), 2),
+        })
+    tiles.sort(key=lambda tile: tile["change"])
+
+    return {
+        "map_type": map_type,
+        "captured_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "sources": [url for url, _ in payloads],
+        "tiles": tiles,
+    }
+
+
+def save_map_data(data, data_path, prefix=""):
+    """
+    Write normalized map data to `data_path`, or remove it when there are no tiles.
+
+    Called after the PNG is saved, so a data file is never older than the
+    image it describes; analyze_map ignores data older than its image. A
+    file left by an earlier capture would describe a different map state,
+    so it is removed rather than kept next to the new PNG.
+
+    Returns:
+        Number of bytes written (0 when nothing was written)
+    """
+    data_path = Path(data_path)
+    if data is None or not data["tiles"]:
+        if data_path.exists():
+            data_path.unlink()
+            print(f"{prefix}🧹 Removed stale map data: {data_path}")
+        return 0
+    text = json.dumps(data, indent=2, ensure_ascii=False)
+    atomic_write(data_path, text)
+    print(f"{prefix}✓ Map data saved: {data_path} ({len(data['tiles'])} tiles)")
+    return len(text.encode("utf-8"))
+
+
+def change_channel(image, size):
+    """
+    Downscale `image` to one 8-bit channel that tracks the map's colors.
+
+    Finviz reds and greens have nearly the same luminance (e.g. -3% and
+    +2% tiles), so plain grayscale would hide most changes; red minus
+    green keeps the % change signal.
+    """
+    from PIL import Image, ImageChops
+
+    red, green, _ = image.convert('RGB').split()
+    channel = ImageChops.subtract(red, green, scale=2, offset=128)
+    return channel.resize(size, Image.BILINEAR).tobytes()
+
+
+def perceptual_hash(image, hash_size=16):
+    """
+    dHash + aHash of a map image as one hex string (2 * hash_size² bits).
+
+    Re-encoding or resizing the same map moves only a bit or two; a tile
+    that changes color flips several.
+    """
+    # dHash: is each pixel brighter than its right neighbour?
+    pixels = change_channel(image, (hash_size + 1, hash_size))
+    dhash = 0
+    for y in range(hash_size):
+        row = pixels[y * (hash_size + 1):(y + 1) * (hash_size + 1)]
+        for x in range(hash_size):
+            dhash = (dhash << 1) | (row[x] > row[x + 1])
+
+    # aHash: is each pixel brighter than the mean?
+    pixels = change_channel(image, (hash_size, hash_size))
+    mean = sum(pixels) / len(pixels)
+    ahash = 0
+    for value in pixels:
+        ahash = (ahash << 1) | (value > mean)
+
+    digits = hash_size * hash_size // 4
+    return f"{dhash:0{digits}x}{ahash:0{digits}x}"
+
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two perceptual_hash() strings."""
+    if len(hash_a) != len(hash_b):
+        return None
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+def file_perceptual_hash(path, hash_size=16):
+    """perceptual_hash() of an image file, or None if it is missing or unreadable."""
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            return perceptual_hash(image, hash_size)
+    except (OSError, ValueError):
+        return None
+
+
+def load_snapshot_hashes(path):
+    """Map type -> {"hash", "saved_at"} from the hash sidecar file, or {} if it is missing or unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return hashes if isinstance(hashes, dict) else {}
+
+
+def previous_snapshot_hashes(png_paths, hash_path, hash_size=16):
+    """
+    Hash of each map's previous snapshot, from the sidecar or the PNG on disk.
+
+    --no-png runs don't rewrite the PNG, so it can be older than the last
+    snapshot; the sidecar records every hashed run. Whichever of the two was
+    written last wins, so a PNG captured later without --detect-changes
+    still counts.
+    """
+    saved = load_snapshot_hashes(hash_path)
+    previous = {}
+    for map_type, path in png_paths.items():
+        entry = saved.get(map_type)
+        png_mtime = path.stat().st_mtime if path.exists() else None
+        if png_mtime is not None and (not isinstance(entry, dict) or png_mtime > entry.get("saved_at", 0)):
+            previous[map_type] = file_perceptual_hash(path, hash_size)
+        elif isinstance(entry, dict):
+            previous[map_type] = entry.get("hash")
+    return previous
+
+
+def save_snapshot_hashes(path, changes):
+    """Record each map's new hash in the sidecar, keeping entries of other maps."""
+    hashes = load_snapshot_hashes(path)
+    now = time.time()
+    for map_type, change in changes.items():
+        if change["hash"] is not None:
+            hashes[map_type] = {"hash": change["hash"], "saved_at": now}
+    atomic_write(path, json.dumps(hashes, indent=2))
+
+
+def detect_changes(previous_hashes, current_images, threshold=2, hash_size=16):
+    """
+    Compare each map's new image with the previous snapshot's hash.
+
+    Args:
+        previous_hashes: Dict of map type -> hash of the previous snapshot (may be missing)
+        current_images: Dict of map type -> PIL image or image path
+        threshold: Maximum differing bits that still count as unchanged
+
+    Returns:
+        Dict of map type -> {"hash", "previous", "distance", "changed"}
+    """
+    changes = {}
+    for map_type, image in current_images.items():
+        if hasattr(image, "convert"):
+            current = perceptual_hash(image, hash_size)
+        else:
+            current = file_perceptual_hash(image, hash_size)
+        previous = previous_hashes.get(map_type)
+        distance = hamming_distance(previous, current) if previous and current else None
+        changes[map_type] = {
+            "hash": current,
+            "previous": previous,
+            "distance": distance,
+            "changed": distance is None or distance > threshold,
+        }
+    return changes
+
+
+def domain_matches(host, domains):
+    """True if `host` is one of `domains` or a subdomain of one."""
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+class RequestRouter:
+    """
+    Allowlist/denylist routing for every request a capture context makes.
+
+    Rules are checked in order: allowed domains always load, then denied
+    domains and denied resource types are aborted. Blocked requests are
+    counted per reason; downloaded bytes are summed from Content-Length so
+    runs with and without blocking can be compared (the size of a request
+    that was never sent is unknown).
+
+    Routing requests makes Chromium disable its HTTP cache for the whole
+    context, whatever the route pattern. A one-shot capture starts with an
+    empty cache anyway, but the --serve daemon reloads warm pages that would
+    otherwise come from the cache, so it runs without a router.
+    """
+
+    def __init__(self, block_types=(), block_domains=(), allow_domains=()):
+        self.block_types = set(block_types)
+        self.block_domains = list(block_domains)
+        self.allow_domains = list(allow_domains)
+        self.allowed = 0
+        self.blocked = {}
+        self.bytes_downloaded = 0
+
+    def decide(self, resource_type, url):
+        """Return the reason to block a request, or None to let it through."""
+        host = urlsplit(url).hostname or ""
+        if domain_matches(host, self.allow_domains):
+            return None
+        if domain_matches(host, self.block_domains):
+            return f"domain:{host}"
+        if resource_type in self.block_types:
+            return f"type:{resource_type}"
+        return None
+
+    async def handle(self, route):
+        request = route.request
+        reason = self.decide(request.resource_type, request.url)
+        if reason is None:
+            self.allowed += 1
+            await route.continue_()
+        else:
+            self.blocked[reason] = self.blocked.get(reason, 0) + 1
+            await route.abort("blockedbyclient")
+
+    def record_response(self, response):
+        try:
+            self.bytes_downloaded += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    def summary(self):
+        return {
+            "allowed": self.allowed,
+            "blocked": sum(self.blocked.values()),
+            "blocked_by_reason": dict(sorted(self.blocked.items(), key=lambda x: -x[1])),
+            "bytes_downloaded": self.bytes_downloaded,
+        }
+
+    def report(self):
+        summary = self.summary()
+        print(f"🚦 Requests: {summary['allowed']} allowed, {summary['blocked']} blocked, "
+              f"{summary['bytes_downloaded']:,} bytes downloaded")
+        for reason, count in list(summary["blocked_by_reason"].items())[:5]:
+            print(f"   blocked {count:>4} × {reason}")
+
+
+class RetryScheduler:
+    """
+    Retry policy for failed captures: a total time budget shared by all
+    maps of a run, exponential backoff with jitter, and escalation through
+    RETRY_STEPS (the last step repeats if more retries are allowed).
+    """
+
+    def __init__(self, retries=3, budget=300, base_delay=1.0, max_delay=20.0):
+        self.retries = retries
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = None
+
+    def start(self):
+        self.deadline = time.monotonic() + self.budget
+        return self
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def step(self, retry):
+        """Escalation step for the `retry`-th retry (1-based)."""
+        return RETRY_STEPS[min(retry, len(RETRY_STEPS)) - 1]
+
+    def backoff(self, retry):
+        """Exponential backoff before the `retry`-th retry, jittered between half and all of it."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (retry - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+
+class CaptureSession:
+    """
+    The browser and context shared by concurrent captures.
+
+    Retries may replace the context or the whole browser. Replacements are
+    guarded by a generation number, so when several maps fail at once only
+    the first one rebuilds and the others pick up the new context. Replaced
+    browsers and contexts are closed with the session, not while other
+    pages may still be using them.
+    """
+
+    def __init__(self, playwright, headless=True, storage_state=None, router=None):
+        self.playwright = playwright
+        self.headless = headless
+        self.storage_state = storage_state
+        self.router = router
+        self.browser = None
+        self.context = None
+        self.generation = 0
+        self.retired = []
+        self.lock = asyncio.Lock()
+
+    @property
+    def state_cached(self):
+        return self.storage_state is not None
+
+    async def start(self):
+        self.browser = await launch_browser(self.playwright, self.headless)
+        self.context = await new_capture_context(self.browser, self.storage_state, self.router)
+
+    async def renew(self, step, generation):
+        """Replace the context ("context") or browser ("browser") unless another map already did."""
+        async with self.lock:
+            if generation != self.generation:
+                return
+            # A cached state that was rejected shouldn't be offered again
+            self.storage_state = None
+            self.retired.append(self.context)
+            if step == "browser" or not self.browser.is_connected():
+                self.retired.append(self.browser)
+                self.browser = await launch_browser(self.playwright, self.headless)
+            self.context = await new_capture_context(self.browser, None, self.router)
+            self.generation += 1
+
+    async def close(self):
+        for resource in self.retired + [self.context, self.browser]:
+            if resource is None:
+                continue
             try:
-                # Try multiple selectors
-                canvas = page.wait_for_selector(
-                    'canvas, #canvas-wrapper canvas, .canvas-wrapper canvas',
-                    timeout=20000
-                )
-                print("✓ Found canvas element")
-            except:
-                print("❌ Could not find canvas element")
-                browser.close()
-                return False
-            
-            # Scroll canvas into view
-            canvas.scroll_into_view_if_needed()
-            time.sleep(2)
-            
-            # Clear any hover effects
-            print("🧹 Clearing hover effects and tooltips...")
-            page.evaluate("""
-                // Hide all high z-index elements (tooltips, popups)
-                document.querySelectorAll('*').forEach(el => {
-                    const style = window.getComputedStyle(el);
-                    const zIndex = parseInt(style.zIndex) || 0;
-                    if (zIndex > 100) {
-                        el.style.display = 'none';
-                    }
-                });
-                
-                // Trigger mouseout on canvas
-                const canvas = document.querySelector('canvas');
-                if (canvas) {
-                    const event = new MouseEvent('mouseout', {
-                        view: window,
-                        bubbles: true,
-                        cancelable: true
-                    });
-                    canvas.dispatchEvent(event);
-                }
-            """)
-            time.sleep(2)
-            
-            # Move mouse away from canvas
-            page.mouse.move(10, 10)
-            time.sleep(1)
-            
+                await resource.close()
+            except Exception:
+                pass
+
+
+async def launch_browser(playwright, headless=True):
+    """Launch Chromium with anti-detection settings."""
+    print("🔧 Launching Chromium browser...")
+    with stage("launch"):
+        return await playwright.chromium.launch(headless=headless, args=BROWSER_ARGS)
+
+
+async def new_capture_context(browser, storage_state=None, router=None):
+    """Create a browser context with realistic settings and anti-detection scripts."""
+    with stage("context", cached=storage_state is not None):
+        context = await browser.new_context(storage_state=storage_state, **CONTEXT_OPTIONS)
+        await context.add_init_script(ANTI_DETECTION_JS)
+        if router is not None:
+            await context.route("**/*", router.handle)
+            context.on("response", router.record_response)
+    return context
+
+
+async def load_map_canvas(page, map_type, timeout=90, stable_frames=3, state_cached=False, url=None):
+    """
+    Navigate `page` to a map (or `url`, e.g. a local fixture) and wait until its canvas is rendered.
+
+    `state_cached` marks contexts created from a cached storage state, so a
+    challenge that still appears is reported as a rejected cache entry.
+
+    Returns:
+        The canvas element handle, or None if the page was not ready in time
+    """
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    prefix = f"[{map_type}] "
+    url = url or MAP_URLS.get(map_type, MAP_URLS["sec"])
+
+    # Navigate to Finviz map
+    print(f"{prefix}🌐 Loading {url}")
+    deadline = time.monotonic() + timeout
+    timings = {}
+    with stage("goto", map=map_type):
+        await page.goto(url, wait_until='domcontentloaded', timeout=remaining_ms(deadline))
+    if not await page.evaluate(CHALLENGE_CLEARED_JS):
+        if state_cached:
+            print(f"{prefix}🍪 Cached storage state rejected, falling back to full challenge wait")
+        else:
+            print(f"{prefix}🛡️  Cloudflare challenge shown")
+
+    # Wait for readiness instead of fixed sleeps: challenge gone,
+    # canvas attached, then canvas pixels settled
+    try:
+        await timed_wait("challenge", lambda: wait_for_challenge(page, deadline), timings, map_type)
+        print(f"{prefix}✓ Page loaded: {await page.title()}")
+
+        canvas = await timed_wait("canvas", lambda: wait_for_canvas(page, deadline), timings, map_type)
+        print(f"{prefix}✓ Found canvas element")
+    except PlaywrightTimeoutError:
+        print(f"{prefix}❌ Page not ready within {timeout}s deadline")
+        return None
+
+    # Scroll canvas into view
+    await canvas.scroll_into_view_if_needed()
+
+    if not await timed_wait("render", lambda: wait_for_canvas_stable(canvas, deadline, stable_frames), timings, map_type):
+        print(f"{prefix}⚠️  Canvas still changing at deadline, capturing anyway")
+
+    # Clear hover effects, move mouse away and let the highlight redraw
+    await page.evaluate(CLEAR_HOVER_JS)
+    await page.mouse.move(10, 10)
+    await timed_wait("settle", lambda: wait_for_canvas_stable(canvas, deadline, stable_frames), timings, map_type)
+
+    print(f"{prefix}✓ Waits: {sum(timings.values()):.2f}s total")
+    return canvas
+
+
+async def capture_map_page(context, map_type, output_path, timeout=90, stable_frames=3,
+                           state_cached=False, raw=False, frames=None, url=None,
+                           data_path=None, map_data=None, page=None):
+    """
+    Load one map in a new page of `context` and save its canvas as PNG.
+
+    With `page`, that page is (re)loaded instead and left open for the
+    caller, so a retry can reload it.
+
+    With `raw`, the canvas backing store is read directly instead of taking
+    an element screenshot; the resulting PIL image is stored in `frames`
+    (if given) and only encoded to `output_path` when a path is set.
+
+    With `data_path`, the map data responses the page downloads are saved
+    there as normalized JSON (and stored in `map_data` if given). Without
+    it, a data file next to `output_path` from an earlier capture is removed.
+
+    Returns:
+        True if successful, False otherwise
+    """
+    prefix = f"[{map_type}] "
+    own_page = page is None
+    if own_page:
+        page = await context.new_page()
+    collector = None
+    if data_path is not None:
+        collector = MapDataCollector()
+        page.on("response", collector.on_response)
+
+    try:
+        canvas = await load_map_canvas(page, map_type, timeout, stable_frames, state_cached, url)
+        if canvas is None:
+            return False
+
+        data = None
+        if collector is not None:
+            with stage("map_data", map=map_type) as record:
+                data = normalize_map_data(map_type, await collector.collect())
+                record["tiles"] = len(data["tiles"])
+            if data["tiles"]:
+                if map_data is not None:
+                    map_data[map_type] = data
+            else:
+                print(f"{prefix}⚠️  No map data responses seen")
+        elif output_path is not None:
+            data_path = Path(output_path).with_suffix(".json")
+
+        if raw:
+            frame = await grab_canvas_frame(canvas, map_type)
+            print(f"{prefix}✓ Canvas pixels read: {frame.width}x{frame.height}")
+            if frames is not None:
+                frames[map_type] = frame
+            if output_path is None:
+                if data_path is not None:
+                    save_map_data(data, data_path, prefix)
+                return True
+            with stage("save", map=map_type) as record:
+                frame.save(output_path, format='PNG')
+                record["bytes"] = os.path.getsize(output_path)
+        else:
             # Take screenshot of canvas element
-            print("📸 Capturing canvas screenshot...")
-            canvas_screenshot = canvas.screenshot(type='png')
-            
+            with stage("screenshot", map=map_type) as record:
+                canvas_screenshot = await canvas.screenshot(type='png')
+                record["bytes"] = len(canvas_screenshot)
+
             # Save screenshot
-            with open(output_path, 'wb') as f:
-                f.write(canvas_screenshot)
-            
-            file_size = os.path.getsize(output_path)
-            print(f"✓ Screenshot saved: {output_path}")
-            print(f"✓ File size: {file_size:,} bytes")
-            
-            # Clean up
-            browser.close()
-            return True
-            
+            with stage("save", map=map_type) as record:
+                with open(output_path, 'wb') as f:
+                    f.write(canvas_screenshot)
+                record["bytes"] = len(canvas_screenshot)
+
+        file_size = os.path.getsize(output_path)
+        print(f"{prefix}✓ Screenshot saved: {output_path} ({file_size:,} bytes)")
+        save_map_data(data, data_path, prefix)
+        return True
+
     except Exception as e:
-        print(f"\n❌ Error: {e}")
+        print(f"{prefix}❌ Error: {e}")
         import traceback
         traceback.print_exc()
         return False
 
+    finally:
+        if collector is not None:
+            page.remove_listener("response", collector.on_response)
+        if own_page:
+            await page.close()
+
+
+async def capture_with_retries(session, scheduler, map_type, output_path, timeout=90, **options):
+    """
+    Capture one map, retrying failures within the scheduler's budget.
+
+    Each retry waits a jittered backoff, then escalates: reload the page,
+    then a new context, then a new browser. If the browser is gone (e.g.
+    Chromium crashed) the retry goes straight to a new browser. Every
+    attempt is logged with its step and duration; an exception anywhere in
+    an attempt, including renewing the context or opening the page, fails
+    only that attempt.
+
+    Returns:
+        True if an attempt succeeded, False otherwise
+    """
+    prefix = f"[{map_type}] "
+    page = None
+    attempts = []
+    generation = session.generation
+    try:
+        for attempt in range(scheduler.retries + 1):
+            step = "first" if attempt == 0 else scheduler.step(attempt)
+            if attempt:
+                if not session.browser.is_connected():
+                    step = "browser"
+                delay = scheduler.backoff(attempt)
+                # Leave the attempt at least a few seconds of its own
+                if scheduler.remaining() < delay + 5:
+                    print(f"{prefix}⌛ Retry budget exhausted after {attempt} attempt(s)")
+                    break
+                print(f"{prefix}🔁 Retry {attempt}/{scheduler.retries} ({step}) in {delay:.1f}s, "
+                      f"{scheduler.remaining():.0f}s of budget left")
+                await asyncio.sleep(delay)
+
+            started = time.monotonic()
+            try:
+                with stage("attempt", map=map_type, step=step) as record:
+                    if step in ("context", "browser"):
+                        await session.renew(step, generation)
+                        page = None
+                    generation = session.generation
+                    if page is None or page.is_closed():
+                        page = await session.context.new_page()
+                    ok = await capture_map_page(
+                        session.context, map_type, output_path,
+                        timeout=min(timeout, max(1, scheduler.remaining())),
+                        state_cached=session.state_cached, page=page, **options
+                    )
+                    record["ok"] = ok
+            except Exception as e:
+                print(f"{prefix}❌ Attempt error: {e}")
+                ok = False
+            elapsed = time.monotonic() - started
+            attempts.append((step, elapsed, ok))
+            status = "✓ succeeded" if ok else "✗ failed"
+            print(f"{prefix}{status} on attempt {attempt + 1} ({step}) after {elapsed:.2f}s")
+            if ok:
+                break
+    finally:
+        if page is not None and not page.is_closed():
+            try:
+                await page.close()
+            except Exception:
+                pass
+
+    if len(attempts) > 1:
+        summary = ", ".join(f"{step} {elapsed:.1f}s{'' if ok else ' ✗'}" for step, elapsed, ok in attempts)
+        print(f"{prefix}📋 Attempts: {summary}")
+    return bool(attempts) and attempts[-1][2]
+
+
+async def capture_finviz_maps(outputs, headless=True, timeout=90, stable_frames=3,
+                              state_cache=None, state_max_age=6, raw=False, frames=None,
+                              router=None, urls=None, data_outputs=None, map_data=None,
+                              retry=None):
+    """
+    Capture several map types concurrently in one browser and one context.
+
+    Failed maps are retried per `retry` (a RetryScheduler; None retries
+    with its defaults, RetryScheduler(retries=0) disables retries).
+
+    Args:
+        outputs: Dict of map type -> output PNG path
+        headless: Run in headless mode (default: True)
+        timeout: Overall deadline in seconds for each page's readiness waits
+        stable_frames: Consecutive identical animation frames that count as rendered
+        state_cache: Storage state file to reuse and refresh (None disables the cache)
+        state_max_age: Hours after which the cached storage state counts as stale
+        raw: Read canvas pixels directly instead of taking element screenshots
+        frames: Optional dict filled with map type -> PIL image in raw mode
+        router: Optional RequestRouter that blocks unneeded requests
+        urls: Optional dict of map type -> URL overriding MAP_URLS
+        data_outputs: Optional dict of map type -> normalized map data JSON path
+        map_data: Optional dict filled with map type -> normalized map data
+        retry: Optional RetryScheduler for failed captures
+
+    Returns:
+        Dict of map type -> True/False
+    """
+    from playwright.async_api import async_playwright
+
+    scheduler = (retry or RetryScheduler()).start()
+    try:
+        async with async_playwright() as p:
+            storage_state = load_storage_state(state_cache, state_max_age)
+            session = CaptureSession(p, headless, storage_state, router)
+            try:
+                await session.start()
+                results = await asyncio.gather(*(
+                    capture_with_retries(session, scheduler, map_type, output_path, timeout,
+                                         stable_frames=stable_frames,
+                                         raw=raw, frames=frames, url=(urls or {}).get(map_type),
+                                         data_path=(data_outputs or {}).get(map_type),
+                                         map_data=map_data)
+                    for map_type, output_path in outputs.items()
+                ))
+                # Refresh the cache after any successful load so the next
+                # run starts with the newest clearance cookies
+                if state_cache and any(results):
+                    await save_storage_state(session.context, state_cache)
+                if router is not None:
+                    router.report()
+                return dict(zip(outputs, results))
+            finally:
+                await session.close()
+
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return {map_type: False for map_type in outputs}
+
+
+def capture_finviz_canvas_playwright(map_type="sec", output_path="spy.png", headless=True,
+                                     timeout=90, stable_frames=3, state_cache=None, state_max_age=6,
+                                     router=None, retry=None):
+    """
+    Capture Finviz map canvas element as screenshot using Playwright.
+
+    Args:
+        map_type: Type of map (sec, world, etf, crypto)
+        output_path: Path to save the screenshot
+        headless: Run in headless mode (default: True)
+        timeout: Overall deadline in seconds for all page readiness waits
+        stable_frames: Consecutive identical animation frames that count as rendered
+        state_cache: Storage state file to reuse and refresh (None disables the cache)
+        state_max_age: Hours after which the cached storage state counts as stale
+        router: Optional RequestRouter that blocks unneeded requests
+        retry: Optional RetryScheduler for failed captures
+
+    Returns:
+        True if successful, False otherwise
+    """
+    check_dependencies()
+
+    print(f"📊 Finviz Canvas Screenshot (Playwright)")
+    print(f"Map type: {map_type}")
+    print(f"URL: {MAP_URLS.get(map_type, MAP_URLS['sec'])}")
+    print(f"Output: {output_path}")
+    print(f"Headless: {headless}\n")
+
+    results = asyncio.run(capture_finviz_maps(
+        {map_type: output_path}, headless=headless, timeout=timeout, stable_frames=stable_frames,
+        state_cache=state_cache, state_max_age=state_max_age, router=router, retry=retry
+    ))
+    return results[map_type]
 
-def create_html(html_path, png_filename="spy.png", map_type="sec"):
-    """Create simple HTML to display the screenshot."""
+
+def create_html(html_path, png_filename="spy.png", map_type="sec", sources=None):
+    """
+    Create simple HTML to display the screenshot.
+
+    `sources` is an optional list of (mime type, srcset) pairs, e.g. the
+    AVIF/WebP variants from postprocess_images.py, offered before the PNG.
+    """
+    image_html = f'<img src="{png_filename}" alt="Finviz Market Map">'
+    if sources:
+        source_html = "".join(
+            f'\n        <source type="{mime_type}" srcset="{srcset}" sizes="100vw">'
+            for mime_type, srcset in sources
+        )
+        image_html = f"<picture>{source_html}\n        {image_html}\n    </picture>"
     
     html_content = f"""<!DOCTYPE html>
 <html lang="zh-TW">
@@ -240,7 +1145,7 @@ def create_html(html_path, png_filename="spy.png", map_type="sec"):
     </style>
 </head>
 <body>
-    <img src="{png_filename}" alt="Finviz Market Map">
+    {image_html}
 </body>
 </html>
 """
@@ -251,15 +1156,120 @@ def create_html(html_path, png_filename="spy.png", map_type="sec"):
     print(f"✓ HTML created: {html_path}")
 
 
+def analyze_frames(frames, output_dir, map_data=None, history=DEFAULT_HISTORY_PATH):
+    """
+    Run the analysis on in-memory canvas frames and save the JSON API files.
+
+    Maps with captured map data are ranked from it directly; the rest go to
+    the vision model together over one pooled connection. Each result is
+    appended to the history store at ``history`` unless it is None.
+    """
+    from analyze_map import default_output_path, record_history, save_json_api, top_losers_from_map_data
+    from analysis_cache import AnalysisCache
+    from models_client import analyze_images
+
+    map_data = map_data or {}
+    api_token = os.environ.get("GITHUB_TOKEN")
+    pending = {map_type: frame for map_type, frame in frames.items() if map_type not in map_data}
+    if pending and not api_token:
+        print("❌ GITHUB_TOKEN is required for --analyze")
+        sys.exit(1)
+
+    results = {}
+    for map_type in frames:
+        if map_type in map_data:
+            print(f"\n[{map_type}] 📈 Ranking captured map data...")
+            results[map_type] = top_losers_from_map_data(map_data[map_type])
+    if pending:
+        print(f"\n🤖 Analyzing {len(pending)} in-memory canvas frame(s)...")
+        # Reruns on identical frames reuse the previous model answer
+        cache = AnalysisCache(Path(output_dir) / ".cache" / "analysis")
+        results.update(asyncio.run(analyze_images(pending, api_token, cache=cache)))
+
+    failed = []
+    for map_type, result in results.items():
+        if isinstance(result, Exception):
+            print(f"[{map_type}] ❌ Analysis failed: {result}")
+            failed.append(map_type)
+            continue
+        output_path = Path(output_dir) / default_output_path(FILENAME_MAP.get(map_type, f"{map_type}.png"))
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        api_response = save_json_api(result, str(output_path))
+        if history is not None:
+            if map_type in map_data:
+                record_history(history, map_type, api_response["data"], "map_data", map_data[map_type]["tiles"])
+            else:
+                record_history(history, map_type, api_response["data"], "models")
+    if failed:
+        sys.exit(1)
+
+
+def write_github_output(name, value):
+    """Expose a step output when running inside GitHub Actions."""
+    output_file = os.environ.get("GITHUB_OUTPUT")
+    if output_file:
+        with open(output_file, "a", encoding="utf-8") as f:
+            f.write(f"{name}={value}\n")
+
+
+def report_changes(changes, threshold):
+    """Print per-map change detection results and return True if any map changed."""
+    print(f"\n🔎 Change detection (threshold: {threshold} bits)")
+    for map_type, change in changes.items():
+        if change["hash"] is None:
+            print(f"[{map_type}] ⚠️  Could not hash new image, treating as changed")
+        elif change["distance"] is None:
+            print(f"[{map_type}] 🆕 No previous snapshot, treating as changed")
+        elif change["changed"]:
+            print(f"[{map_type}] 🔄 Changed ({change['distance']} bits differ)")
+        else:
+            print(f"[{map_type}] 💤 Unchanged ({change['distance']} bits differ)")
+    return any(change["changed"] for change in changes.values())
+
+
+def split_list(value):
+    """argparse type for comma-separated lists."""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def build_router(args):
+    """Create the RequestRouter requested on the command line, or None."""
+    if not (args.block or args.block_types is not None or args.block_domains or args.allow_domains):
+        return None
+    return RequestRouter(
+        block_types=DEFAULT_BLOCK_TYPES if args.block_types is None else args.block_types,
+        block_domains=DEFAULT_BLOCK_DOMAINS + (args.block_domains or []),
+        allow_domains=DEFAULT_ALLOW_DOMAINS + (args.allow_domains or []),
+    )
+
+
+def parse_map_types(value):
+    """argparse type for -t: one map type or a comma-separated list."""
+    map_types = [t.strip() for t in value.split(",") if t.strip()]
+    unknown = [t for t in map_types if t not in MAP_URLS]
+    if not map_types or unknown:
+        raise argparse.ArgumentTypeError(
+            f"invalid map type(s): {', '.join(unknown) or value!r} "
+            f"(choose from {', '.join(MAP_URLS)})"
+        )
+    # Keep first occurrence order, drop duplicates
+    return list(dict.fromkeys(map_types))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Capture Finviz map canvas as screenshot using Playwright"
     )
     parser.add_argument(
         "-t", "--type",
-        default="sec",
-        choices=["sec", "world", "etf", "crypto"],
-        help="Map type (default: sec)"
+        default=["sec"],
+        type=parse_map_types,
+        help="Map type, or comma-separated list captured concurrently: sec, world, etf, crypto (default: sec)"
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Capture every map type in one browser session"
     )
     parser.add_argument(
         "--no-html",
@@ -271,42 +1281,259 @@ def main():
         action="store_true",
         help="Run with visible browser (for debugging)"
     )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=90,
+        help="Overall deadline in seconds for Cloudflare, canvas and render waits (default: 90)"
+    )
+    parser.add_argument(
+        "--stable-frames",
+        type=int,
+        default=3,
+        help="Identical animation frames required before the canvas counts as rendered (default: 3)"
+    )
+    parser.add_argument(
+        "--state-cache",
+        help="Browser storage state file reused across runs (default: .cache/storage_state.json)"
+    )
+    parser.add_argument(
+        "--state-max-age",
+        type=float,
+        default=6,
+        help="Hours before the cached storage state is considered stale (default: 6)"
+    )
+    parser.add_argument(
+        "--no-state-cache",
+        action="store_true",
+        help="Always start with a fresh browser context"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries for a failed map, escalating reload -> new context -> new browser (default: 3, 0 disables)"
+    )
+    parser.add_argument(
+        "--retry-budget",
+        type=float,
+        default=300,
+        help="Total seconds all attempts of a run may take, backoff included (default: 300)"
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Read canvas pixels directly (getImageData) instead of taking an element screenshot"
+    )
+    parser.add_argument(
+        "--no-png",
+        action="store_true",
+        help="Keep captured pixels in memory only, don't write PNG files (implies --raw)"
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="Hand the in-memory pixels straight to analyze_map.py and write the JSON API (implies --raw)"
+    )
+    parser.add_argument(
+        "--history",
+        default=str(DEFAULT_HISTORY_PATH),
+        help="SQLite history store that --analyze appends a snapshot to (default: data/history.sqlite)"
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Don't record --analyze results in the history store"
+    )
+    parser.add_argument(
+        "--detect-changes",
+        action="store_true",
+        help="Compare a perceptual hash of each new map with the previous snapshot and report whether it changed"
+    )
+    parser.add_argument(
+        "--hash-cache",
+        help="Previous snapshot hashes for --detect-changes (default: .cache/map_hashes.json)"
+    )
+    parser.add_argument(
+        "--change-threshold",
+        type=int,
+        default=2,
+        help="Differing hash bits still counted as unchanged (default: 2)"
+    )
+    parser.add_argument(
+        "--hash-size",
+        type=int,
+        default=16,
+        help="Perceptual hash grid size; larger notices smaller tiles (default: 16)"
+    )
+    parser.add_argument(
+        "--exit-unchanged",
+        type=int,
+        nargs="?",
+        const=EXIT_UNCHANGED,
+        help=f"Exit with this code (default: {EXIT_UNCHANGED}) when no map changed (implies --detect-changes)"
+    )
+    parser.add_argument(
+        "--data",
+        action="store_true",
+        help="Also save the map data the page downloads (tickers, sectors, market caps, % changes) as <map>.json"
+    )
+    parser.add_argument(
+        "--url",
+        help="Load this URL instead of Finviz, e.g. the offline fixture page (single map type only)"
+    )
+    parser.add_argument(
+        "--block",
+        action="store_true",
+        help="Block ads, analytics, images, fonts and media the map canvas doesn't need"
+    )
+    parser.add_argument(
+        "--block-types",
+        type=split_list,
+        help=f"Comma-separated resource types to block (implies --block, default: {','.join(DEFAULT_BLOCK_TYPES)})"
+    )
+    parser.add_argument(
+        "--block-domains",
+        type=split_list,
+        help="Extra comma-separated domains to block, subdomains included (implies --block)"
+    )
+    parser.add_argument(
+        "--allow-domains",
+        type=split_list,
+        help="Comma-separated domains that are never blocked (implies --block)"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as a daemon that keeps Chromium warm and serves GET /capture?type=sec over HTTP"
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Daemon listen address (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Daemon listen port (default: 8765)"
+    )
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
+    # Every exit path below goes through sys.exit, so write the metrics at exit
+    setup_metrics(args, "capture")
+    atexit.register(finish_metrics, args)
+
     # Output paths - root directory
     script_dir = Path(__file__).parent.parent.parent.parent
 
-    # Map type to filename mapping
-    filename_map = {
-        "sec": "spy.png",      # S&P 500 -> SPY ETF ticker
-        "world": "world.png",
-        "etf": "etf.png",
-        "crypto": "crypto.png"
-    }
+    headless = not args.no_headless
+    state_cache = None
+    if not args.no_state_cache:
+        state_cache = args.state_cache or str(script_dir / ".cache" / "storage_state.json")
+
+    router = build_router(args)
+    retry = RetryScheduler(retries=args.retries, budget=args.retry_budget)
+
+    if args.serve:
+        from capture_server import serve
+        if router is not None:
+            print("⚠️  Request blocking is off in --serve mode: routing disables the HTTP cache "
+                  "that warm page reloads rely on\n")
+            router = None
+        serve(
+            script_dir, host=args.host, port=args.port, headless=headless,
+            timeout=args.timeout, stable_frames=args.stable_frames,
+            state_cache=state_cache, state_max_age=args.state_max_age, router=router
+        )
 
-    # Generate filename based on map type
-    png_filename = filename_map.get(args.type, f"{args.type}.png")
-    png_path = script_dir / png_filename
+    map_types = list(MAP_URLS) if args.all else args.type
+    if args.url and len(map_types) > 1:
+        parser.error("--url works with a single map type")
+
+    # Generate filenames based on map type
+    png_paths = {
+        map_type: script_dir / FILENAME_MAP.get(map_type, f"{map_type}.png")
+        for map_type in map_types
+    }
     html_path = script_dir / "index.html"
     
     print(f"📁 Output directory: {script_dir}\n")
 
     # Capture canvas screenshot
-    headless = not args.no_headless
-    success = capture_finviz_canvas_playwright(args.type, str(png_path), headless=headless)
+    raw = args.raw or args.no_png or args.analyze
+    frames = {}
+    map_data = {}
+    urls = {map_types[0]: args.url} if args.url else None
+    data_outputs = None
+    if args.data:
+        data_outputs = {map_type: str(path.with_suffix(".json")) for map_type, path in png_paths.items()}
 
-    if not success:
-        print("\n❌ Failed to capture screenshot")
+    detect = args.detect_changes or args.exit_unchanged is not None
+    previous_hashes = {}
+    hash_cache = Path(args.hash_cache or script_dir / ".cache" / "map_hashes.json")
+    if detect:
+        previous_hashes = previous_snapshot_hashes(png_paths, hash_cache, args.hash_size)
+
+    if len(map_types) == 1 and not (raw or urls or data_outputs):
+        map_type = map_types[0]
+        results = {map_type: capture_finviz_canvas_playwright(
+            map_type, str(png_paths[map_type]), headless=headless,
+            timeout=args.timeout, stable_frames=args.stable_frames,
+            state_cache=state_cache, state_max_age=args.state_max_age, router=router, retry=retry
+        )}
+    else:
+        check_dependencies()
+        print(f"📊 Finviz Canvas Screenshot (Playwright, {len(map_types)} maps)")
+        print(f"Map types: {', '.join(map_types)}")
+        print(f"Raw pixels: {raw}")
+        print(f"Headless: {headless}\n")
+        started = time.monotonic()
+        results = asyncio.run(capture_finviz_maps(
+            {map_type: None if args.no_png else str(path) for map_type, path in png_paths.items()},
+            headless=headless, timeout=args.timeout, stable_frames=args.stable_frames,
+            state_cache=state_cache, state_max_age=args.state_max_age,
+            raw=raw, frames=frames, router=router,
+            urls=urls, data_outputs=data_outputs, map_data=map_data, retry=retry
+        ))
+        print(f"\n⏱️  All maps captured in {time.monotonic() - started:.2f}s")
+
+    failed = [map_type for map_type, ok in results.items() if not ok]
+    if failed:
+        print(f"\n❌ Failed to capture screenshot: {', '.join(failed)}")
         sys.exit(1)
 
-    # Create HTML if requested
+    changed = True
+    if detect:
+        current_images = {map_type: frames.get(map_type, png_paths[map_type]) for map_type in map_types}
+        with stage("detect_changes"):
+            changes = detect_changes(previous_hashes, current_images, args.change_threshold, args.hash_size)
+            save_snapshot_hashes(hash_cache, changes)
+        changed = report_changes(changes, args.change_threshold)
+        write_github_output("changed", str(changed).lower())
+        if not changed:
+            print("\n💤 Map unchanged since last snapshot, skipping analysis and HTML")
+            sys.exit(args.exit_unchanged or 0)
+
+    if args.analyze:
+        analyze_frames(frames, script_dir, map_data, None if args.no_history else args.history)
+
+    # No PNG means nothing for the HTML viewer to show
+    if args.no_png:
+        args.no_html = True
+        png_paths = {}
+
+    # Create HTML if requested (shows the first map)
+    png_filename = FILENAME_MAP.get(map_types[0], f"{map_types[0]}.png")
     if not args.no_html:
         print()
-        create_html(str(html_path), png_filename, args.type)
+        create_html(str(html_path), png_filename, map_types[0])
 
     print(f"\n🎉 Done!")
-    print(f"✓ PNG: {png_path}")
+    for png_path in png_paths.values():
+        print(f"✓ PNG: {png_path}")
     if not args.no_html:
         print(f"✓ HTML: {html_path}")
         print(f"\n📖 Open {html_path} in your browser to view the map.")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Finviz Map Capture Daemon
+Keeps Chromium warm with one page per map type and serves captures over local HTTP
+
+Endpoints:
+    GET /capture?type=sec          PNG bytes of the freshly rendered canvas
+    GET /capture?type=sec&save=1   also write the PNG under its usual filename
+    GET /health                    browser state and per-map capture counts
+"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from capture_canvas_playwright import (
+    FILENAME_MAP,
+    MAP_URLS,
+    check_dependencies,
+    launch_browser,
+    load_map_canvas,
+    load_storage_state,
+    new_capture_context,
+    save_map_data,
+    save_storage_state,
+)
+from instrumentation import atomic_write
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class CaptureDaemon:
+    """
+    One long-lived browser and context with a page pool keyed by map type.
+
+    Requests for the same map type are queued on a per-type lock, so each
+    pooled page only ever serves one capture at a time while different map
+    types capture concurrently. If the browser disconnects or crashes it is
+    relaunched on the next request.
+    """
+
+    def __init__(self, output_dir, headless=True, timeout=90, stable_frames=3,
+                 state_cache=None, state_max_age=6, router=None):
+        self.output_dir = Path(output_dir)
+        self.headless = headless
+        self.timeout = timeout
+        self.stable_frames = stable_frames
+        self.state_cache = state_cache
+        self.state_max_age = state_max_age
+        self.router = router
+
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.state_cached = False
+        self.pages = {}
+        self.locks = {map_type: asyncio.Lock() for map_type in MAP_URLS}
+        self.launch_lock = asyncio.Lock()
+        self.state_lock = asyncio.Lock()
+        self.stats = {"launches": 0, "captures": {}, "failures": {}}
+
+    async def start(self):
+        from playwright.async_api import async_playwright
+
+        self.playwright = await async_playwright().start()
+        await self.ensure_browser()
+
+    async def stop(self):
+        if self.browser is not None:
+            await self.browser.close()
+        if self.playwright is not None:
+            await self.playwright.stop()
+
+    async def ensure_browser(self):
+        """Launch the browser (again) if it is missing or disconnected."""
+        async with self.launch_lock:
+            if self.browser is not None and self.browser.is_connected():
+                return
+
+            if self.browser is not None:
+                print("♻️  Browser disconnected, recycling...")
+                try:
+                    await self.browser.close()
+                except Exception:
+                    pass
+
+            self.pages = {}
+            self.browser = await launch_browser(self.playwright, self.headless)
+            storage_state = load_storage_state(self.state_cache, self.state_max_age)
+            self.state_cached = storage_state is not None
+            self.context = await new_capture_context(self.browser, storage_state, self.router)
+            self.stats["launches"] += 1
+
+    async def get_page(self, map_type):
+        page = self.pages.get(map_type)
+        if page is None or page.is_closed():
+            page = await self.context.new_page()
+            self.pages[map_type] = page
+        return page
+
+    async def discard_page(self, map_type):
+        page = self.pages.pop(map_type, None)
+        if page is not None:
+            try:
+                await page.close()
+            except Exception:
+                pass
+
+    async def capture(self, map_type):
+        """
+        Render `map_type` on its pooled page and return the canvas PNG bytes.
+
+        Returns:
+            PNG bytes, or None if the page was not ready before the deadline
+        """
+        async with self.locks[map_type]:
+            await self.ensure_browser()
+            page = await self.get_page(map_type)
+            try:
+                canvas = await load_map_canvas(
+                    page, map_type, self.timeout, self.stable_frames, self.state_cached
+                )
+                if canvas is None:
+                    self.stats["failures"][map_type] = self.stats["failures"].get(map_type, 0) + 1
+                    return None
+                png = await canvas.screenshot(type='png')
+            except Exception:
+                # A crashed page or browser is replaced on the next request
+                self.stats["failures"][map_type] = self.stats["failures"].get(map_type, 0) + 1
+                await self.discard_page(map_type)
+                raise
+
+            self.stats["captures"][map_type] = self.stats["captures"].get(map_type, 0) + 1
+
+        if self.state_cache:
+            async with self.state_lock:
+                await save_storage_state(self.context, self.state_cache)
+        return png
+
+    def health(self):
+        return {
+            "browser_connected": bool(self.browser and self.browser.is_connected()),
+            "pages": sorted(self.pages),
+            "queued": {t: lock.locked() for t, lock in self.locks.items()},
+            "requests": self.router.summary() if self.router else None,
+            **self.stats,
+        }
+
+
+async def send_response(writer, status, body, content_type="application/json", headers=None):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    lines = [
+        f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: close",
+    ]
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+async def handle_request(daemon, reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain headers, requests carry no body
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            await send_response(writer, 400, {"error": "malformed request line"})
+            return
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if method != "GET":
+            await send_response(writer, 405, {"error": f"{method} not allowed"})
+        elif url.path == "/health":
+            await send_response(writer, 200, daemon.health())
+        elif url.path == "/capture":
+            map_type = query.get("type", ["sec"])[0]
+            if map_type not in MAP_URLS:
+                await send_response(writer, 400, {"error": f"unknown map type: {map_type}"})
+                return
+
+            started = time.monotonic()
+            try:
+                png = await daemon.capture(map_type)
+            except Exception as e:
+                print(f"[{map_type}] ❌ Error: {e}")
+                await send_response(writer, 500, {"error": str(e)})
+                return
+            elapsed = time.monotonic() - started
+
+            if png is None:
+                await send_response(writer, 503, {"error": f"{map_type} map not ready before deadline"})
+                return
+
+            headers = {"X-Capture-Seconds": f"{elapsed:.3f}"}
+            if query.get("save", ["0"])[0] not in ("0", "false", ""):
+                output_path = daemon.output_dir / FILENAME_MAP.get(map_type, f"{map_type}.png")
+                # Other processes read the PNG while the daemon keeps serving
+                atomic_write(output_path, png)
+                print(f"[{map_type}] ✓ Screenshot saved: {output_path} ({len(png):,} bytes)")
+                # The daemon doesn't record map data, so an older <map>.json no longer matches
+                save_map_data(None, output_path.with_suffix(".json"), f"[{map_type}] ")
+                headers["X-Capture-Path"] = str(output_path)
+            print(f"[{map_type}] ✓ Served capture in {elapsed:.2f}s")
+            await send_response(writer, 200, png, "image/png", headers)
+        else:
+            await send_response(writer, 404, {"error": f"no route for {url.path}"})
+
+    finally:
+        writer.close()
+
+
+async def run_server(daemon, host="127.0.0.1", port=8765):
+    await daemon.start()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_request(daemon, reader, writer), host, port
+    )
+    print(f"🚀 Capture daemon listening on http://{host}:{port}")
+    print(f"   GET /capture?type=sec[&save=1]  |  GET /health\n")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await daemon.stop()
+
+
+def serve(output_dir, host="127.0.0.1", port=8765, **daemon_options):
+    """Run the capture daemon until interrupted."""
+    check_dependencies()
+    daemon = CaptureDaemon(output_dir, **daemon_options)
+    try:
+        asyncio.run(run_server(daemon, host, port))
+    except KeyboardInterrupt:
+        print("\n👋 Capture daemon stopped")
+    sys.exit(0)
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+分析結果的歷史快照庫 (SQLite)
+每次分析新增一筆快照，只新增不覆寫；有地圖資料時一併保存每個方塊的漲跌幅，
+以索引支援「過去 90 天 META 跌最多的一天」這類查詢，不必翻 git log
+
+    python scripts/history_store.py worst META --days 90
+    python scripts/history_store.py history META --days 30
+    python scripts/history_store.py day 2026-10-16 --map sec
+    python scripts/history_store.py frequent --days 30
+    python scripts/history_store.py backfill        # 從 git 歷史匯入 api/*_losers.json
+    python scripts/history_store.py export          # 匯出成 data/history/YYYY-MM-DD.ndjson
+    python scripts/history_store.py import          # 從匯出檔重建資料庫
+
+二進位的 SQLite 檔案不提交到 git (每次提交都是整個檔案的新版本)，
+提交的是每天一個 NDJSON 的文字匯出: 過去日期的檔案不會再變動，git 只增加當天的資料；
+資料庫不存在時 (例如新的 CI runner) 以 import 從匯出檔重建，快照 id 保持不變
+"""
+
+import argparse
+import json
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from instrumentation import atomic_write
+
+REPO_ROOT = Path(__file__).parent.parent.parent.parent
+DEFAULT_PATH = REPO_ROOT / "data" / "history.sqlite"
+DEFAULT_EXPORT_DIR = REPO_ROOT / "data" / "history"
+
+# 匯出檔中每個方塊以陣列表示的欄位順序
+TILE_COLUMNS = ("ticker", "sector", "industry", "market_cap", "change")
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    captured_at TEXT NOT NULL,
+    date TEXT NOT NULL,
+    map_type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    UNIQUE (map_type, captured_at)
+);
+CREATE INDEX IF NOT EXISTS snapshots_date_map ON snapshots (date, map_type);
+
+CREATE TABLE IF NOT EXISTS losers (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    date TEXT NOT NULL,
+    map_type TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    ticker TEXT,
+    change REAL
+);
+CREATE INDEX IF NOT EXISTS losers_ticker_date ON losers (ticker, date);
+CREATE INDEX IF NOT EXISTS losers_snapshot ON losers (snapshot_id);
+
+CREATE TABLE IF NOT EXISTS tiles (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    date TEXT NOT NULL,
+    map_type TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    sector TEXT,
+    industry TEXT,
+    market_cap REAL,
+    change REAL
+);
+CREATE INDEX IF NOT EXISTS tiles_ticker_date ON tiles (ticker, date);
+CREATE INDEX IF NOT EXISTS tiles_snapshot ON tiles (snapshot_id);
+
+-- 有方塊資料的快照用完整資料，否則用 top_losers
+CREATE VIEW IF NOT EXISTS changes AS
+    SELECT snapshot_id, date, map_type, ticker, change FROM tiles
+    UNION ALL
+    SELECT snapshot_id, date, map_type, ticker, change FROM losers AS l
+    WHERE ticker IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM tiles AS t WHERE t.snapshot_id = l.snapshot_id);
+"""
+
+# 只新增不修改
+APPEND_ONLY = """
+CREATE TRIGGER IF NOT EXISTS {table}_no_update BEFORE UPDATE ON {table}
+BEGIN SELECT RAISE(ABORT, '{table} is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS {table}_no_delete BEFORE DELETE ON {table}
+BEGIN SELECT RAISE(ABORT, '{table} is append-only'); END;
+"""
+
+
+def map_type_for(image_name):
+    """圖片名稱對應的地圖類型: spy.png -> sec，其餘使用檔名 (world.png -> world)"""
+    stem = Path(image_name).stem
+    return "sec" if stem == "spy" else stem
+
+
+def parse_change(value):
+    """"-4.78%"、"−4.78%" (模型有時輸出 Unicode 減號) 或 -4.78 -> -4.78，無法解析時回傳 None"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().rstrip("%").replace("−", "-"))
+    except (TypeError, ValueError):
+        return None
+
+
+def since(days):
+    """days 天前的日期字串 (UTC)"""
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+class HistoryStore:
+    """快照庫；可當作 context manager 使用"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            with self.db:
+                self.db.executescript(SCHEMA + "".join(
+                    APPEND_ONLY.format(table=table) for table in ("snapshots", "losers", "tiles")
+                ))
+                self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def record(self, map_type, data, source, tiles=None, captured_at=None, snapshot_id=None):
+        """
+        新增一筆快照
+
+        Args:
+            map_type: 地圖類型 (sec、world...)
+            data: 分析結果 (含 top_losers 與 generated_at)
+            source: 結果來源 (map_data、models、local、ocr、backfill)
+            tiles: 地圖資料的方塊列表 (ticker、sector、industry、market_cap、change)
+            snapshot_id: 指定快照 id (從匯出檔重建時保留原本的 id)
+
+        Returns:
+            快照 id；同一張地圖同一時間的快照已存在時回傳 None
+        """
+        captured_at = captured_at or data.get("generated_at") or \
+            datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        date = captured_at[:10]
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO snapshots (id, captured_at, date, map_type, source, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (snapshot_id, captured_at, date, map_type, source, json.dumps(data, ensure_ascii=False)),
+            )
+            if not cursor.rowcount:
+                return None
+            snapshot_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO losers (snapshot_id, date, map_type, rank, ticker, change) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (snapshot_id, date, map_type, rank, entry.get("ticker"), parse_change(entry.get("change")))
+                    for rank, entry in enumerate(data.get("top_losers") or [], 1)
+                ),
+            )
+            if tiles:
+                self.db.executemany(
+                    "INSERT INTO tiles (snapshot_id, date, map_type, ticker, sector, industry, market_cap, change) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (snapshot_id, date, map_type, tile["ticker"], tile.get("sector"),
+                         tile.get("industry"), tile.get("market_cap"), tile.get("change"))
+                        for tile in tiles if tile.get("ticker")
+                    ),
+                )
+        return snapshot_id
+
+    def ticker_history(self, ticker, days=None, map_type="sec"):
+        """每天 (同一天多次快照取最新的一筆) 的漲跌幅，依日期排序"""
+        return [dict(row) for row in self.db.execute(
+            """
+            SELECT date, change FROM (
+                SELECT c.date, c.change,
+                       ROW_NUMBER() OVER (PARTITION BY c.date ORDER BY s.captured_at DESC) AS latest
+                FROM changes AS c JOIN snapshots AS s ON s.id = c.snapshot_id
+                WHERE c.ticker = ? AND c.map_type = ? AND c.date >= ?
+            )
+            WHERE latest = 1
+            ORDER BY date
+            """,
+            (ticker.upper(), map_type, since(days) if days else ""),
+        )]
+
+    def worst_days(self, ticker, days=90, map_type="sec", limit=1):
+        """ticker 跌最多的幾天"""
+        history = [row for row in self.ticker_history(ticker, days, map_type) if row["change"] is not None]
+        return sorted(history, key=lambda row: row["change"])[:limit]
+
+    def losers_on(self, date, map_type="sec"):
+        """某天最新一筆快照的 top_losers"""
+        snapshot = self.db.execute(
+            "SELECT id, captured_at, source FROM snapshots WHERE date = ? AND map_type = ? "
+            "ORDER BY captured_at DESC LIMIT 1",
+            (date, map_type),
+        ).fetchone()
+        if snapshot is None:
+            return None
+        losers = self.db.execute(
+            "SELECT rank, ticker, change FROM losers WHERE snapshot_id = ? ORDER BY rank",
+            (snapshot["id"],),
+        )
+        return {**dict(snapshot), "top_losers": [dict(row) for row in losers]}
+
+    def frequent_losers(self, days=30, map_type="sec", limit=10):
+        """最常出現在 top_losers 的股票 (每天只算一次)"""
+        return [dict(row) for row in self.db.execute(
+            """
+            SELECT ticker, COUNT(DISTINCT date) AS days, MIN(change) AS worst, AVG(change) AS average
+            FROM losers
+            WHERE map_type = ? AND date >= ? AND ticker IS NOT NULL
+            GROUP BY ticker
+            ORDER BY days DESC, worst
+            LIMIT ?
+            """,
+            (map_type, since(days), limit),
+        )]
+
+    def latest_snapshot_id(self):
+        """最新一筆快照的 id (沒有快照時為 0)；快照只新增，id 只會變大"""
+        return self.db.execute("SELECT COALESCE(MAX(id), 0) FROM snapshots").fetchone()[0]
+
+    def daily_snapshots(self, since=0):
+        """
+        每天每張地圖最新一筆快照: 依日期排序的 (date, map_type, data)
+
+        since 大於 0 時只列出 id 大於 since 的快照所在的日期
+        """
+        for row in self.db.execute(
+            """
+            SELECT date, map_type, payload FROM (
+                SELECT date, map_type, payload,
+                       ROW_NUMBER() OVER (PARTITION BY date, map_type ORDER BY captured_at DESC) AS latest
+                FROM snapshots
+                WHERE date IN (SELECT date FROM snapshots WHERE id > ?)
+            )
+            WHERE latest = 1
+            ORDER BY date, map_type
+            """,
+            (since,),
+        ):
+            yield row["date"], row["map_type"], json.loads(row["payload"])
+
+    def latest_snapshots(self):
+        """每張地圖最新一天的最新一筆快照: (date, map_type, data)"""
+        for row in self.db.execute(
+            """
+            SELECT date, map_type, payload FROM (
+                SELECT date, map_type, payload,
+                       ROW_NUMBER() OVER (PARTITION BY map_type ORDER BY date DESC, captured_at DESC) AS latest
+                FROM snapshots
+            )
+            WHERE latest = 1
+            ORDER BY map_type
+            """
+        ):
+            yield row["date"], row["map_type"], json.loads(row["payload"])
+
+    def all_ticker_changes(self, since=0):
+        """
+        所有股票每天的漲跌幅: 依股票、地圖、日期排序的 (ticker, map_type, date, change)
+
+        since 大於 0 時只列出 id 大於 since 的快照所在的 (地圖, 日期)，
+        每一筆仍取該天所有快照中最新的一筆
+        """
+        for row in self.db.execute(
+            """
+            SELECT ticker, map_type, date, change FROM (
+                SELECT c.ticker, c.map_type, c.date, c.change,
+                       ROW_NUMBER() OVER (PARTITION BY c.ticker, c.map_type, c.date
+                                          ORDER BY s.captured_at DESC) AS latest
+                FROM changes AS c JOIN snapshots AS s ON s.id = c.snapshot_id
+                WHERE (c.map_type, c.date) IN (SELECT map_type, date FROM snapshots WHERE id > ?)
+            )
+            WHERE latest = 1
+            ORDER BY ticker, map_type, date
+            """,
+            (since,),
+        ):
+            yield tuple(row)
+
+    def backfill(self, paths=("api/top_losers.json",), repo=REPO_ROOT):
+        """
+        從 git 歷史匯入過去提交的 JSON API 檔案
+
+        已匯入的快照 (同一張地圖同一個 generated_at) 會略過，可重複執行；回傳新增筆數
+        """
+        added = 0
+        for path in paths:
+            map_type = "sec" if Path(path).name == "top_losers.json" else Path(path).stem.replace("_losers", "")
+            commits = subprocess.run(
+                ["git", "log", "--format=%H", "--", path],
+                cwd=repo, capture_output=True, text=True, check=True
+            ).stdout.split()
+            for commit in reversed(commits):
+                shown = subprocess.run(
+                    ["git", "show", f"{commit}:{path}"], cwd=repo, capture_output=True, text=True
+                )
+                if shown.returncode != 0:
+                    continue
+                try:
+                    data = json.loads(shown.stdout).get("data", {})
+                except ValueError:
+                    continue
+                if self.record(map_type, data, "backfill") is not None:
+                    added += 1
+        return added
+
+    def export_lines(self):
+        """每天的匯出內容: 依日期排序的 (date, text)，每行一筆快照，依 id 排序"""
+        tiles = {}
+        for row in self.db.execute(
+            "SELECT snapshot_id, ticker, sector, industry, market_cap, change FROM tiles ORDER BY rowid"
+        ):
+            tiles.setdefault(row[0], []).append(list(row)[1:])
+
+        lines = {}
+        for row in self.db.execute(
+            "SELECT id, captured_at, date, map_type, source, payload FROM snapshots ORDER BY date, id"
+        ):
+            snapshot = {
+                "id": row["id"], "captured_at": row["captured_at"], "map_type": row["map_type"],
+                "source": row["source"], "data": json.loads(row["payload"]),
+            }
+            if row["id"] in tiles:
+                snapshot["tiles"] = tiles[row["id"]]
+            lines.setdefault(row["date"], []).append(
+                json.dumps(snapshot, ensure_ascii=False, separators=(",", ":"))
+            )
+        for date, day_lines in lines.items():
+            yield date, "\n".join(day_lines) + "\n"
+
+    def export(self, directory=DEFAULT_EXPORT_DIR):
+        """
+        匯出成每天一個 NDJSON 檔案，只重寫內容有變化的檔案
+
+        Returns:
+            (寫入的檔案數, 檔案總數)
+        """
+        directory = Path(directory)
+        written = total = 0
+        for date, text in self.export_lines():
+            total += 1
+            path = directory / f"{date}.ndjson"
+            try:
+                if path.read_text(encoding="utf-8") == text:
+                    continue
+            except OSError:
+                pass
+            atomic_write(path, text)
+            written += 1
+        return written, total
+
+    def import_export(self, directory=DEFAULT_EXPORT_DIR):
+        """從匯出檔新增資料庫中沒有的快照 (保留原本的 id)；回傳新增筆數"""
+        added = 0
+        for path in sorted(Path(directory).glob("*.ndjson")):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    snapshot = json.loads(line)
+                    tiles = [dict(zip(TILE_COLUMNS, tile)) for tile in snapshot.get("tiles", [])]
+                    if self.record(
+                        snapshot["map_type"], snapshot["data"], snapshot["source"], tiles=tiles or None,
+                        captured_at=snapshot["captured_at"], snapshot_id=snapshot["id"]
+                    ) is not None:
+                        added += 1
+        return added
+
+
+def format_change(change):
+    return f"{change:+.2f}%" if change is not None else "N/A"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查詢分析結果的歷史快照")
+    parser.add_argument("--db", default=str(DEFAULT_PATH), help=f"資料庫路徑 (預設: {DEFAULT_PATH.relative_to(REPO_ROOT)})")
+    parser.add_argument("--map", default="sec", help="地圖類型 (預設: sec)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worst = commands.add_parser("worst", help="股票跌最多的幾天")
+    worst.add_argument("ticker")
+    worst.add_argument("--days", type=int, default=90, help="查詢最近幾天 (預設: 90)")
+    worst.add_argument("--limit", type=int, default=1, help="列出幾天 (預設: 1)")
+
+    history = commands.add_parser("history", help="股票每天的漲跌幅")
+    history.add_argument("ticker")
+    history.add_argument("--days", type=int, default=30, help="查詢最近幾天 (預設: 30)")
+
+    day = commands.add_parser("day", help="某天的 top_losers")
+    day.add_argument("date", help="日期 YYYY-MM-DD")
+
+    frequent = commands.add_parser("frequent", help="最常進入 top_losers 的股票")
+    frequent.add_argument("--days", type=int, default=30, help="查詢最近幾天 (預設: 30)")
+    frequent.add_argument("--limit", type=int, default=10, help="列出幾檔 (預設: 10)")
+
+    backfill = commands.add_parser("backfill", help="從 git 歷史匯入過去的 JSON API 檔案")
+    backfill.add_argument("paths", nargs="*", default=["api/top_losers.json"], help="相對於專案根目錄的路徑")
+
+    export = commands.add_parser("export", help="匯出成每天一個 NDJSON 檔案 (提交到 git 的文字版本)")
+    export.add_argument("directory", nargs="?", default=str(DEFAULT_EXPORT_DIR), help="匯出目錄 (預設: data/history)")
+
+    import_ = commands.add_parser("import", help="從匯出檔新增資料庫中沒有的快照")
+    import_.add_argument("directory", nargs="?", default=str(DEFAULT_EXPORT_DIR), help="匯出目錄 (預設: data/history)")
+
+    args = parser.parse_args()
+
+    with HistoryStore(args.db) as store:
+        started = time.perf_counter()
+        if args.command == "worst":
+            rows = store.worst_days(args.ticker, args.days, args.map, args.limit)
+            print(f"📉 {args.ticker.upper()} 過去 {args.days} 天跌最多:")
+            for row in rows:
+                print(f"   {row['date']}  {format_change(row['change'])}")
+        elif args.command == "history":
+            rows = store.ticker_history(args.ticker, args.days, args.map)
+            print(f"📈 {args.ticker.upper()} 過去 {args.days} 天:")
+            for row in rows:
+                print(f"   {row['date']}  {format_change(row['change'])}")
+        elif args.command == "day":
+            snapshot = store.losers_on(args.date, args.map)
+            rows = snapshot["top_losers"] if snapshot else []
+            if snapshot:
+                print(f"📅 {args.date} ({snapshot['source']}, {snapshot['captured_at']}):")
+            for row in rows:
+                print(f"   {row['rank']:>2}. {row['ticker'] or 'N/A'}: {format_change(row['change'])}")
+        elif args.command == "frequent":
+            rows = store.frequent_losers(args.days, args.map, args.limit)
+            print(f"🔁 過去 {args.days} 天最常進入 top_losers:")
+            for row in rows:
+                print(f"   {row['ticker']:<6} {row['days']} 天，最差 {format_change(row['worst'])}，"
+                      f"平均 {format_change(row['average'])}")
+        elif args.command == "backfill":
+            rows = None
+            print(f"📥 已從 git 歷史匯入 {store.backfill(args.paths)} 筆快照")
+        elif args.command == "export":
+            rows = None
+            written, total = store.export(args.directory)
+            print(f"📤 已匯出到 {args.directory}: {total} 個檔案，重寫 {written} 個")
+        else:
+            rows = None
+            print(f"📥 已從 {args.directory} 匯入 {store.import_export(args.directory)} 筆快照")
+        elapsed = (time.perf_counter() - started) * 1000
+
+    if rows == []:
+        print("   (沒有資料)")
+    print(f"⏱️  {elapsed:.1f} ms")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
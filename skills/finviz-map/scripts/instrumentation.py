@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Stage timing and resource instrumentation shared by the capture and analysis scripts
+
+Each script calls configure() once (behind its --metrics flag) and wraps the
+steps it wants measured in `with stage("name", map="sec") as record:`.
+Stages record wall time, the process's peak RSS and, when the caller sets
+record["bytes"], the bytes moved. Without configure() every call is a cheap
+no-op, so the scripts never need to check whether metrics are enabled.
+
+Output:
+    write_json_trace()   one JSON document with every stage
+    write_prometheus()   a node_exporter textfile collector file
+"""
+
+import json
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes, or None if unavailable."""
+    try:
+        import resource
+    except ImportError:
+        # Windows: fall back to psutil when installed
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Tracer:
+    """Collects stage records for one script run."""
+
+    def __init__(self, script):
+        self.script = script
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.monotonic()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **labels):
+        record = {
+            "name": name,
+            "labels": {k: v for k, v in labels.items() if v is not None},
+            "start_offset": round(time.monotonic() - self.started, 4),
+            "bytes": None,
+        }
+        started = time.monotonic()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            record["seconds"] = round(time.monotonic() - started, 4)
+            record["peak_rss_bytes"] = peak_rss_bytes()
+            self.stages.append(record)
+
+    def to_dict(self):
+        return {
+            "script": self.script,
+            "started_at": self.started_at.isoformat().replace("+00:00", "Z"),
+            "total_seconds": round(time.monotonic() - self.started, 4),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "bytes_total": sum(s["bytes"] or 0 for s in self.stages),
+            "stages": self.stages,
+        }
+
+
+class NullTracer:
+    """Stand-in used until configure() is called; records nothing."""
+
+    stages = []
+
+    @contextmanager
+    def stage(self, name, **labels):
+        yield {}
+
+
+_tracer = NullTracer()
+
+
+def configure(script):
+    """Start recording stages for `script` (e.g. "capture" or "analyze")."""
+    global _tracer
+    _tracer = Tracer(script)
+    return _tracer
+
+
+def enabled():
+    return isinstance(_tracer, Tracer)
+
+
+def stage(name, **labels):
+    """Context manager timing one stage; set record["bytes"] to report bytes moved."""
+    return _tracer.stage(name, **labels)
+
+
+def percentile(values, q):
+    """Linearly interpolated percentile of `values`, with q between 0 and 1."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = math.floor(position)
+    high = math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def atomic_write(path, content):
+    """Write text or bytes to a temp file next to `path`, then rename it into place."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    if isinstance(content, bytes):
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_json_trace(path):
+    """Write the trace as JSON; returns the trace dict (None when disabled)."""
+    if not enabled():
+        return None
+    trace = _tracer.to_dict()
+    atomic_write(path, json.dumps(trace, indent=2, ensure_ascii=False))
+    print(f"📈 Metrics trace saved: {path}")
+    return trace
+
+
+def prometheus_labels(labels):
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in sorted(labels.items())
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def write_prometheus(path):
+    """
+    Write the run as a Prometheus textfile (node_exporter textfile collector).
+
+    Stages that ran more than once with the same labels are summed.
+    """
+    if not enabled():
+        return
+    trace = _tracer.to_dict()
+    script = {"script": trace["script"]}
+
+    durations = {}
+    moved = {}
+    for record in trace["stages"]:
+        key = prometheus_labels({**script, "stage": record["name"], **record["labels"]})
+        durations[key] = durations.get(key, 0) + record["seconds"]
+        if record["bytes"] is not None:
+            moved[key] = moved.get(key, 0) + record["bytes"]
+
+    lines = [
+        "# HELP finviz_stage_duration_seconds Wall time of a pipeline stage in the last run.",
+        "# TYPE finviz_stage_duration_seconds gauge",
+        *(f"finviz_stage_duration_seconds{key} {value:.4f}" for key, value in durations.items()),
+        "# HELP finviz_stage_bytes Bytes moved by a pipeline stage in the last run.",
+        "# TYPE finviz_stage_bytes gauge",
+        *(f"finviz_stage_bytes{key} {value}" for key, value in moved.items()),
+        "# HELP finviz_run_duration_seconds Wall time of the last run.",
+        "# TYPE finviz_run_duration_seconds gauge",
+        f"finviz_run_duration_seconds{prometheus_labels(script)} {trace['total_seconds']:.4f}",
+        "# HELP finviz_run_timestamp_seconds Unix time the last run finished.",
+        "# TYPE finviz_run_timestamp_seconds gauge",
+        f"finviz_run_timestamp_seconds{prometheus_labels(script)} {time.time():.0f}",
+    ]
+    if trace["peak_rss_bytes"] is not None:
+        lines += [
+            "# HELP finviz_peak_rss_bytes Peak resident memory of the script process.",
+            "# TYPE finviz_peak_rss_bytes gauge",
+            f"finviz_peak_rss_bytes{prometheus_labels(script)} {trace['peak_rss_bytes']}",
+        ]
+
+    atomic_write(path, "\n".join(lines) + "\n")
+    print(f"📈 Prometheus metrics saved: {path}")
+
+
+def add_metrics_arguments(parser):
+    """Add the shared --metrics/--metrics-prom flags to an argparse parser."""
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="Record per-stage wall time, peak RSS and bytes moved to this JSON trace file"
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        metavar="PATH",
+        help="Also write the metrics as a Prometheus textfile (implies recording)"
+    )
+
+
+def setup_metrics(args, script):
+    """Enable recording if --metrics/--metrics-prom was given."""
+    if args.metrics or args.metrics_prom:
+        configure(script)
+
+
+def finish_metrics(args):
+    """Write whatever outputs --metrics/--metrics-prom asked for."""
+    if args.metrics:
+        write_json_trace(args.metrics)
+    if args.metrics_prom:
+        write_prometheus(args.metrics_prom)
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+GitHub Models 非同步客戶端
+多張地圖共用一個 httpx 連線池 (TLS 握手只做一次)，以 semaphore 限制同時請求數
+
+用法:
+    results = asyncio.run(analyze_images({"sec": "spy.png", "world": "world.png"}, token))
+
+端點可用 endpoint 參數或環境變數 GITHUB_MODELS_ENDPOINT 覆寫，
+例如指向 fixtures/mock_models_server.py 的本地模擬伺服器
+
+請求先經過 rate_limiter.RateLimiter 取得額度，429 與 5xx 依 Retry-After 重試
+
+設定 hedge_model 時，主要模型超過延遲百分位數仍未回應，就把同一個請求送給第二個模型，
+先通過驗證的回應勝出，另一個請求取消
+"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+import time
+
+from instrumentation import atomic_write, percentile, stage
+from models_common import (
+    CROP_PROMPT,
+    MODEL,
+    MODEL_PARAMS,
+    MODELS_URL,
+    PROMPT,
+    build_payload,
+    encode_image,
+    parse_model_content,
+    read_image_bytes,
+)
+from rate_limiter import (
+    DEFAULT_MAX_RETRIES,
+    RETRY_STATUSES,
+    RateLimiter,
+    backoff,
+    estimate_tokens,
+    retry_after,
+)
+from stream_parser import TopLosersStreamParser, parse_sse_line, valid_entry
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 60
+DEFAULT_STREAM_LIMIT = 10
+
+# 避險: 延遲紀錄不足 HEDGE_MIN_SAMPLES 筆時使用固定的 DEFAULT_HEDGE_DELAY 秒
+DEFAULT_HEDGE_DELAY = 10.0
+DEFAULT_HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 5
+LATENCY_HISTORY = 50
+
+
+def resolve_endpoint(endpoint=None):
+    """參數 > 環境變數 GITHUB_MODELS_ENDPOINT > 正式端點"""
+    return endpoint or os.environ.get("GITHUB_MODELS_ENDPOINT") or MODELS_URL
+
+
+def valid_result(data):
+    """回應是否符合 {"top_losers": [{"ticker", "change"}, ...]} 且至少有一筆"""
+    losers = data.get("top_losers") if isinstance(data, dict) else None
+    return isinstance(losers, list) and bool(losers) and all(valid_entry(entry) for entry in losers)
+
+
+class LatencyTracker:
+    """
+    各模型最近 LATENCY_HISTORY 次請求的延遲
+
+    每筆為 [秒數, 是否設限]: 避險勝出而被取消的主要請求只知道延遲至少有這麼久，
+    記為設限 (censored) 樣本，而不是丟掉 (否則只剩快的樣本，百分位數與避險延遲
+    會越來越小)。失敗的請求不記錄。
+    有 path 時跨次執行保存 (JSON)，讓第一次請求就能用過去的百分位數
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.samples = {}
+        if path is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    samples = json.load(f)
+                # 舊格式只有秒數 (都是完整樣本)
+                self.samples = {
+                    model: [entry if isinstance(entry, list) else [entry, False] for entry in history]
+                    for model, history in samples.items()
+                }
+            except (OSError, ValueError, AttributeError):
+                self.samples = {}
+
+    def record(self, model, seconds, censored=False):
+        """記錄一次延遲；censored 表示請求被取消，實際延遲至少是 seconds"""
+        history = self.samples.setdefault(model, [])
+        history.append([round(seconds, 3), censored])
+        del history[:-LATENCY_HISTORY]
+
+    def delay(self, model, q, fallback):
+        """
+        model 延遲的第 q 百分位數，紀錄不足時回傳 fallback
+
+        設限樣本至少與最慢的完整樣本一樣慢，因此排在所有完整樣本之後
+        """
+        history = self.samples.get(model, [])
+        if len(history) < HEDGE_MIN_SAMPLES:
+            return fallback
+        slowest = max((seconds for seconds, censored in history if not censored), default=0.0)
+        return percentile(
+            [max(seconds, slowest) if censored else seconds for seconds, censored in history], q / 100
+        )
+
+    def save(self):
+        if self.path is not None and self.samples:
+            atomic_write(self.path, json.dumps(self.samples))
+
+
+class ModelsClient:
+    """
+    共用連線池的非同步客戶端，需以 async with 使用
+
+    連線池大小與 semaphore 都是 concurrency，超過的請求排隊等待而不是開新連線
+    """
+
+    def __init__(self, api_token, endpoint=None, concurrency=DEFAULT_CONCURRENCY,
+                 timeout=DEFAULT_TIMEOUT, cache=None, payload="full",
+                 stream=False, stream_limit=DEFAULT_STREAM_LIMIT, limiter=None,
+                 max_retries=DEFAULT_MAX_RETRIES, hedge_model=None, hedge_endpoint=None,
+                 hedge_delay=DEFAULT_HEDGE_DELAY, hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+                 latency_path=None):
+        self.api_token = api_token
+        self.endpoint = resolve_endpoint(endpoint)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.payload = payload
+        self.stream = stream
+        self.stream_limit = stream_limit
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.max_retries = max_retries
+        self.hedge_model = hedge_model
+        self.hedge_endpoint = resolve_endpoint(hedge_endpoint or endpoint)
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker(latency_path)
+        self.hedge_stats = {"requests": 0, "fired": 0, "wins": {}}
+        self.client = None
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # 避險請求另有自己的名額，不必等主要請求讓出
+        self.hedge_semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        import httpx
+
+        self.client = httpx.AsyncClient(
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_token}"
+            },
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.concurrency * (2 if self.hedge_model else 1),
+                max_keepalive_connections=self.concurrency
+            ),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        self.latencies.save()
+
+    async def analyze(self, image, label="image"):
+        """
+        分析一張圖片 (路徑、位元組或 PIL Image)
+
+        Returns:
+            解析後的 JSON (dict)
+        """
+        import httpx
+
+        prefix = f"[{label}] "
+        image_bytes = read_image_bytes(image)
+        prompt = PROMPT if self.payload == "full" else CROP_PROMPT
+        cache_key = None
+        if self.cache is not None:
+            # 不同端點 (例如本機模擬伺服器) 的回答不可互相沿用
+            params = {**MODEL_PARAMS, "payload": self.payload, "endpoint": self.endpoint}
+            if self.stream:
+                # 提前結束的串流結果只有 stream_limit 筆
+                params["stream_limit"] = self.stream_limit
+            if self.hedge_model:
+                # 結果可能來自第二個模型
+                params["hedge_model"] = self.hedge_model
+                params["hedge_endpoint"] = self.hedge_endpoint
+            cache_key = self.cache.key(image_bytes, prompt, MODEL, params)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"{prefix}💾 使用快取的分析結果 ({cache_key[:12]})，不呼叫 API")
+                return cached
+
+        body = self.build_body(image_bytes, prefix)
+        tokens = estimate_tokens(body, MODEL_PARAMS["max_tokens"])
+
+        for attempt in range(1, self.max_retries + 2):
+            await self.limiter.acquire(tokens, prefix)
+            try:
+                if self.hedge_model:
+                    data = await self.hedged_request(body, label, prefix, tokens, attempt)
+                else:
+                    # 沒有避險時也記錄延遲，開啟避險時就有百分位數可用
+                    started = time.monotonic()
+                    data = await self.request(body, label, prefix, tokens, attempt)
+                    self.latencies.record(MODEL, time.monotonic() - started)
+                break
+            except httpx.HTTPError as e:
+                delay = self.retry_delay(e, attempt, prefix)
+                if delay is None:
+                    print(f"{prefix}❌ API 請求失敗: {e}")
+                    if isinstance(e, httpx.HTTPStatusError):
+                        print(f"{prefix}回應內容: {e.response.text}")
+                    raise
+                reason = (f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError)
+                          else e.__class__.__name__)
+                print(f"{prefix}🔁 {reason}，{delay:.1f}s 後重試 ({attempt}/{self.max_retries})")
+                await asyncio.sleep(delay)
+
+        if self.cache is not None:
+            self.cache.put(cache_key, data, MODEL)
+        return data
+
+    async def request(self, body, label, prefix, tokens, attempt=1, model=None, hedge=False):
+        """送出一次請求並解析回應；hedge 為 True 時使用避險端點與名額"""
+        endpoint = self.hedge_endpoint if hedge else self.endpoint
+        async with (self.hedge_semaphore if hedge else self.semaphore):
+            print(f"{prefix}📤 正在呼叫 GitHub Models API{f' ({model})' if model else ''}"
+                  f"{' (串流)' if self.stream else ''}...")
+            with stage("request", image=label, stream=self.stream or None, model=model,
+                       attempt=attempt if attempt > 1 else None) as record:
+                if self.stream:
+                    return await self.stream_completion(body, prefix, record, endpoint)
+                response = await self.client.post(endpoint, content=body)
+                self.limiter.update(response.headers)
+                response.raise_for_status()
+                # 送出與收到的位元組數
+                record["bytes"] = len(body) + len(response.content)
+
+        completion = response.json()
+        self.limiter.refund(tokens, (completion.get("usage") or {}).get("total_tokens"))
+        content = completion["choices"][0]["message"]["content"]
+        print(f"{prefix}✅ API 呼叫成功")
+        print(f"{prefix}📝 回應內容:\n{content}\n")
+        return parse_model_content(content)
+
+    async def hedged_request(self, body, label, prefix, tokens, attempt=1):
+        """
+        先送主要模型；超過延遲百分位數仍未回應時，同一個請求再送給 hedge_model
+
+        先回來且通過 valid_result 的回應勝出，另一個取消。避險送出後兩邊都失敗
+        才拋出例外 (交給重試)；避險送出前主要模型就失敗則直接拋出
+
+        主要模型的延遲每次都記錄: 有回應時為實際延遲，被取消時為設限樣本
+        """
+        delay = self.latencies.delay(MODEL, self.hedge_percentile, self.hedge_delay)
+        self.hedge_stats["requests"] += 1
+        started = time.monotonic()
+
+        def record_primary(task):
+            if task.cancelled():
+                self.latencies.record(MODEL, time.monotonic() - started, censored=True)
+            elif task.exception() is None:
+                self.latencies.record(MODEL, time.monotonic() - started)
+
+        primary = asyncio.create_task(self.request(body, label, prefix, tokens, attempt, MODEL))
+        primary.add_done_callback(record_primary)
+        tasks = {primary: MODEL}
+        pending = set(tasks)
+        hedged = False
+        errors = []
+
+        try:
+            while pending:
+                timeout = None if hedged else max(0.0, delay - (time.monotonic() - started))
+                done, pending = await asyncio.wait(pending, timeout=timeout,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    self.hedge_stats["fired"] += 1
+                    print(f"{prefix}🪁 {MODEL} 超過 {delay:.1f}s 未回應，同時送給 {self.hedge_model}")
+                    await self.limiter.acquire(tokens, prefix)
+                    hedge = asyncio.create_task(self.request(
+                        self.for_model(body, self.hedge_model), label, prefix, tokens, attempt,
+                        self.hedge_model, hedge=True
+                    ))
+                    tasks[hedge] = self.hedge_model
+                    pending.add(hedge)
+                    continue
+
+                for task in done:
+                    model = tasks[task]
+                    error = task.exception()
+                    if error is None and valid_result(task.result()):
+                        wins = self.hedge_stats["wins"]
+                        wins[model] = wins.get(model, 0) + 1
+                        if hedged:
+                            print(f"{prefix}🏁 {model} 先回應 ({time.monotonic() - started:.2f}s)")
+                        return task.result()
+                    if error is None:
+                        print(f"{prefix}⚠️  {model} 的回應不符合格式")
+                        error = ValueError(f"{model} 的回應沒有有效的 top_losers")
+                    errors.append(error)
+                if not hedged:
+                    raise errors[0]
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    @staticmethod
+    def for_model(body, model):
+        """同一個請求本文改送給另一個模型"""
+        payload = json.loads(body)
+        payload["model"] = model
+        return json.dumps(payload).encode("utf-8")
+
+    def hedge_report(self):
+        stats = self.hedge_stats
+        if not self.hedge_model or not stats["requests"]:
+            return
+        wins = "、".join(f"{model} {count}" for model, count in stats["wins"].items()) or "無"
+        print(f"🪁 避險: {stats['requests']} 次請求中觸發 {stats['fired']} 次，勝出: {wins}")
+
+    def retry_delay(self, error, attempt, prefix=""):
+        """
+        第 attempt 次失敗後的等待秒數，不應重試時回傳 None
+
+        429/5xx 依 Retry-After，沒有時用指數退避；連線錯誤與逾時也重試。
+        429 會讓所有排隊中的請求一起暫停
+        """
+        import httpx
+
+        if attempt > self.max_retries:
+            return None
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            if status not in RETRY_STATUSES:
+                return None
+            delay = retry_after(error.response.headers)
+            if delay is None:
+                delay = backoff(attempt)
+            if status == 429:
+                self.limiter.pause(delay)
+        elif isinstance(error, httpx.TransportError):
+            delay = backoff(attempt)
+        else:
+            return None
+
+        if delay > self.limiter.max_wait:
+            print(f"{prefix}⚠️  伺服器要求等待 {delay:.0f}s，超過上限 {self.limiter.max_wait:.0f}s，不再重試")
+            return None
+        return delay
+
+    async def stream_completion(self, body, prefix, record, endpoint=None):
+        """
+        以 SSE 串流接收回應，邊收邊解析 top_losers
+
+        取得 stream_limit 筆有效項目或 top_losers 陣列結束 (讀到 "]") 就關閉連線，
+        之後的 token (結尾的 ``` 與說明文字) 不再產生；
+        串流在陣列結束前中斷時改用完整解析，失敗才使用已解析的項目
+        """
+        parser = TopLosersStreamParser()
+        started = time.monotonic()
+        received = 0
+        stopped_early = False
+        first_entry = None
+
+        async with self.client.stream("POST", endpoint or self.endpoint, content=body) as response:
+            self.limiter.update(response.headers)
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                received += len(line.encode("utf-8")) + 1
+                chunk = parse_sse_line(line)
+                if chunk is None:
+                    break
+                if parser.feed(chunk) and first_entry is None:
+                    first_entry = time.monotonic() - started
+                    print(f"{prefix}⚡ 第一筆結果: {first_entry:.2f}s")
+                if len(parser.entries) >= self.stream_limit or parser.closed:
+                    stopped_early = True
+                    break
+
+        elapsed = time.monotonic() - started
+        record["bytes"] = len(body) + received
+        record["first_entry_seconds"] = first_entry
+
+        if stopped_early:
+            reason = "陣列已結束" if parser.closed else f"已達上限 {self.stream_limit} 筆"
+            print(f"{prefix}✂️  已取得 {len(parser.entries)} 筆 ({reason})，提前結束串流 ({elapsed:.2f}s)")
+            return {"top_losers": parser.entries}
+
+        print(f"{prefix}✅ 串流完成 ({elapsed:.2f}s)")
+        print(f"{prefix}📝 回應內容:\n{parser.text}\n")
+        try:
+            return parse_model_content(parser.text)
+        except ValueError:
+            if not parser.entries:
+                raise
+            print(f"{prefix}⚠️  完整解析失敗，使用串流中已解析的 {len(parser.entries)} 筆")
+            return {"top_losers": parser.entries}
+
+    def encode_payload(self, payload):
+        if self.stream:
+            payload["stream"] = True
+        return json.dumps(payload).encode("utf-8")
+
+    def build_body(self, image_bytes, prefix=""):
+        """
+        依 payload 模式組成請求本文
+
+        mosaic/parts 只送最紅方塊的標籤裁切，並回報與整張圖相比的大小；
+        找不到候選方塊時改送整張圖
+        """
+        if self.payload == "full":
+            return self.encode_payload(build_payload(encode_image(image_bytes)))
+
+        # 裁切需要 NumPy，只在 mosaic/parts 模式才載入
+        from vision_crops import shrink_images
+
+        with stage("shrink", mode=self.payload) as record:
+            parts = shrink_images(io.BytesIO(image_bytes), self.payload)
+            record["bytes"] = sum(len(part) for part in parts)
+        if not parts:
+            print(f"{prefix}⚠️  找不到候選方塊或飽和方塊太多，改送整張圖")
+            return self.encode_payload(build_payload(encode_image(image_bytes)))
+
+        payload = build_payload([base64.b64encode(part).decode("utf-8") for part in parts], CROP_PROMPT)
+        body = self.encode_payload(payload)
+        # 整張圖的請求大小: 空圖片的請求加上 base64 後的圖片長度
+        full_bytes = len(json.dumps(build_payload("")).encode("utf-8")) + 4 * -(-len(image_bytes) // 3)
+        print(f"{prefix}📦 請求大小: {full_bytes:,} → {len(body):,} bytes "
+              f"({1 - len(body) / full_bytes:.0%} 較小，{len(parts)} 張圖片)")
+        return body
+
+    async def analyze_many(self, images):
+        """
+        同時分析多張圖片
+
+        Args:
+            images: 名稱 -> 圖片 的 dict
+
+        Returns:
+            名稱 -> 結果 dict 或例外 (單張失敗不影響其他圖片)
+        """
+        results = await asyncio.gather(
+            *(self.analyze(image, label) for label, image in images.items()),
+            return_exceptions=True
+        )
+        self.hedge_report()
+        return dict(zip(images, results))
+
+
+async def analyze_images(images, api_token, endpoint=None, concurrency=DEFAULT_CONCURRENCY, **options):
+    """
+    以共用連線池分析多張圖片，回傳 名稱 -> 結果或例外
+
+    options (cache、payload、stream、limiter、hedge_model...) 直接傳給 ModelsClient
+    """
+    async with ModelsClient(api_token, endpoint, concurrency, **options) as client:
+        return await client.analyze_many(images)
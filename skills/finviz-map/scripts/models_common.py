@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+視覺模型請求的共用設定
+模型、提示詞、請求內容與回應解析，analyze_map 與 models_client 都從這裡匯入，
+彼此不必互相匯入 (analyze_map 以 __main__ 執行時再被匯入會載入第二份模組)
+"""
+
+import base64
+import io
+import json
+
+from instrumentation import stage
+
+# GitHub Models API endpoint
+# 使用 gpt-4o 模型 (支援 vision)
+MODELS_URL = "https://models.inference.ai.azure.com/chat/completions"
+MODEL = "gpt-4o"
+
+# 模型參數，連同提示詞與模型一起作為分析快取的鍵
+MODEL_PARAMS = {
+    "max_tokens": 1000,
+    "temperature": 0.1  # 降低溫度以獲得更準確的結果
+}
+
+# 構建提示詞
+PROMPT = """分析這張 Finviz 市場地圖截圖。
+
+這是一個股票市場熱力圖，每個方塊代表一個股票：
+- 紅色方塊 = 下跌的股票
+- 綠色方塊 = 上漲的股票
+- 每個方塊顯示股票代碼和漲跌幅百分比
+
+請找出跌幅最大的十檔股票（最紅/最深紅色的方塊）。如果不足十檔，則返回所有符合條件的股票。
+
+要求：
+1. 只返回 JSON 格式，不要其他文字
+2. JSON 格式如下：
+{
+  "top_losers": [
+    {"ticker": "股票代碼", "change": "跌幅百分比"},
+    ...
+  ]
+}
+
+3. 跌幅應該是負數（例如 "-2.10%"）
+4. 按跌幅從大到小排序（最大跌幅在前）
+5. 準確識別每個方塊上的文字"""
+
+
+CROP_PROMPT = """這是一張 Finviz 市場熱力圖中跌幅最大方塊的標籤裁切圖。
+
+每個格子是一個 (或幾個相鄰) 方塊上的文字：第一行是股票代碼，第二行是漲跌幅百分比。
+
+請讀出每個格子的股票代碼與漲跌幅，找出跌幅最大的十檔股票。如果不足十檔，則返回所有讀到的股票。
+
+要求：
+1. 只返回 JSON 格式，不要其他文字
+2. JSON 格式如下：
+{
+  "top_losers": [
+    {"ticker": "股票代碼", "change": "跌幅百分比"},
+    ...
+  ]
+}
+
+3. 跌幅應該是負數（例如 "-2.10%"）
+4. 按跌幅從大到小排序（最大跌幅在前）
+5. 準確識別每個格子上的文字"""
+
+
+def read_image_bytes(image):
+    """
+    取得圖片的 PNG 位元組
+
+    image 可以是檔案路徑、已讀出的位元組，或截圖程式直接從 canvas 讀出的
+    記憶體圖片 (PIL Image)，後者只在記憶體中編碼，不經過檔案寫入與讀取
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if hasattr(image, "save"):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+    with open(image, "rb") as image_file:
+        return image_file.read()
+
+
+def encode_image(image):
+    """將圖片 (路徑、位元組或 PIL Image) 編碼為 base64 字串"""
+    with stage("encode") as record:
+        encoded = base64.b64encode(read_image_bytes(image)).decode("utf-8")
+        record["bytes"] = len(encoded)
+    return encoded
+
+
+def build_payload(base64_images, prompt=PROMPT):
+    """組成 chat completions 請求內容；base64_images 可為單張或多張 (多個圖片部分)"""
+    if isinstance(base64_images, str):
+        base64_images = [base64_images]
+    return {
+        "model": MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    *(
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/png;base64,{base64_image}"
+                            }
+                        }
+                        for base64_image in base64_images
+                    )
+                ]
+            }
+        ],
+        **MODEL_PARAMS
+    }
+
+
+def parse_model_content(content):
+    """從模型回應文字中解析 JSON"""
+    # 有時 AI 會在 JSON 外包裝 markdown 代碼區塊
+    raw = content
+    if "```json" in content:
+        content = content.split("```json")[1].split("```")[0].strip()
+    elif "```" in content:
+        content = content.split("```")[1].split("```")[0].strip()
+
+    try:
+        with stage("parse"):
+            return json.loads(content)
+    except json.JSONDecodeError as e:
+        print(f"❌ JSON 解析失敗: {e}")
+        print(f"原始內容: {raw}")
+        raise
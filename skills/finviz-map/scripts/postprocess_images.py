@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Finviz Map Image Post-Processing
+Writes optimized PNG, WebP/AVIF variants, downscaled sizes and thumbnails for
+captured maps in a process pool, plus a manifest of sizes and hashes
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from instrumentation import atomic_write
+
+# Fix Windows console encoding issues. Changed in place, as in
+# capture_canvas_playwright (imported by --html), so neither module's import
+# leaves a replaced wrapper behind to close the shared buffer
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+# (suffix, format, max width) for every variant; None keeps full size
+VARIANTS = [
+    ("", "png", None),
+    ("", "webp", None),
+    ("", "avif", None),
+    ("-1280w", "webp", 1280),
+    ("-1280w", "avif", 1280),
+    ("-800w", "webp", 800),
+    ("-800w", "avif", 800),
+    ("-480w", "webp", 480),
+    ("-480w", "avif", 480),
+    ("-thumb", "webp", 320),
+]
+
+SAVE_OPTIONS = {
+    "png": {"format": "PNG", "optimize": True},
+    "webp": {"format": "WEBP", "lossless": True, "method": 4},
+    "avif": {"format": "AVIF", "quality": 60},
+}
+
+# Downscaled variants are lossy, the text stays readable at these settings
+RESIZED_SAVE_OPTIONS = {
+    "webp": {"format": "WEBP", "quality": 82, "method": 4},
+}
+
+MIME_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+
+def sha256_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def supported_formats():
+    """Formats this Pillow build can write."""
+    from PIL import features
+
+    return {fmt for fmt in SAVE_OPTIONS if fmt == "png" or features.check(fmt)}
+
+
+def render_variant(source_path, output_path, fmt, max_width):
+    """
+    Encode one variant of `source_path` (runs in a worker process).
+
+    A full-size PNG that Pillow can't make smaller than the source isn't
+    written; its manifest entry points at the source instead of a copy.
+
+    Returns:
+        Manifest entry for the written file
+    """
+    from PIL import Image
+
+    started = time.monotonic()
+    resized = False
+    with Image.open(source_path) as image:
+        image = image.convert("RGB")
+        if max_width and image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            image = image.resize((max_width, height), Image.LANCZOS)
+            options = RESIZED_SAVE_OPTIONS.get(fmt, SAVE_OPTIONS[fmt])
+            resized = True
+        else:
+            options = SAVE_OPTIONS[fmt]
+
+        buffer = io.BytesIO()
+        image.save(buffer, **options)
+
+    data = buffer.getvalue()
+    if fmt == "png" and not resized and os.path.getsize(source_path) <= len(data):
+        # Browser PNGs are sometimes already tighter than Pillow's optimizer
+        data = Path(source_path).read_bytes()
+        Path(output_path).unlink(missing_ok=True)
+        output_path = source_path
+    else:
+        atomic_write(output_path, data)
+
+    return {
+        "path": str(output_path),
+        "format": fmt,
+        "mime_type": MIME_TYPES[fmt],
+        "width": image.width,
+        "height": image.height,
+        "bytes": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"maps": {}}
+
+
+def postprocess_images(image_paths, output_dir, root_dir, workers=None, force=False):
+    """
+    Write all variants for `image_paths` under `output_dir/<stem>/` in a process pool.
+
+    Maps whose source hash matches the existing manifest (and whose variant
+    files still exist) are skipped unless `force` is set.
+
+    Returns:
+        The updated manifest dict
+    """
+    output_dir = Path(output_dir)
+    root_dir = Path(root_dir)
+    manifest_path = output_dir / "manifest.json"
+    manifest = load_manifest(manifest_path)
+    formats = supported_formats()
+    skipped_formats = {fmt for _, fmt, _ in VARIANTS} - formats
+    if skipped_formats:
+        print(f"⚠️  Pillow can't write {', '.join(sorted(skipped_formats))}, skipping those variants")
+
+    jobs = {}
+    sources = {}
+    for image_path in map(Path, image_paths):
+        stem = image_path.stem
+        source_sha = sha256_file(image_path)
+        previous = manifest["maps"].get(stem)
+        if (not force and previous and previous.get("source_sha256") == source_sha
+                and all((root_dir / v["path"]).exists() for v in previous["variants"])):
+            print(f"[{stem}] ⏭️  Unchanged since last run, keeping variants")
+            continue
+
+        (output_dir / stem).mkdir(parents=True, exist_ok=True)
+        sources[stem] = {
+            "source": image_path.relative_to(root_dir).as_posix(),
+            "source_bytes": image_path.stat().st_size,
+            "source_sha256": source_sha,
+        }
+        for suffix, fmt, max_width in VARIANTS:
+            if fmt in formats:
+                output_path = output_dir / stem / f"{stem}{suffix}.{fmt}"
+                jobs[(stem, suffix, fmt)] = (str(image_path), str(output_path), fmt, max_width)
+
+    if not jobs:
+        return manifest
+
+    started = time.monotonic()
+    results = {stem: [] for stem in sources}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {key: pool.submit(render_variant, *args) for key, args in jobs.items()}
+        for (stem, _, _), future in futures.items():
+            entry = future.result()
+            entry["path"] = Path(entry["path"]).relative_to(root_dir).as_posix()
+            results[stem].append(entry)
+
+    for stem, variants in results.items():
+        manifest["maps"][stem] = {**sources[stem], "variants": variants}
+        full_width = max(v["width"] for v in variants)
+        smallest = min((v for v in variants if v["width"] == full_width), key=lambda v: v["bytes"])
+        saved = 1 - smallest["bytes"] / sources[stem]["source_bytes"]
+        print(f"[{stem}] ✓ {len(variants)} variants, full size as small as "
+              f"{smallest['bytes']:,} bytes ({smallest['format']}, {saved:.0%} smaller)")
+
+    print(f"⏱️  {len(jobs)} variants encoded in {time.monotonic() - started:.2f}s")
+
+    manifest["generated_at"] = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    atomic_write(manifest_path, json.dumps(manifest, indent=2, ensure_ascii=False))
+    print(f"✓ Manifest saved: {manifest_path}")
+    return manifest
+
+
+def picture_sources(map_manifest):
+    """<source> entries (mime type, srcset) for a map, best format first."""
+    sources = []
+    for fmt in ("avif", "webp"):
+        variants = [
+            v for v in map_manifest["variants"]
+            if v["format"] == fmt and "-thumb" not in v["path"]
+        ]
+        if variants:
+            srcset = ", ".join(f"{v['path']} {v['width']}w" for v in sorted(variants, key=lambda v: v["width"]))
+            sources.append((MIME_TYPES[fmt], srcset))
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write optimized, WebP/AVIF and downscaled variants of captured Finviz maps"
+    )
+    parser.add_argument(
+        "images",
+        nargs="*",
+        default=["spy.png"],
+        help="PNG files relative to the project root (default: spy.png)"
+    )
+    parser.add_argument(
+        "-o", "--output-dir",
+        default="img",
+        help="Directory for variants and manifest.json, relative to the project root (default: img)"
+    )
+    parser.add_argument(
+        "-j", "--workers",
+        type=int,
+        help="Worker processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-encode even if the source image is unchanged"
+    )
+    parser.add_argument(
+        "--html",
+        action="store_true",
+        help="Rewrite index.html with a <picture> that serves AVIF/WebP at the viewer's size"
+    )
+
+    args = parser.parse_args()
+
+    root_dir = Path(__file__).parent.parent.parent.parent.resolve()
+    image_paths = [root_dir / image for image in args.images]
+    missing = [str(p) for p in image_paths if not p.exists()]
+    if missing:
+        print(f"❌ Image not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    print(f"🖼️  Finviz Map Post-Processing")
+    print(f"Images: {', '.join(args.images)}")
+    print(f"Output: {root_dir / args.output_dir}\n")
+
+    manifest = postprocess_images(
+        image_paths, root_dir / args.output_dir, root_dir, workers=args.workers, force=args.force
+    )
+
+    if args.html:
+        from capture_canvas_playwright import create_html
+
+        first = image_paths[0]
+        create_html(
+            str(root_dir / "index.html"), first.name,
+            sources=picture_sources(manifest["maps"][first.stem])
+        )
+
+    print(f"\n🎉 Done!")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
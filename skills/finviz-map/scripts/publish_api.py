@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Static API Publishing
+Writes sharded JSON endpoints from the snapshot history for GitHub Pages:
+
+    api/latest.json              newest snapshot of every map
+    api/daily/YYYY-MM-DD.json    that day's snapshot of every map
+    api/tickers/<TICKER>.json    one ticker's daily change history
+    api/manifest.json            sha256 and sizes of every shard
+
+Shards are minified, and those of 1KB or more get gzip (.gz) and brotli
+(.br) variants next to them. Each run only builds the shards that snapshots
+newer than the manifest touch: that day's shard, latest.json and the ticker
+shards with new rows, which are merged into the shard already on disk. A
+shard is only rewritten when its content hash differs from the manifest,
+so past days stay untouched and clients can skip anything whose hash they
+already have.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Fix Windows console encoding issues
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+from history_store import DEFAULT_PATH as DEFAULT_HISTORY_PATH, HistoryStore
+from instrumentation import atomic_write
+
+API_VERSION = "1.0"
+
+MIN_COMPRESS_BYTES = 1024
+
+
+def brotli_module():
+    """The brotli module, or None when it isn't installed."""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def minify(document):
+    return json.dumps(document, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def ticker_filename(ticker):
+    return ticker.replace("/", "-") + ".json"
+
+
+class StaleShard(Exception):
+    """A shard on disk doesn't match the manifest, so new rows can't be merged into it."""
+
+
+def build_shards(store, since=0, load=None):
+    """
+    Documents of the shards touched by snapshots after `since`, keyed by path
+    relative to the API directory; since=0 builds every shard.
+
+    Daily shards and latest.json are rebuilt from the database, which only
+    costs the affected days. Ticker shards get the new rows merged into the
+    document that load(name) returns, so their history isn't reread.
+
+    Documents carry no timestamps of their own, so an unchanged shard hashes
+    the same from run to run.
+    """
+    shards = {}
+    for date, map_type, data in store.daily_snapshots(since):
+        daily = shards.setdefault(f"daily/{date}.json", {"version": API_VERSION, "date": date, "maps": {}})
+        daily["maps"][map_type] = data
+
+    latest = {map_type: {"date": date, **data} for date, map_type, data in store.latest_snapshots()}
+    if latest:
+        shards["latest.json"] = {"version": API_VERSION, "maps": latest}
+
+    rows = {}
+    for ticker, map_type, date, change in store.all_ticker_changes(since):
+        if ticker:
+            rows.setdefault(f"tickers/{ticker_filename(ticker)}", (ticker, {}))[1] \
+                .setdefault(map_type, {})[date] = change
+
+    for name, (ticker, maps) in rows.items():
+        shard = (load(name) if since else None) or {"version": API_VERSION, "ticker": ticker, "maps": {}}
+        for map_type, changes in maps.items():
+            merged = dict(shard["maps"].get(map_type, []))
+            merged.update(changes)
+            shard["maps"][map_type] = [[date, merged[date]] for date in sorted(merged)]
+        shards[name] = shard
+    return shards
+
+
+def compressed(data):
+    """Whether a shard gets .gz/.br variants; below this size they don't pay for themselves."""
+    return len(data) >= MIN_COMPRESS_BYTES
+
+
+def write_variants(path, data, brotli=None):
+    """Write the minified file and its compressed variants; returns their sizes."""
+    atomic_write(path, data)
+    sizes = {"bytes": len(data)}
+    if not compressed(data):
+        for suffix in (".gz", ".br"):
+            path.with_name(path.name + suffix).unlink(missing_ok=True)
+        return sizes
+    # mtime=0 keeps the gzip bytes identical for identical content
+    compressed_data = gzip.compress(data, compresslevel=9, mtime=0)
+    atomic_write(path.with_name(path.name + ".gz"), compressed_data)
+    sizes["gzip_bytes"] = len(compressed_data)
+    if brotli is not None:
+        compressed_data = brotli.compress(data, quality=11)
+        atomic_write(path.with_name(path.name + ".br"), compressed_data)
+        sizes["br_bytes"] = len(compressed_data)
+    return sizes
+
+
+def variant_paths(path, entry=None, brotli=None):
+    """The files a shard consists of; with a manifest entry, only the variants it has."""
+    paths = [path]
+    if entry is None or "gzip_bytes" in entry:
+        paths.append(path.with_name(path.name + ".gz"))
+    if brotli is not None and (entry is None or "br_bytes" in entry):
+        paths.append(path.with_name(path.name + ".br"))
+    return paths
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def shard_loader(output_dir, manifest):
+    """load(name) for build_shards: the shard on disk, checked against its manifest hash."""
+    def load(name):
+        entry = manifest["files"].get(name)
+        if entry is None:
+            return None
+        try:
+            data = (output_dir / name).read_bytes()
+        except OSError:
+            raise StaleShard(name)
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise StaleShard(name)
+        return json.loads(data)
+    return load
+
+
+def publish_api(store, output_dir, force=False):
+    """
+    Write every shard whose content changed, then the manifest.
+
+    The manifest records the newest snapshot id it covers. The next run only
+    builds the shards that newer snapshots touch and keeps the other entries;
+    --force, a missing manifest or a shard that no longer matches its hash
+    rebuilds everything.
+
+    Returns:
+        (manifest dict, number of shards written)
+    """
+    output_dir = Path(output_dir)
+    manifest_path = output_dir / "manifest.json"
+    manifest = load_manifest(manifest_path)
+    brotli = brotli_module()
+    if brotli is None:
+        print("⚠️  brotli isn't installed, skipping .br variants")
+
+    started = time.monotonic()
+    last_id = store.latest_snapshot_id()
+    since = 0 if force else manifest.get("last_snapshot_id", 0)
+    if since and since >= last_id:
+        print(f"✓ No new snapshots since #{since}, nothing to publish")
+        return manifest, 0
+    # The brotli setting changed since the last run: every variant has to be redone
+    if since and any(("br_bytes" in entry) != (brotli is not None and "gzip_bytes" in entry)
+                     for entry in manifest["files"].values()):
+        since = 0
+
+    try:
+        shards = build_shards(store, since, shard_loader(output_dir, manifest))
+    except StaleShard as e:
+        print(f"⚠️  {e} doesn't match the manifest, rebuilding every shard")
+        since = 0
+        manifest = {"files": {}}
+        shards = build_shards(store)
+
+    files = dict(manifest["files"]) if since else {}
+    written = 0
+    for name, document in sorted(shards.items()):
+        data = minify(document)
+        digest = hashlib.sha256(data).hexdigest()
+        path = output_dir / name
+        previous = manifest["files"].get(name)
+        if (not force and previous and previous["sha256"] == digest
+                and ("br_bytes" in previous) == (brotli is not None and compressed(data))
+                and all(p.exists() for p in variant_paths(path, previous, brotli))):
+            files[name] = previous
+        else:
+            files[name] = {"sha256": digest, **write_variants(path, data, brotli)}
+            written += 1
+
+    total = {"bytes": 0, "gzip_bytes": 0, "br_bytes": 0}
+    for entry in files.values():
+        for key in total:
+            total[key] += entry.get(key, 0)
+    print(f"✓ {written} of {len(shards)} affected shards rewritten ({len(files)} total) "
+          f"in {time.monotonic() - started:.2f}s")
+    if files:
+        print(f"   {total['bytes']:,} bytes minified, {total['gzip_bytes']:,} gzip"
+              + (f", {total['br_bytes']:,} brotli" if brotli is not None else ""))
+
+    manifest = {
+        "version": API_VERSION,
+        "generated_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "last_snapshot_id": last_id,
+        "files": files,
+    }
+    write_variants(manifest_path, minify(manifest), brotli)
+    print(f"✓ Manifest saved: {manifest_path}")
+    return manifest, written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write sharded, precompressed static API files from the snapshot history"
+    )
+    parser.add_argument(
+        "--history",
+        default=str(DEFAULT_HISTORY_PATH),
+        help="Snapshot history database (default: data/history.sqlite)"
+    )
+    parser.add_argument(
+        "-o", "--output-dir",
+        default="api",
+        help="API directory, relative to the project root (default: api)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rewrite every shard even if its content is unchanged"
+    )
+    args = parser.parse_args()
+
+    root_dir = Path(__file__).parent.parent.parent.parent.resolve()
+    if not Path(args.history).exists():
+        print(f"❌ History database not found: {args.history}")
+        sys.exit(1)
+
+    print(f"📡 Static API Publishing")
+    print(f"History: {args.history}")
+    print(f"Output: {root_dir / args.output_dir}\n")
+
+    with HistoryStore(args.history) as store:
+        publish_api(store, root_dir / args.output_dir, force=args.force)
+
+    print(f"\n🎉 Done!")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
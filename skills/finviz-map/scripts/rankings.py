@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+地圖資料的完整排名
+把每個方塊的代碼、產業、市值與漲跌幅存成欄式表格 (NumPy 陣列)，
+以一次掃描維護多個大小為 k 的堆積 (O(n log k))，同時得到跌幅、漲幅、
+市值變動最大的股票，產業彙總則以 np.bincount 依產業代碼累加
+
+    table = TileTable.from_tiles(map_data["tiles"])
+    sections = rank_tiles(table, k=10)
+    # {"top_losers", "top_gainers", "biggest_movers", "sectors", "breadth"}
+"""
+
+import heapq
+
+import numpy as np
+
+DEFAULT_K = 10
+
+UNKNOWN_SECTOR = "Unknown"
+
+
+class TileTable:
+    """
+    欄式方塊表格: 每個欄位一個等長陣列
+
+    tickers 為字串陣列，sector_codes 指向 sectors 中的產業名稱，
+    market_cap 與 change 缺值時為 NaN
+    """
+
+    def __init__(self, tickers, sectors, sector_codes, industries, market_cap, change):
+        self.tickers = tickers
+        self.sectors = sectors
+        self.sector_codes = sector_codes
+        self.industries = industries
+        self.market_cap = market_cap
+        self.change = change
+
+    @classmethod
+    def from_tiles(cls, tiles):
+        """由地圖資料的方塊列表 (list of dict) 建立"""
+        tickers = np.array([tile["ticker"] for tile in tiles], dtype=object)
+        sectors, sector_codes = np.unique(
+            np.array([tile.get("sector") or UNKNOWN_SECTOR for tile in tiles], dtype=object),
+            return_inverse=True
+        )
+        industries = np.array([tile.get("industry") for tile in tiles], dtype=object)
+        market_cap = np.array(
+            [np.nan if tile.get("market_cap") is None else tile["market_cap"] for tile in tiles],
+            dtype=np.float64
+        )
+        change = np.array(
+            [np.nan if tile.get("change") is None else tile["change"] for tile in tiles],
+            dtype=np.float64
+        )
+        return cls(tickers, sectors, sector_codes.astype(np.int32), industries, market_cap, change)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def row(self, index):
+        return {
+            "ticker": self.tickers[index],
+            "sector": self.sectors[self.sector_codes[index]],
+            "industry": self.industries[index],
+            "market_cap": None if np.isnan(self.market_cap[index]) else float(self.market_cap[index]),
+            "change": None if np.isnan(self.change[index]) else float(self.change[index]),
+        }
+
+
+def format_change(change):
+    return f"{change:.2f}%"
+
+
+def top_k(table, k=DEFAULT_K):
+    """
+    一次掃描同時維護三個大小為 k 的最小堆積
+
+    losers 以 -change、gainers 以 change、movers 以 |市值變動| 為鍵，
+    同值時以索引決定順序 (與穩定排序相同)
+
+    Returns:
+        (losers, gainers, movers) 三個索引列表，各自由最極端到最不極端
+    """
+    losers, gainers, movers = [], [], []
+    dollar_change = table.market_cap * table.change / 100
+    for index, (change, dollars) in enumerate(zip(table.change.tolist(), dollar_change.tolist())):
+        if change != change:  # NaN
+            continue
+        if change < 0:
+            item = (-change, -index)
+            if len(losers) < k:
+                heapq.heappush(losers, item)
+            elif item > losers[0]:
+                heapq.heapreplace(losers, item)
+        elif change > 0:
+            item = (change, -index)
+            if len(gainers) < k:
+                heapq.heappush(gainers, item)
+            elif item > gainers[0]:
+                heapq.heapreplace(gainers, item)
+        if dollars == dollars and dollars != 0:
+            item = (abs(dollars), -index)
+            if len(movers) < k:
+                heapq.heappush(movers, item)
+            elif item > movers[0]:
+                heapq.heapreplace(movers, item)
+
+    return tuple([-index for _, index in sorted(heap, reverse=True)] for heap in (losers, gainers, movers))
+
+
+def sector_aggregates(table):
+    """各產業的檔數、平均與市值加權漲跌幅、總市值、上漲/下跌檔數與跌最多的股票"""
+    valid = ~np.isnan(table.change)
+    if not valid.any():
+        return []
+    codes = table.sector_codes[valid]
+    change = table.change[valid]
+    cap = np.nan_to_num(table.market_cap[valid])
+    size = len(table.sectors)
+
+    count = np.bincount(codes, minlength=size)
+    change_sum = np.bincount(codes, weights=change, minlength=size)
+    cap_sum = np.bincount(codes, weights=cap, minlength=size)
+    weighted_sum = np.bincount(codes, weights=cap * change, minlength=size)
+    advancers = np.bincount(codes, weights=change > 0, minlength=size)
+    decliners = np.bincount(codes, weights=change < 0, minlength=size)
+
+    # 每個產業跌最多的方塊: 依 (產業, 漲跌幅) 排序後取每個產業的第一筆
+    indexes = np.flatnonzero(valid)
+    order = indexes[np.lexsort((table.change[indexes], table.sector_codes[indexes]))]
+    first = np.flatnonzero(np.r_[True, np.diff(table.sector_codes[order]) != 0])
+    worst = {int(table.sector_codes[order[i]]): order[i] for i in first}
+
+    sectors = []
+    for code in np.flatnonzero(count):
+        sectors.append({
+            "sector": table.sectors[code],
+            "count": int(count[code]),
+            "average_change": round(float(change_sum[code] / count[code]), 2),
+            "weighted_change": round(float(weighted_sum[code] / cap_sum[code]), 2) if cap_sum[code] else None,
+            "market_cap": float(cap_sum[code]),
+            "advancers": int(advancers[code]),
+            "decliners": int(decliners[code]),
+            "worst": {"ticker": table.tickers[worst[code]], "change": format_change(table.change[worst[code]])},
+        })
+    return sorted(sectors, key=lambda sector: sector["weighted_change"] if sector["weighted_change"] is not None
+                  else sector["average_change"])
+
+
+def rank_tiles(table, k=DEFAULT_K):
+    """
+    所有排名與彙總，作為 JSON API 的區段
+
+    Returns:
+        dict: top_losers、top_gainers、biggest_movers、sectors、breadth
+    """
+    losers, gainers, movers = top_k(table, k)
+    valid = ~np.isnan(table.change)
+    return {
+        "top_losers": [
+            {"ticker": table.tickers[i], "change": format_change(table.change[i])} for i in losers
+        ],
+        "top_gainers": [
+            {"ticker": table.tickers[i], "change": format_change(table.change[i])} for i in gainers
+        ],
+        "biggest_movers": [
+            {
+                "ticker": table.tickers[i],
+                "change": format_change(table.change[i]),
+                "market_cap": float(table.market_cap[i]),
+                "market_cap_change": round(float(table.market_cap[i] * table.change[i] / 100)),
+            }
+            for i in movers
+        ],
+        "sectors": sector_aggregates(table),
+        "breadth": {
+            "tiles": int(valid.sum()),
+            "advancers": int((table.change[valid] > 0).sum()),
+            "decliners": int((table.change[valid] < 0).sum()),
+            "unchanged": int((table.change[valid] == 0).sum()),
+        },
+    }
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+GitHub Models 的客戶端速率限制
+以權杖桶 (token bucket) 追蹤每分鐘的請求數與 token 數，送出前先取得額度，
+不足時依序排隊等待；回應的 x-ratelimit-* 標頭會校正本地的剩餘額度
+
+429 與 5xx 依 Retry-After 等待後重試，沒有 Retry-After 時用指數退避
+"""
+
+import asyncio
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+# gpt-4o 屬於 GitHub Models 的 High 等級: 每分鐘 10 個請求
+DEFAULT_REQUESTS_PER_MINUTE = 10
+DEFAULT_MAX_RETRIES = 4
+# 單次等待超過此秒數 (例如每日額度用完) 就放棄，不讓 workflow 卡住
+DEFAULT_MAX_WAIT = 120.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# 每張圖片以 high detail 512px 方格估算的 token 數 (gpt-4o: 85 + 170 × 4 格)
+IMAGE_TOKENS = 765
+
+
+class RateLimitExceeded(RuntimeError):
+    """需要等待的時間超過 max_wait"""
+
+
+def parse_duration(value):
+    """
+    解析標頭中的時間長度，回傳秒數
+
+    接受純數字 ("20")、OpenAI 格式 ("1m30s"、"250ms") 或 HTTP 日期；無法解析時回傳 None
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * scale[u] for n, u in parts)
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers):
+    """回應要求的等待秒數 (retry-after-ms > retry-after)，沒有時回傳 None"""
+    milliseconds = parse_duration(headers.get("retry-after-ms"))
+    if milliseconds is not None:
+        return milliseconds / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+def backoff(attempt, base_delay=1.0, max_delay=60.0):
+    """第 attempt 次重試前的指數退避，在一半到全部之間隨機"""
+    ceiling = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def estimate_tokens(body, max_tokens):
+    """請求本文的 token 估計: 圖片數 × IMAGE_TOKENS + 文字 + 回應上限"""
+    images = body.count(b'"image_url"')
+    text = len(body) - sum(len(m) for m in re.findall(rb'data:image/[^"]*', body))
+    return images * IMAGE_TOKENS + text // 4 + max_tokens
+
+
+class TokenBucket:
+    """每 period 秒補滿 capacity 的權杖桶"""
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """取得 amount 需要等待的秒數 (超過容量的請求只需等到桶滿)"""
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.refill()
+        self.level -= amount
+
+    def sync(self, remaining):
+        """以伺服器回報的剩餘額度校正 (只往下調，本地可能有尚未回報的請求)"""
+        self.refill()
+        self.level = min(self.level, float(remaining))
+
+
+class RateLimiter:
+    """
+    請求數與 token 數兩個權杖桶，加上伺服器要求的暫停時間
+
+    acquire 以鎖排隊，先到的請求先取得額度
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=None,
+                 max_wait=DEFAULT_MAX_WAIT):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_wait = max_wait
+        self.paused_until = 0.0
+        self.waited = 0.0
+        self.lock = asyncio.Lock()
+
+    def wait_time(self, tokens):
+        wait = max(0.0, self.paused_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    async def acquire(self, tokens=0, prefix=""):
+        """等到有額度再返回；需要等待超過 max_wait 時拋出 RateLimitExceeded"""
+        async with self.lock:
+            while True:
+                wait = self.wait_time(tokens)
+                if wait <= 0:
+                    break
+                if wait > self.max_wait:
+                    raise RateLimitExceeded(f"需要等待 {wait:.0f}s，超過上限 {self.max_wait:.0f}s")
+                print(f"{prefix}⏳ 速率限制: 等待 {wait:.1f}s")
+                self.waited += wait
+                await asyncio.sleep(wait)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+
+    def pause(self, seconds):
+        """所有請求暫停 seconds 秒 (429 的 Retry-After)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        """依 x-ratelimit-remaining-* 與 x-ratelimit-reset-* 標頭校正額度"""
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if bucket is not None:
+                bucket.sync(remaining)
+            if remaining <= 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(reset)
+
+    def refund(self, estimated, actual):
+        """以回應的 usage 修正送出前估計的 token 數"""
+        if self.tokens is not None and actual is not None:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
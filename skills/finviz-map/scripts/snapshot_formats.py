@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+分析結果的精簡輸出格式
+除了美化的 JSON API 之外，提供兩種給下游批次作業讀取的格式，漲跌幅一律是數值 (float)，
+不再是 "-9.34%" 字串:
+
+    ndjson    每行一筆方塊記錄 (沒有地圖資料時為跌幅榜的每一檔)
+    columnar  二進位欄式快照 (.fcol)，數值欄位可直接以 np.frombuffer 讀取
+
+所有檔案都先寫入暫存檔再改名 (atomic_write)，讀取端不會看到寫到一半的檔案
+
+.fcol 格式 (所有整數與浮點數皆為 little-endian):
+
+    偏移    大小    內容
+    0       8       magic b"FMAPCOL1"
+    8       4       uint32 標頭長度 H
+    12      4       uint32 保留 (0)
+    16      H       標頭 JSON (UTF-8)
+    ...             補零到 8 位元組邊界，之後是各欄位緩衝區，每個都從 8 的倍數開始
+
+    標頭 JSON:
+        map_type, generated_at, source  快照資訊
+        rows                            列數 n
+        sectors                         產業名稱字典 (sector_code 的索引)
+        buffers                         {名稱: {"dtype", "offset", "count"}}，offset 自檔案開頭起算
+
+    緩衝區:
+        change            <f8 × n       漲跌幅 (%)，缺值為 NaN
+        market_cap        <f8 × n       市值，缺值為 NaN
+        sector_code       <i4 × n       sectors 的索引
+        ticker_offsets    <u4 × (n+1)   第 i 列代碼為 ticker_data[offsets[i]:offsets[i+1]]
+        ticker_data       u1            UTF-8 位元組
+        industry_offsets  <u4 × (n+1)   同上，缺值為空字串
+        industry_data     u1
+
+    python scripts/snapshot_formats.py api/top_losers.fcol api/world_losers.fcol
+"""
+
+import argparse
+import json
+import struct
+import sys
+import time
+from pathlib import Path
+
+# Windows 終端機編碼修正；analyze_map 會匯入本模組，所以就地修改而不換掉 stdout
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+import numpy as np
+
+from history_store import parse_change
+from instrumentation import atomic_write
+from rankings import TileTable
+
+FORMATS = ("json", "ndjson", "columnar")
+
+SUFFIXES = {"json": ".json", "ndjson": ".ndjson", "columnar": ".fcol"}
+
+MAGIC = b"FMAPCOL1"
+PREFIX = struct.Struct("<8sII")
+ALIGNMENT = 8
+
+
+def snapshot_rows(data, tiles=None):
+    """
+    輸出的列: 有地圖資料時為每個方塊，否則為結果中跌幅榜的每一檔
+
+    Returns:
+        TileTable，change 已轉為數值
+    """
+    if tiles is None:
+        tiles = [
+            {"ticker": stock.get("ticker") or "", "change": parse_change(stock.get("change"))}
+            for stock in data.get("top_losers") or []
+        ]
+    return TileTable.from_tiles(tiles)
+
+
+def ndjson_lines(table, meta):
+    """每一列一行 JSON，快照資訊重複在每一行，單獨一行也能使用"""
+    for index in range(len(table)):
+        yield json.dumps({**meta, **table.row(index)}, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_strings(values):
+    """字串欄位 -> (offsets, data)，None 視為空字串"""
+    encoded = [(value or "").encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype="u1")
+
+
+def decode_strings(offsets, data):
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    return [raw[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:])]
+
+
+def encode_columnar(table, meta):
+    """TileTable -> .fcol 位元組"""
+    ticker_offsets, ticker_data = encode_strings(table.tickers)
+    industry_offsets, industry_data = encode_strings(table.industries)
+    arrays = {
+        "change": table.change.astype("<f8"),
+        "market_cap": table.market_cap.astype("<f8"),
+        "sector_code": table.sector_codes.astype("<i4"),
+        "ticker_offsets": ticker_offsets,
+        "ticker_data": ticker_data,
+        "industry_offsets": industry_offsets,
+        "industry_data": industry_data,
+    }
+
+    def aligned(size):
+        return -(-size // ALIGNMENT) * ALIGNMENT
+
+    # 標頭記錄緩衝區的絕對位置，位置又取決於標頭長度: 先以較長的 offset 估算標頭大小，
+    # 實際標頭不會更長，剩下的空間補零
+    buffers = {
+        name: {"dtype": array.dtype.str, "offset": 10 ** 12, "count": len(array)} for name, array in arrays.items()
+    }
+    header = {**meta, "rows": len(table), "sectors": [str(name) for name in table.sectors], "buffers": buffers}
+    start = aligned(PREFIX.size + len(json.dumps(header, ensure_ascii=False).encode("utf-8")))
+
+    offset = start
+    for name, array in arrays.items():
+        buffers[name]["offset"] = offset
+        offset = aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    out = bytearray(offset)
+    out[:PREFIX.size] = PREFIX.pack(MAGIC, len(header_bytes), 0)
+    out[PREFIX.size:PREFIX.size + len(header_bytes)] = header_bytes
+    for name, array in arrays.items():
+        position = buffers[name]["offset"]
+        out[position:position + array.nbytes] = array.tobytes()
+    return bytes(out)
+
+
+def read_columnar(path):
+    """
+    讀取 .fcol 快照
+
+    數值欄位是檔案內容的唯讀 view (np.frombuffer，不複製)
+
+    Returns:
+        (header dict, TileTable)
+    """
+    raw = Path(path).read_bytes()
+    if len(raw) < PREFIX.size or raw[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"不是欄式快照檔: {path}")
+    _, header_length, _ = PREFIX.unpack_from(raw)
+    header = json.loads(raw[PREFIX.size:PREFIX.size + header_length])
+
+    columns = {
+        name: np.frombuffer(raw, dtype=buffer["dtype"], count=buffer["count"], offset=buffer["offset"])
+        for name, buffer in header["buffers"].items()
+    }
+    industries = [value or None for value in decode_strings(columns["industry_offsets"], columns["industry_data"])]
+    table = TileTable(
+        np.array(decode_strings(columns["ticker_offsets"], columns["ticker_data"]), dtype=object),
+        np.array(header["sectors"], dtype=object),
+        columns["sector_code"],
+        np.array(industries, dtype=object),
+        columns["market_cap"],
+        columns["change"],
+    )
+    return header, table
+
+
+def read_ndjson(path):
+    """逐行讀取 NDJSON 快照，每次產生一筆記錄 (dict)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def output_path_for(path, fmt):
+    """把預設的 .json 輸出路徑換成該格式的副檔名"""
+    return Path(path).with_suffix(SUFFIXES[fmt])
+
+
+def write_snapshot(path, fmt, data, map_type, tiles=None):
+    """
+    以 ndjson 或 columnar 格式寫出快照 (暫存檔 + 改名)
+
+    Args:
+        data: 分析結果 (已有 generated_at 與 source)
+        tiles: 地圖資料的方塊列表，沒有時輸出跌幅榜
+
+    Returns:
+        寫入的位元組數
+    """
+    table = snapshot_rows(data, tiles)
+    meta = {"map_type": map_type, "generated_at": data.get("generated_at"), "source": data.get("source")}
+    if fmt == "ndjson":
+        content = "".join(line + "\n" for line in ndjson_lines(table, meta)).encode("utf-8")
+    elif fmt == "columnar":
+        content = encode_columnar(table, meta)
+    else:
+        raise ValueError(f"不支援的格式: {fmt}")
+    atomic_write(path, content)
+    return len(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="讀取欄式 (.fcol) 或 NDJSON 快照並顯示摘要")
+    parser.add_argument("paths", nargs="+", help="快照檔案")
+    parser.add_argument("--head", type=int, default=5, help="每個檔案顯示的列數 (預設: 5)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    total = 0
+    for path in args.paths:
+        if Path(path).suffix == SUFFIXES["columnar"]:
+            header, table = read_columnar(path)
+            rows = [table.row(index) for index in range(min(args.head, len(table)))]
+            count = len(table)
+        else:
+            records = list(read_ndjson(path))
+            header = records[0] if records else {}
+            rows = records[:args.head]
+            count = len(records)
+        total += count
+        print(f"📦 {path}: {header.get('map_type')} {header.get('generated_at')} ({count} 列)")
+        for row in rows:
+            print(f"   {row['ticker']}: {row['change']}")
+
+    print(f"\n✓ {len(args.paths)} 個檔案、{total} 列，讀取耗時 {time.perf_counter() - started:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+串流回應的增量 JSON 解析
+模型以 SSE 逐字回傳時，邊收邊從 "top_losers" 陣列中取出已完整的物件，
+不必等整個回應結束，也不必依賴 ```json 區塊
+"""
+
+import json
+
+
+def parse_sse_line(line):
+    """
+    解析一行 SSE，回傳本行帶來的文字片段
+
+    Returns:
+        文字 (可能為空字串)，串流結束 ([DONE]) 時回傳 None
+    """
+    if not line.startswith("data:"):
+        return ""
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None
+    try:
+        event = json.loads(data)
+    except ValueError:
+        return ""
+    choices = event.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+def valid_entry(entry):
+    return (
+        isinstance(entry, dict)
+        and isinstance(entry.get("ticker"), str) and entry["ticker"].strip()
+        and isinstance(entry.get("change"), str) and entry["change"].strip()
+    )
+
+
+class TopLosersStreamParser:
+    """
+    增量掃描 "top_losers": [ {...}, {...} ... ] 中的物件
+
+    只掃描新收到的字元，追蹤字串、跳脫與大括號深度，
+    每當陣列中的一個物件結束就 json.loads 該片段
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = 0
+        self.array_start = None
+        self.closed = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.object_start = None
+        self.entries = []
+
+    def feed(self, chunk):
+        """加入新片段，回傳這次新解析出的有效項目"""
+        self.text += chunk
+        found = []
+
+        if self.array_start is None:
+            key = self.text.find('"top_losers"')
+            if key < 0:
+                return found
+            bracket = self.text.find("[", key)
+            if bracket < 0:
+                return found
+            self.array_start = bracket
+            self.position = bracket + 1
+
+        while self.position < len(self.text) and not self.closed:
+            char = self.text[self.position]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0 and self.object_start is not None:
+                    try:
+                        entry = json.loads(self.text[self.object_start:self.position + 1])
+                    except ValueError:
+                        entry = None
+                    if valid_entry(entry):
+                        self.entries.append(entry)
+                        found.append(entry)
+                    self.object_start = None
+            elif char == "]" and self.depth == 0:
+                self.closed = True
+            self.position += 1
+        return found
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+本地方塊切割引擎
+不呼叫 API，直接用 NumPy 把 Finviz 熱力圖截圖切成方塊，並依填色換算漲跌幅
+
+做法:
+1. 背景色 (方塊間的 1px 分隔線、板塊標題列) 標記為背景
+2. XY-cut: 遞迴尋找整行/整列都是背景的分隔線，把區域切開；
+   產業標題列底下沒有分隔線，找不到切線時改為略過頂端幾列再找直向切線
+3. 切不開的區域即為方塊，取眾數顏色為填色，並去掉頂端與填色不同的標題列
+4. 填色以 Finviz 色階內插成的查找表換算為漲跌幅 (超出 ±3% 的顏色已飽和)
+"""
+
+import numpy as np
+
+# 方塊間分隔線與板塊標題列的背景色
+BACKGROUND = (38, 41, 49)
+BACKGROUND_TOLERANCE = 12
+
+# Finviz 色階 (漲跌幅 %, RGB)，與 fixtures/map.html 相同
+COLOR_SCALE = [
+    (-3, (246, 53, 56)),
+    (-2, (191, 64, 69)),
+    (-1, (139, 68, 78)),
+    (0, (65, 69, 84)),
+    (1, (53, 118, 78)),
+    (2, (47, 158, 79)),
+    (3, (48, 204, 90)),
+]
+
+# 產業標題列的最大高度 (像素)
+HEADER_MAX = 24
+
+# 小於此尺寸的區域視為雜訊 (文字殘片、邊緣)
+MIN_TILE_SIZE = 6
+
+# 填色與查找表的最大距離 (RGB 歐氏距離)，超過則不是方塊 (例如純文字區域)
+MAX_COLOR_DISTANCE = 12
+
+
+def build_color_lut(step=0.01):
+    """
+    依 COLOR_SCALE 線性內插出查找表
+
+    Returns:
+        (changes, colors): 漲跌幅陣列 (N,) 與對應 RGB 陣列 (N, 3)
+    """
+    stops = np.array([change for change, _ in COLOR_SCALE], dtype=np.float64)
+    rgb = np.array([color for _, color in COLOR_SCALE], dtype=np.float64)
+    changes = np.round(np.arange(stops[0], stops[-1] + step / 2, step), 4)
+    colors = np.stack([np.interp(changes, stops, rgb[:, k]) for k in range(3)], axis=1)
+    return changes, colors
+
+
+COLOR_LUT = build_color_lut()
+
+
+def color_to_change(color, lut=COLOR_LUT):
+    """
+    把填色換算為漲跌幅
+
+    Returns:
+        (change, distance)，distance 為填色與查找表最接近顏色的距離
+    """
+    changes, colors = lut
+    distances = np.sqrt(((colors - np.asarray(color, dtype=np.float64)) ** 2).sum(axis=1))
+    index = int(distances.argmin())
+    return float(changes[index]), float(distances[index])
+
+
+def background_mask(pixels):
+    """背景像素的布林遮罩 (H, W)"""
+    diff = np.abs(pixels.astype(np.int16) - np.array(BACKGROUND, dtype=np.int16)).sum(axis=2)
+    return diff <= BACKGROUND_TOLERANCE
+
+
+def runs(flags):
+    """回傳 flags 中連續 False 區段的 (start, end)，即分隔線之間的內容"""
+    padded = np.concatenate(([True], flags, [True]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def xy_cut(mask, y0, y1, x0, x1, leaves):
+    """
+    遞迴切割區域 [y0:y1, x0:x1]，切不開的區域以 (y0, y1, x0, x1) 加入 leaves
+    """
+    region = mask[y0:y1, x0:x1]
+
+    # 去掉四周的背景後再找切線
+    rows = region.all(axis=1)
+    cols = region.all(axis=0)
+    row_runs = runs(rows)
+    col_runs = runs(cols)
+    if not row_runs or not col_runs:
+        return
+
+    if len(row_runs) > 1:
+        for start, end in row_runs:
+            xy_cut(mask, y0 + start, y0 + end, x0, x1, leaves)
+        return
+    if len(col_runs) > 1:
+        for start, end in col_runs:
+            xy_cut(mask, y0, y1, x0 + start, x0 + end, leaves)
+        return
+
+    # 裁到內容範圍
+    (ry0, ry1), (rx0, rx1) = row_runs[0], col_runs[0]
+    if (ry0, ry1, rx0, rx1) != (0, y1 - y0, 0, x1 - x0):
+        xy_cut(mask, y0 + ry0, y0 + ry1, x0 + rx0, x0 + rx1, leaves)
+        return
+
+    # 產業標題列橫跨整個產業，擋住直向切線: 略過頂端幾列再找一次
+    for offset in range(1, min(HEADER_MAX, y1 - y0 - MIN_TILE_SIZE) + 1):
+        col_runs = runs(region[offset:].all(axis=0))
+        if len(col_runs) > 1:
+            for start, end in col_runs:
+                xy_cut(mask, y0 + offset, y1, x0 + start, x0 + end, leaves)
+            return
+
+    leaves.append((y0, y1, x0, x1))
+
+
+def mode_color(pixels):
+    """區域中出現最多次的顏色與其佔比"""
+    packed = (pixels[..., 0].astype(np.uint32) << 16) | (pixels[..., 1].astype(np.uint32) << 8) | pixels[..., 2]
+    values, counts = np.unique(packed.ravel(), return_counts=True)
+    index = int(counts.argmax())
+    value = int(values[index])
+    return (value >> 16, (value >> 8) & 0xFF, value & 0xFF), counts[index] / packed.size
+
+
+def strip_header(pixels, fill):
+    """
+    回傳頂端與填色不同的列數 (產業標題列與其漸層邊緣)
+
+    只檢查前 HEADER_MAX 列，且至少保留 MIN_TILE_SIZE 列
+    """
+    limit = min(HEADER_MAX, pixels.shape[0] - MIN_TILE_SIZE)
+    fill = np.array(fill, dtype=np.uint8)
+    for y in range(max(0, limit)):
+        if (pixels[y] == fill).all(axis=1).mean() >= 0.5:
+            return y
+    return 0
+
+
+def segment_tiles(image):
+    """
+    把熱力圖切成方塊
+
+    Args:
+        image: 圖片路徑、PIL Image 或 (H, W, 3/4) uint8 陣列
+
+    Returns:
+        依漲跌幅由低到高排序的方塊列表，每個方塊為
+        {"bbox": [x0, y0, x1, y1], "area", "color", "change", "saturated", "coverage"}
+    """
+    pixels = load_pixels(image)
+    mask = background_mask(pixels)
+
+    leaves = []
+    xy_cut(mask, 0, mask.shape[0], 0, mask.shape[1], leaves)
+
+    tiles = []
+    for y0, y1, x0, x1 in leaves:
+        if y1 - y0 < MIN_TILE_SIZE or x1 - x0 < MIN_TILE_SIZE:
+            continue
+        region = pixels[y0:y1, x0:x1]
+        fill, coverage = mode_color(region)
+        change, distance = color_to_change(fill)
+        if distance > MAX_COLOR_DISTANCE:
+            # 背景上的板塊名稱、純文字等非方塊區域
+            continue
+
+        header = strip_header(region, fill)
+        y0 += header
+        if header:
+            coverage = float((pixels[y0:y1, x0:x1] == np.array(fill, dtype=np.uint8)).all(axis=2).mean())
+
+        tiles.append({
+            "bbox": [int(x0), int(y0), int(x1), int(y1)],
+            "area": int((x1 - x0) * (y1 - y0)),
+            "color": list(fill),
+            "change": round(change, 2),
+            # 色階在 ±3% 飽和，更大的漲跌幅無法從顏色區分
+            "saturated": abs(change) >= COLOR_SCALE[-1][0],
+            "coverage": round(float(coverage), 3),
+        })
+
+    # 同樣飽和的方塊以面積 (市值) 由大到小排列
+    tiles.sort(key=lambda tile: (tile["change"], -tile["area"]))
+    return tiles
+
+
+def load_pixels(image):
+    """把圖片路徑、PIL Image 或陣列轉成 (H, W, 3) uint8 陣列"""
+    if isinstance(image, np.ndarray):
+        return np.ascontiguousarray(image[..., :3], dtype=np.uint8)
+
+    from PIL import Image
+
+    if hasattr(image, "convert"):
+        return np.asarray(image.convert("RGB"))
+    with Image.open(image) as opened:
+        return np.asarray(opened.convert("RGB"))
+
+
+def top_losers_from_tiles(tiles, limit=10, engine="local"):
+    """
+    以方塊跌幅組成 top_losers，並附上方塊位置
+
+    只用填色時讀不到方塊上的文字，ticker 為 None；經 tile_ocr 辨識的方塊
+    帶有 ticker 與交叉比對結果 verified
+    """
+    losers = [tile for tile in tiles if tile["change"] < 0][:limit]
+    top_losers = []
+    for tile in losers:
+        entry = {
+            "ticker": tile.get("ticker"),
+            "change": f"{tile['change']:.2f}%",
+            "bbox": tile["bbox"],
+            "saturated": tile["saturated"] and not tile.get("verified"),
+        }
+        if "verified" in tile:
+            entry["verified"] = tile["verified"]
+        top_losers.append(entry)
+
+    return {
+        "top_losers": top_losers,
+        "engine": engine,
+        "tiles_found": len(tiles),
+    }
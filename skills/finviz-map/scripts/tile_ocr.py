@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+方塊文字辨識 (OCR)
+在 tile_engine 切出的方塊上讀取股票代碼與漲跌幅文字，並與填色估計的漲跌幅交叉比對
+
+只辨識跌幅最大的前 N 個方塊，裁切後分散到多個行程 (process pool) 平行處理，
+速度隨 CPU 核心數增加。需要 pytesseract 與系統安裝的 Tesseract
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 方塊上的文字是白色，填色的最小 RGB 分量都低於此值 (例如紅 (246,53,56) 為 53)
+TEXT_THRESHOLD = 160
+
+# 小於此尺寸的方塊不會顯示文字
+MIN_TEXT_WIDTH = 30
+MIN_TEXT_HEIGHT = 24
+
+# 放大後的文字高度，Tesseract 在字高 30px 以上較準確
+TARGET_HEIGHT = 120
+
+# OCR 讀到的漲跌幅與填色估計相差在此範圍內視為一致 (百分點)
+CHANGE_TOLERANCE = 0.35
+
+TESSERACT_CONFIG = "--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.-+%"
+
+TICKER_PATTERN = re.compile(r"^[A-Z][A-Z.]{0,5}$")
+CHANGE_PATTERN = re.compile(r"([+-]?\d{1,3}\.\d{1,2})%")
+
+
+def ocr_available():
+    """pytesseract 與 Tesseract 執行檔是否都可用"""
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def prepare_crop(pixels, bbox):
+    """
+    裁出方塊內部並轉成 Tesseract 易讀的黑字白底灰階圖
+
+    取 RGB 最小分量: 白字接近 255，任何填色都遠低於 TEXT_THRESHOLD
+    """
+    x0, y0, x1, y1 = bbox
+    crop = pixels[y0 + 1:y1 - 1, x0 + 1:x1 - 1]
+    text = crop.min(axis=2) > TEXT_THRESHOLD
+    gray = np.where(text, 0, 255).astype(np.uint8)
+
+    # 加白邊，文字貼邊時 Tesseract 容易漏字
+    return np.pad(gray, 8, constant_values=255)
+
+
+def parse_ocr_text(text):
+    """
+    從 OCR 文字中取出股票代碼與漲跌幅
+
+    Returns:
+        (ticker, change)，讀不到的欄位為 None
+    """
+    ticker = None
+    change = None
+    for token in text.split():
+        match = CHANGE_PATTERN.search(token)
+        if match and change is None:
+            change = float(match.group(1))
+        elif ticker is None and TICKER_PATTERN.match(token):
+            ticker = token
+    return ticker, change
+
+
+def ocr_crop(crop):
+    """在 worker 行程中辨識一個方塊裁切 (黑字白底陣列)"""
+    import pytesseract
+    from PIL import Image
+
+    image = Image.fromarray(crop)
+    if image.height < TARGET_HEIGHT:
+        scale = TARGET_HEIGHT / image.height
+        image = image.resize((round(image.width * scale), TARGET_HEIGHT), Image.LANCZOS)
+    text = pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+    return text.strip()
+
+
+def cross_check(tile, ticker, change):
+    """
+    比對 OCR 漲跌幅與填色估計
+
+    沒讀到有效股票代碼的方塊不算一致，否則 verified 的方塊可能沒有代碼。
+    填色在 ±3% 飽和，飽和方塊只要 OCR 讀到同方向且超過飽和點附近的數值即視為一致
+    """
+    if change is None or not ticker or not TICKER_PATTERN.match(ticker):
+        return False
+    if tile["saturated"]:
+        return change * tile["change"] > 0 and abs(change) >= abs(tile["change"]) - CHANGE_TOLERANCE
+    return abs(change - tile["change"]) <= CHANGE_TOLERANCE
+
+
+def ocr_tiles(image, tiles, top_n=20, workers=None):
+    """
+    辨識跌幅最大的前 top_n 個方塊文字
+
+    Args:
+        image: 圖片路徑、PIL Image 或陣列
+        tiles: segment_tiles() 的結果 (依漲跌幅由低到高排序)
+        top_n: 要辨識的方塊數，None 表示全部
+        workers: 行程數 (預設: CPU 核心數)
+
+    Returns:
+        重新排序後的方塊列表；辨識過的方塊加上 ticker、ocr_text、ocr_change、verified，
+        通過交叉比對的方塊以 OCR 數值為 change
+    """
+    from tile_engine import load_pixels
+
+    pixels = load_pixels(image)
+    candidates = [
+        tile for tile in tiles
+        if tile["bbox"][2] - tile["bbox"][0] >= MIN_TEXT_WIDTH
+        and tile["bbox"][3] - tile["bbox"][1] >= MIN_TEXT_HEIGHT
+    ][:top_n]
+    if not candidates:
+        return tiles
+
+    crops = [prepare_crop(pixels, tile["bbox"]) for tile in candidates]
+    workers = min(workers or os.cpu_count() or 1, len(crops))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        texts = list(pool.map(ocr_crop, crops))
+
+    for tile, text in zip(candidates, texts):
+        ticker, change = parse_ocr_text(text)
+        verified = cross_check(tile, ticker, change)
+        tile.update({
+            "ticker": ticker,
+            "ocr_text": text,
+            "ocr_change": change,
+            "color_change": tile["change"],
+            "verified": verified,
+        })
+        if verified:
+            tile["change"] = change
+
+    return sorted(tiles, key=lambda tile: (tile["change"], -tile["area"]))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+縮小送給視覺模型的圖片
+先以 tile_engine 在本地找出候選方塊，只裁出方塊上的標籤文字 (代碼與漲跌幅)，
+縮到文字仍可辨識的最小解析度，再拼成一張馬賽克或作為多個圖片部分送出，
+取代整張全解析度截圖
+"""
+
+import io
+
+import numpy as np
+
+# 與 OCR 使用同一個白字門檻，兩邊的標籤遮罩才會一致
+from tile_ocr import TEXT_THRESHOLD
+
+# 文字區塊 (代碼 + 漲跌幅兩行) 縮放後的最大高度；較小的標籤不放大
+TEXT_BLOCK_HEIGHT = 32
+
+# 裁切時文字四周保留的邊距
+MARGIN = 3
+
+# 馬賽克寬度上限與格子間距 (gpt-4o 以 512px 方格計算圖片 token)
+MOSAIC_WIDTH = 512
+MOSAIC_GAP = 4
+MOSAIC_BACKGROUND = (38, 41, 49)
+
+# 候選方塊數的下限: 飽和方塊不足時以次紅的方塊補足
+DEFAULT_CANDIDATES = 15
+
+# 候選方塊數的上限 (約為 512px 寬的馬賽克拼成一個 512px 方格的數量)；
+# 飽和方塊超過此數時無法從顏色挑出最大跌幅，改送整張圖
+MAX_CANDIDATES = 100
+
+
+def label_crop(pixels, bbox):
+    """
+    裁出方塊上的標籤文字區塊並縮到可辨識的最小尺寸
+
+    Returns:
+        PIL Image，方塊上沒有文字 (太小而未顯示標籤) 時回傳 None
+    """
+    from PIL import Image
+
+    x0, y0, x1, y1 = bbox
+    tile = pixels[y0:y1, x0:x1]
+    ys, xs = np.nonzero(tile.min(axis=2) > TEXT_THRESHOLD)
+    if len(ys) == 0:
+        return None
+
+    top = max(0, ys.min() - MARGIN)
+    bottom = min(tile.shape[0], ys.max() + 1 + MARGIN)
+    left = max(0, xs.min() - MARGIN)
+    right = min(tile.shape[1], xs.max() + 1 + MARGIN)
+    crop = Image.fromarray(np.ascontiguousarray(tile[top:bottom, left:right]))
+
+    if crop.height > TEXT_BLOCK_HEIGHT:
+        scale = TEXT_BLOCK_HEIGHT / crop.height
+        crop = crop.resize((max(1, round(crop.width * scale)), TEXT_BLOCK_HEIGHT), Image.LANCZOS)
+    return crop
+
+
+def candidate_tiles(pixels, limit=DEFAULT_CANDIDATES, maximum=MAX_CANDIDATES):
+    """
+    要送給模型的候選方塊與其標籤裁切
+
+    色階在 -3% 飽和，飽和方塊的顏色都一樣紅，segment_tiles 只能依面積排列，
+    無法看出誰跌得最多；因此所有有標籤的飽和方塊都要送出，
+    不足 limit 個時再依跌幅補上未飽和的方塊
+
+    Returns:
+        [(tile, crop), ...]；有標籤的飽和方塊超過 maximum 個時回傳空列表
+    """
+    from tile_engine import segment_tiles
+
+    candidates = []
+    for tile in segment_tiles(pixels):
+        if tile["change"] >= 0 or (not tile["saturated"] and len(candidates) >= limit):
+            break
+        crop = label_crop(pixels, tile["bbox"])
+        if crop is not None:
+            candidates.append((tile, crop))
+    if len(candidates) > maximum:
+        return []
+    return candidates
+
+
+def candidate_crops(image, limit=DEFAULT_CANDIDATES, maximum=MAX_CANDIDATES):
+    """候選方塊的標籤裁切 (依跌幅由大到小)，太多飽和方塊時為空列表"""
+    from tile_engine import load_pixels
+
+    return [crop for _, crop in candidate_tiles(load_pixels(image), limit, maximum)]
+
+
+def build_mosaic(crops, width=MOSAIC_WIDTH, gap=MOSAIC_GAP):
+    """把裁切依序排成多列，拼成一張圖"""
+    from PIL import Image
+
+    rows = []
+    row, row_width = [], gap
+    for crop in crops:
+        if row and row_width + crop.width + gap > width:
+            rows.append(row)
+            row, row_width = [], gap
+        row.append(crop)
+        row_width += crop.width + gap
+    if row:
+        rows.append(row)
+
+    mosaic_width = max(gap + sum(c.width + gap for c in r) for r in rows)
+    mosaic_height = gap + sum(max(c.height for c in r) + gap for r in rows)
+    mosaic = Image.new("RGB", (mosaic_width, mosaic_height), MOSAIC_BACKGROUND)
+    y = gap
+    for r in rows:
+        x = gap
+        for crop in r:
+            mosaic.paste(crop, (x, y))
+            x += crop.width + gap
+        y += max(c.height for c in r) + gap
+    return mosaic
+
+
+def png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def shrink_images(image, mode="mosaic", limit=DEFAULT_CANDIDATES, maximum=MAX_CANDIDATES):
+    """
+    產生要送出的圖片 (PNG 位元組列表)
+
+    mode: "mosaic" 拼成一張圖，"parts" 每個裁切一張；
+    找不到候選方塊或飽和方塊太多時回傳空列表，呼叫端應改送整張圖
+    """
+    crops = candidate_crops(image, limit, maximum)
+    if not crops:
+        return []
+    if mode == "parts":
+        return [png_bytes(crop) for crop in crops]
+    return [png_bytes(build_mosaic(crops))]
@@ -0,0 +1,112 @@
+"""
+Shared fixtures: the scripts and the mock models server are importable by
+bare module name, and mock_server starts fixtures/mock_models_server.py in
+its own process on a free port.
+"""
+
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+SKILL_DIR = Path(__file__).parent.parent
+FIXTURES_DIR = SKILL_DIR / "fixtures"
+sys.path[:0] = [str(SKILL_DIR / "scripts"), str(FIXTURES_DIR)]
+
+SAMPLE_IMAGE = FIXTURES_DIR / "corpus" / "sec.png"
+
+
+def fixture_map_data():
+    """Normalized map data from the fixture structure and performance payloads"""
+    from capture_canvas_playwright import normalize_map_data
+
+    payloads = []
+    for url, path in (("sec.json", FIXTURES_DIR / "maps" / "sec.json"),
+                      ("map_perf.ashx", FIXTURES_DIR / "api" / "map_perf.ashx")):
+        with open(path, "r", encoding="utf-8") as f:
+            payloads.append((url, json.load(f)))
+    return normalize_map_data("sec", payloads)
+
+
+def analysis_result(generated_at, *losers):
+    """An analysis result with (ticker, change) pairs as its top_losers"""
+    return {"generated_at": generated_at,
+            "top_losers": [{"ticker": ticker, "change": change} for ticker, change in losers]}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MockServer:
+    def __init__(self, args, log_path):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}/chat/completions"
+        self.log_path = log_path
+        with open(log_path, "w") as log:
+            self.process = subprocess.Popen(
+                [sys.executable, "-u", str(FIXTURES_DIR / "mock_models_server.py"),
+                 "--port", str(self.port), *args],
+                stdout=log, stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                break
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"mock server didn't start:\n{self.log()}")
+                time.sleep(0.05)
+
+    def log(self):
+        return self.log_path.read_text(encoding="utf-8")
+
+    def wait_for_log(self, text, timeout=5.0):
+        """Whether text shows up in the server log within timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while text not in self.log():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=5)
+
+
+@pytest.fixture
+def mock_server(tmp_path):
+    """Factory: mock_server("--rpm", "2") starts a server with those options"""
+    servers = []
+
+    def start(*args):
+        server = MockServer(args, tmp_path / f"mock_server_{len(servers)}.log")
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def store(tmp_path):
+    """An empty history store in tmp_path"""
+    from history_store import HistoryStore
+
+    with HistoryStore(tmp_path / "history.sqlite") as store:
+        yield store
+
+
+@pytest.fixture(autouse=True)
+def no_endpoint_override(monkeypatch):
+    monkeypatch.delenv("GITHUB_MODELS_ENDPOINT", raising=False)
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+from analysis_cache import AnalysisCache
+
+RESULT = {"top_losers": [{"ticker": "META", "change": "-9.34%"}]}
+
+
+def age(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_round_trip_and_key(tmp_path):
+    cache = AnalysisCache(tmp_path)
+    key = cache.key(b"png", "prompt", "gpt-4o", {"payload": "full"})
+
+    assert cache.get(key) is None
+    cache.put(key, RESULT, "gpt-4o")
+
+    assert cache.get(key) == RESULT
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats()["lifetime_hits"] == 1
+    # Any input that changes the answer changes the key
+    assert key != cache.key(b"png2", "prompt", "gpt-4o", {"payload": "full"})
+    assert key != cache.key(b"png", "prompt", "gpt-4o", {"payload": "mosaic"})
+    assert key == cache.key(b"png", "prompt", "gpt-4o", {"payload": "full"})
+
+
+def test_entries_expire_by_creation_even_when_used(tmp_path):
+    cache = AnalysisCache(tmp_path, max_age_days=1)
+    cache.put("old", RESULT)
+    path = cache.path("old")
+    entry = json.loads(path.read_text(encoding="utf-8"))
+    entry["created_at"] = "2000-01-01T00:00:00Z"
+    path.write_text(json.dumps(entry), encoding="utf-8")
+
+    # A fresh mtime (recent hit) doesn't keep an old entry alive
+    assert cache.get("old") is None
+    assert not path.exists()
+
+
+def test_entries_without_created_at_fall_back_to_mtime(tmp_path):
+    cache = AnalysisCache(tmp_path, max_age_days=1)
+    cache.path("legacy").write_text(json.dumps({"result": RESULT}), encoding="utf-8")
+    assert cache.get("legacy") == RESULT
+
+    age(cache.path("legacy"), 2 * 86400)
+    assert cache.get("legacy") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = AnalysisCache(tmp_path)
+    for index, key in enumerate(("a", "b", "c")):
+        cache.put(key, RESULT)
+        age(cache.path(key), 100 - index)
+    cache.get("a")
+    cache.max_bytes = cache.stats()["bytes"] - 1
+
+    assert cache.evict() == 1
+    assert [cache.get(key) is not None for key in ("a", "b", "c")] == [True, False, True]
+
+
+def test_corrupt_entries_are_misses_and_removed(tmp_path):
+    cache = AnalysisCache(tmp_path)
+    cache.path("bad").write_text("{not json", encoding="utf-8")
+
+    assert cache.get("bad") is None
+    assert cache.evict() == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_missing_directory_is_empty(tmp_path):
+    cache = AnalysisCache(tmp_path / "missing")
+
+    assert cache.get("key") is None
+    assert cache.evict() == 0
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,122 @@
+import gzip
+import http.client
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from api_server import APIHandler, EventHub, ResponseCache
+from conftest import analysis_result
+
+
+class Server:
+    def __init__(self, api_dir, history_path):
+        self.cache = ResponseCache(api_dir, history_path)
+        handler = type("Handler", (APIHandler,), {"cache": self.cache, "hub": EventHub()})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def get(self, path, **headers):
+        """(status, headers, body) of a GET"""
+        connection = http.client.HTTPConnection("127.0.0.1", self.httpd.server_address[1], timeout=5)
+        try:
+            connection.request("GET", path, headers={k.replace("_", "-"): v for k, v in headers.items()})
+            response = connection.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def api_dir(tmp_path):
+    api_dir = tmp_path / "api"
+    api_dir.mkdir()
+    (api_dir / "top_losers.json").write_text(json.dumps({"status": "success"}), encoding="utf-8")
+    return api_dir
+
+
+@pytest.fixture
+def server(api_dir, tmp_path):
+    server = Server(api_dir, tmp_path / "history.sqlite")
+    yield server
+    server.stop()
+
+
+def rewrite(path, content):
+    path.write_text(content, encoding="utf-8")
+    # Make sure the version changes even on filesystems with coarse mtimes
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_etag_and_conditional_get(server):
+    status, headers, body = server.get("/api/top_losers.json")
+    assert status == 200 and json.loads(body) == {"status": "success"}
+    etag = headers["ETag"]
+
+    status, headers, body = server.get("/api/top_losers.json", If_None_Match=etag)
+    assert (status, body) == (304, b"")
+    assert headers["ETag"] == etag
+    status, _, _ = server.get("/api/top_losers.json", If_Modified_Since=headers["Last-Modified"])
+    assert status == 304
+    assert server.cache.snapshot_stats()["not_modified"] == 2
+    assert server.cache.snapshot_stats()["misses"] == 1
+
+
+def test_changed_file_gets_a_new_etag(server, api_dir):
+    _, headers, _ = server.get("/api/top_losers.json")
+    rewrite(api_dir / "top_losers.json", json.dumps({"status": "updated"}))
+
+    # Served from memory until the watcher notices the change
+    assert server.get("/api/top_losers.json", If_None_Match=headers["ETag"])[0] == 304
+    assert server.cache.refresh() == [api_dir / "top_losers.json"]
+
+    status, new_headers, body = server.get("/api/top_losers.json", If_None_Match=headers["ETag"])
+    assert status == 200 and json.loads(body) == {"status": "updated"}
+    assert new_headers["ETag"] != headers["ETag"]
+
+
+def test_large_bodies_are_gzipped(server, api_dir):
+    document = {"tickers": [f"T{i}" for i in range(1000)]}
+    (api_dir / "big.json").write_text(json.dumps(document), encoding="utf-8")
+
+    status, headers, body = server.get("/api/big.json", Accept_Encoding="gzip")
+    assert status == 200 and headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == document
+    # Either variant's ETag revalidates
+    assert server.get("/api/big.json", If_None_Match=headers["ETag"])[0] == 304
+    _, plain, _ = server.get("/api/big.json")
+    assert "Content-Encoding" not in plain and plain["ETag"] != headers["ETag"]
+
+
+def test_missing_files_and_paths_outside_the_api_dir(server):
+    assert server.get("/api/missing.json")[0] == 404
+    assert server.get("/api/../history.sqlite")[0] == 404
+    assert server.get("/nowhere")[0] == 404
+    assert server.get("/history/META")[0] == 404  # no database yet
+    assert server.get("/history/META?days=x")[0] == 400
+
+
+def test_history_routes_are_cached_until_the_database_changes(server, tmp_path):
+    from history_store import HistoryStore
+
+    with HistoryStore(tmp_path / "history.sqlite") as store:
+        store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-9.34%")), "models")
+    server.cache.refresh()
+
+    status, headers, body = server.get("/day/2026-10-15")
+    assert status == 200
+    assert json.loads(body)["top_losers"] == [{"rank": 1, "ticker": "META", "change": -9.34}]
+    assert server.get("/day/2026-10-15", If_None_Match=headers["ETag"])[0] == 304
+
+    with HistoryStore(tmp_path / "history.sqlite") as store:
+        store.record("sec", analysis_result("2026-10-15T20:00:00Z", ("INTU", "-6.81%")), "models")
+    server.cache.refresh()
+    status, _, body = server.get("/day/2026-10-15", If_None_Match=headers["ETag"])
+    assert status == 200 and json.loads(body)["top_losers"][0]["ticker"] == "INTU"
@@ -0,0 +1,65 @@
+import hashlib
+import json
+
+from benchmark import (
+    benchmark_engine,
+    engine_runner,
+    load_corpus,
+    mock_endpoint,
+    recording_path,
+)
+from conftest import FIXTURES_DIR
+
+
+def corpus_with_recordings(tmp_path):
+    """The fixture corpus, with its responses directory moved to tmp_path"""
+    return [{**entry, "responses": tmp_path} for entry in load_corpus(FIXTURES_DIR / "corpus")]
+
+
+def run(engine, corpus, endpoint, **options):
+    return benchmark_engine(engine, corpus, endpoint, "test", repeat=1, warmup=0,
+                            tolerance=0.01, verbose=False, **options)
+
+
+def test_mock_answers_are_not_scored(tmp_path):
+    corpus = corpus_with_recordings(tmp_path)
+    with mock_endpoint() as endpoint:
+        result = run("models", corpus, endpoint, mock=True)
+
+    assert result["ticker"] is None and result["pair"] is None
+    assert result["scored_maps"] == 0
+    assert result["maps"][0]["accuracy"] == "n/a"
+    assert result["payload_bytes"] > 0
+
+
+def test_recorded_answer_is_replayed_while_request_matches(tmp_path):
+    corpus = corpus_with_recordings(tmp_path)
+    entry = corpus[0]
+    with mock_endpoint() as endpoint:
+        body = engine_runner("models", endpoint, "test")[1](entry["image"])
+        recording = {
+            "request_sha256": hashlib.sha256(body).hexdigest(),
+            # A model that read only half the answers
+            "top_losers": entry["top_losers"][:5],
+        }
+        recording_path(entry, "models").write_text(json.dumps(recording), encoding="utf-8")
+        replayed = run("models", corpus, endpoint, mock=True)
+
+        recording["request_sha256"] = "0" * 64
+        recording_path(entry, "models").write_text(json.dumps(recording), encoding="utf-8")
+        stale = run("models", corpus, endpoint, mock=True)
+
+    assert replayed["maps"][0]["accuracy"] == "replay"
+    assert replayed["ticker"] == {"precision": 1.0, "recall": 0.5}
+    assert stale["ticker"] is None
+
+
+def test_live_answers_are_recorded(tmp_path):
+    corpus = corpus_with_recordings(tmp_path)
+    with mock_endpoint() as endpoint:
+        live = run("models-mosaic", corpus, endpoint, record=True)
+        replayed = run("models-mosaic", corpus, endpoint, mock=True)
+
+    assert live["maps"][0]["accuracy"] == "live"
+    assert recording_path(corpus[0], "models-mosaic").exists()
+    assert replayed["ticker"] == live["ticker"]
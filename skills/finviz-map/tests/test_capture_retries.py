@@ -0,0 +1,88 @@
+import asyncio
+
+import capture_canvas_playwright
+from capture_canvas_playwright import CaptureSession, RetryScheduler, capture_with_retries
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def close(self):
+        self.connected = False
+
+
+class FakePage:
+    def __init__(self):
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeContext:
+    def __init__(self, browser):
+        self.browser = browser
+
+    async def new_page(self):
+        if not self.browser.is_connected():
+            raise RuntimeError("Target page, context or browser has been closed")
+        return FakePage()
+
+    async def close(self):
+        pass
+
+
+def crashed_session(monkeypatch):
+    """A session whose browser has crashed; renewing launches a working one"""
+    launched = []
+
+    async def launch_browser(playwright, headless=True):
+        launched.append(FakeBrowser())
+        return launched[-1]
+
+    async def new_capture_context(browser, storage_state=None, router=None):
+        return FakeContext(browser)
+
+    async def capture_map_page(context, map_type, output_path, page=None, **options):
+        return context.browser.is_connected()
+
+    monkeypatch.setattr(capture_canvas_playwright, "launch_browser", launch_browser)
+    monkeypatch.setattr(capture_canvas_playwright, "new_capture_context", new_capture_context)
+    monkeypatch.setattr(capture_canvas_playwright, "capture_map_page", capture_map_page)
+
+    session = CaptureSession(None)
+    session.browser = FakeBrowser()
+    session.browser.connected = False
+    session.context = FakeContext(session.browser)
+    return session, launched
+
+
+def test_crashed_browser_is_replaced_on_the_first_retry(monkeypatch):
+    session, launched = crashed_session(monkeypatch)
+    scheduler = RetryScheduler(retries=3, base_delay=0.01).start()
+
+    ok = asyncio.run(capture_with_retries(session, scheduler, "sec", "spy.png"))
+
+    assert ok
+    # new_page raised on the dead browser; the retry skipped reload and context
+    assert len(launched) == 1
+    assert session.generation == 1
+
+
+def test_failing_renewal_fails_only_its_attempt(monkeypatch):
+    session, launched = crashed_session(monkeypatch)
+
+    async def failing_launch(playwright, headless=True):
+        raise RuntimeError("Chromium failed to start")
+
+    monkeypatch.setattr(capture_canvas_playwright, "launch_browser", failing_launch)
+    scheduler = RetryScheduler(retries=2, base_delay=0.01).start()
+
+    assert asyncio.run(capture_with_retries(session, scheduler, "sec", "spy.png")) is False
@@ -0,0 +1,50 @@
+import os
+import time
+
+from PIL import Image
+
+from capture_canvas_playwright import (
+    detect_changes,
+    perceptual_hash,
+    previous_snapshot_hashes,
+    save_snapshot_hashes,
+)
+from conftest import SAMPLE_IMAGE
+
+
+def sample_images():
+    """The fixture map and the same map with its left half recolored green"""
+    with Image.open(SAMPLE_IMAGE) as image:
+        before = image.convert("RGB")
+    after = before.copy()
+    after.paste((40, 160, 60), (0, 0, after.width // 2, after.height))
+    return before, after
+
+
+def test_no_png_runs_compare_with_the_sidecar(tmp_path):
+    before, after = sample_images()
+    png = tmp_path / "spy.png"
+    hash_cache = tmp_path / "map_hashes.json"
+    before.save(png)
+    os.utime(png, (time.time() - 60, time.time() - 60))
+
+    # A --no-png run saw the map change; the PNG on disk still shows the old map
+    save_snapshot_hashes(hash_cache, detect_changes({}, {"sec": after}))
+    previous = previous_snapshot_hashes({"sec": png}, hash_cache)
+
+    assert previous == {"sec": perceptual_hash(after)}
+    assert not detect_changes(previous, {"sec": after})["sec"]["changed"]
+
+
+def test_png_written_after_the_sidecar_wins(tmp_path):
+    before, after = sample_images()
+    png = tmp_path / "spy.png"
+    hash_cache = tmp_path / "map_hashes.json"
+    save_snapshot_hashes(hash_cache, detect_changes({}, {"sec": before}))
+    after.save(png)
+    os.utime(png, (time.time() + 60, time.time() + 60))
+
+    previous = previous_snapshot_hashes({"sec": png, "world": tmp_path / "world.png"}, hash_cache)
+
+    assert previous == {"sec": perceptual_hash(after)}
+    assert detect_changes(previous, {"sec": before})["sec"]["changed"]
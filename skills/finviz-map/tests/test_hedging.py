@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from conftest import SAMPLE_IMAGE
+from mock_models_server import load_losers
+from models_client import HEDGE_MIN_SAMPLES, LatencyTracker, ModelsClient
+from models_common import MODEL
+from rate_limiter import RateLimiter
+
+
+async def analyze_hedged(server, hedge_delay):
+    """Result, hedge stats, seconds taken and the tasks left running afterwards"""
+    async with ModelsClient("test", server.url, limiter=RateLimiter(0), hedge_model="fast",
+                            hedge_delay=hedge_delay) as client:
+        started = time.monotonic()
+        result = await client.analyze(SAMPLE_IMAGE, "sec")
+        elapsed = time.monotonic() - started
+        leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        return result, client.hedge_stats, elapsed, leftover, client.latencies.samples
+
+
+async def analyze_unhedged(server):
+    async with ModelsClient("test", server.url, limiter=RateLimiter(0)) as client:
+        await client.analyze(SAMPLE_IMAGE, "sec")
+        return client.latencies.samples
+
+
+def test_slow_primary_is_hedged_and_cancelled(mock_server):
+    server = mock_server("--model-delay", f"{MODEL}=3")
+
+    result, stats, elapsed, leftover, samples = asyncio.run(analyze_hedged(server, hedge_delay=0.2))
+
+    assert result == load_losers()
+    assert stats == {"requests": 1, "fired": 1, "wins": {"fast": 1}}
+    # The cancelled primary is kept as a lower bound on its latency
+    [(seconds, censored)] = samples[MODEL]
+    assert censored and 0.2 <= seconds < 2
+    # The primary request is cancelled instead of being waited for
+    assert elapsed < 2
+    assert leftover == []
+    assert server.log().count("📨 POST") == 2
+
+
+def test_fast_primary_is_not_hedged(mock_server):
+    server = mock_server()
+
+    result, stats, _, leftover, samples = asyncio.run(analyze_hedged(server, hedge_delay=2))
+
+    assert result == load_losers()
+    assert stats == {"requests": 1, "fired": 0, "wins": {MODEL: 1}}
+    assert [censored for _, censored in samples[MODEL]] == [False]
+    assert leftover == []
+    assert server.log().count("📨 POST") == 1
+
+
+def test_hedge_delay_follows_recorded_latencies(tmp_path):
+    tracker = LatencyTracker(tmp_path / "latency.json")
+    for seconds in range(1, HEDGE_MIN_SAMPLES):
+        tracker.record(MODEL, seconds)
+    assert tracker.delay(MODEL, 95, fallback=10.0) == 10.0
+
+    tracker.record(MODEL, HEDGE_MIN_SAMPLES)
+    tracker.save()
+    assert LatencyTracker(tmp_path / "latency.json").delay(MODEL, 100, fallback=10.0) == HEDGE_MIN_SAMPLES
+
+
+def test_unhedged_requests_record_latency(mock_server):
+    samples = asyncio.run(analyze_unhedged(mock_server()))
+
+    assert [censored for _, censored in samples[MODEL]] == [False]
+
+
+def test_censored_latencies_rank_above_complete_ones():
+    tracker = LatencyTracker()
+    for seconds in (1, 2, 3, 4):
+        tracker.record(MODEL, seconds)
+    # Cancelled after 0.5s: took at least that long, and possibly longer than 4s
+    for _ in range(4):
+        tracker.record(MODEL, 0.5, censored=True)
+
+    assert tracker.delay(MODEL, 50, fallback=10.0) == 4
+
+
+def test_latencies_saved_as_plain_seconds_still_load(tmp_path):
+    path = tmp_path / "latency.json"
+    path.write_text(f'{{"{MODEL}": [1, 2, 3, 4, 5]}}', encoding="utf-8")
+
+    assert LatencyTracker(path).delay(MODEL, 100, fallback=10.0) == 5
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+from conftest import analysis_result, fixture_map_data
+from history_store import HistoryStore
+
+
+def test_snapshots_are_append_only(store):
+    first = store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-9.34%")), "map_data",
+                         tiles=fixture_map_data()["tiles"][:1])
+
+    assert first == 1
+    # The same map at the same time is recorded once
+    assert store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-1.00%")), "models") is None
+    for statement in ("UPDATE snapshots SET source = 'x'", "DELETE FROM losers", "DELETE FROM tiles"):
+        with pytest.raises(sqlite3.IntegrityError):
+            store.db.execute(statement)
+    assert store.losers_on("2026-10-15")["top_losers"] == [{"rank": 1, "ticker": "META", "change": -9.34}]
+
+
+def test_empty_and_missing_losers(store):
+    assert store.record("sec", analysis_result("2026-10-15T14:30:00Z"), "local") is not None
+    assert store.record("sec", {"generated_at": "2026-10-15T15:30:00Z", "top_losers": None}, "models") is not None
+    assert store.record("world", {}, "models", captured_at="2026-10-15T14:30:00Z") is not None
+
+    assert store.losers_on("2026-10-15")["top_losers"] == []
+    assert store.losers_on("2026-10-14") is None
+    assert store.ticker_history("META") == []
+
+
+def test_unicode_minus_in_changes(store):
+    store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "\u22129.34%"), ("INTU", "n/a")), "models")
+
+    assert [entry["change"] for entry in store.losers_on("2026-10-15")["top_losers"]] == [-9.34, None]
+
+
+def test_history_prefers_tiles_and_latest_snapshot_of_the_day(store):
+    store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-2.00%")), "models")
+    store.record("sec", analysis_result("2026-10-15T20:00:00Z", ("META", "-4.00%")), "models")
+    store.record("sec", analysis_result("2026-10-16T14:30:00Z", ("META", "-1.00%")), "map_data",
+                 tiles=fixture_map_data()["tiles"])
+
+    assert store.ticker_history("meta") == [
+        {"date": "2026-10-15", "change": -4.0},
+        {"date": "2026-10-16", "change": -9.34},
+    ]
+    assert store.worst_days("META", days=None)[0]["date"] == "2026-10-16"
+    # MSFT is only in the tiles, not in top_losers
+    assert store.ticker_history("MSFT") == [{"date": "2026-10-16", "change": 16.5}]
+
+
+def test_export_import_keeps_ids(store, tmp_path):
+    store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-9.34%")), "models")
+    store.record("sec", analysis_result("2026-10-16T14:30:00Z", ("INTU", "-6.81%")), "map_data",
+                 tiles=fixture_map_data()["tiles"])
+    store.record("world", analysis_result("2026-10-16T14:31:00Z", ("SAP", "-3.00%")), "models")
+    export_dir = tmp_path / "export"
+
+    assert store.export(export_dir) == (2, 2)
+    # Unchanged days aren't rewritten
+    assert store.export(export_dir) == (0, 2)
+
+    with HistoryStore(tmp_path / "rebuilt.sqlite") as rebuilt:
+        assert rebuilt.import_export(export_dir) == 3
+        assert rebuilt.import_export(export_dir) == 0
+        assert list(rebuilt.export_lines()) == list(store.export_lines())
+        assert rebuilt.latest_snapshot_id() == 3
+        assert rebuilt.ticker_history("MSFT") == store.ticker_history("MSFT")
+
+
+def test_import_adds_only_missing_snapshots(store, tmp_path):
+    store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-9.34%")), "models")
+    store.export(tmp_path / "export")
+    store.record("sec", analysis_result("2026-10-16T14:30:00Z", ("INTU", "-6.81%")), "models")
+
+    with HistoryStore(tmp_path / "other.sqlite") as other:
+        other.import_export(tmp_path / "export")
+        store.export(tmp_path / "export")
+        assert other.import_export(tmp_path / "export") == 1
+        assert [row["id"] for row in other.db.execute("SELECT id FROM snapshots ORDER BY id")] == [1, 2]
+
+
+def test_capture_analyze_records_history(store, tmp_path):
+    from capture_canvas_playwright import analyze_frames
+
+    analyze_frames({"sec": None}, tmp_path, {"sec": fixture_map_data()}, history=None)
+    assert store.latest_snapshot_id() == 0
+    analyze_frames({"sec": None}, tmp_path, {"sec": fixture_map_data()}, history=store.path)
+
+    assert (tmp_path / "api" / "top_losers.json").exists()
+    assert [tuple(row) for row in store.db.execute("SELECT map_type, source FROM snapshots")] == [("sec", "map_data")]
+    # The tiles are stored along with the ranked losers
+    assert [entry["change"] for entry in store.ticker_history("MSFT")] == [16.5]
@@ -0,0 +1,95 @@
+import json
+import re
+
+import pytest
+
+import instrumentation
+from instrumentation import percentile, stage, write_json_trace, write_prometheus
+
+SAMPLE = re.compile(r'^(finviz_[a-z_]+)\{((?:[a-z_]+="(?:[^"\\]|\\.)*",?)*)\} (\d+(?:\.\d+)?)$')
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    """Record stages for this test only"""
+    monkeypatch.setattr(instrumentation, "_tracer", instrumentation._tracer)
+    return instrumentation.configure("analyze")
+
+
+def test_stages_are_no_ops_until_configured(monkeypatch, tmp_path):
+    monkeypatch.setattr(instrumentation, "_tracer", instrumentation.NullTracer())
+
+    with stage("save") as record:
+        record["bytes"] = 10
+
+    assert not instrumentation.enabled()
+    assert write_json_trace(tmp_path / "trace.json") is None
+    write_prometheus(tmp_path / "metrics.prom")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stages_record_names_labels_and_bytes(tracer, tmp_path):
+    from analyze_map import save_json_api
+
+    with stage("request", image="sec", stream=None, attempt=2) as record:
+        record["bytes"] = 1234
+    save_json_api({"top_losers": []}, str(tmp_path / "top_losers.json"))
+    with pytest.raises(ValueError):
+        with stage("parse", image="sec"):
+            raise ValueError("bad JSON")
+
+    trace = write_json_trace(tmp_path / "trace.json")
+
+    assert json.loads((tmp_path / "trace.json").read_text(encoding="utf-8")) == trace
+    assert trace["script"] == "analyze"
+    assert [(s["name"], s["labels"], s["status"]) for s in trace["stages"]] == [
+        # Labels set to None are left out
+        ("request", {"image": "sec", "attempt": 2}, "ok"),
+        ("save", {}, "ok"),
+        ("parse", {"image": "sec"}, "error"),
+    ]
+    saved = (tmp_path / "top_losers.json").stat().st_size
+    assert [s["bytes"] for s in trace["stages"]] == [1234, saved, None]
+    assert trace["bytes_total"] == 1234 + saved
+    assert all(s["seconds"] >= 0 for s in trace["stages"])
+
+
+def test_prometheus_textfile(tracer, tmp_path):
+    for _ in range(2):
+        with stage("request", image="sec") as record:
+            record["bytes"] = 100
+    with stage("goto", map='say "hi"\\'):
+        pass
+
+    write_prometheus(tmp_path / "metrics.prom")
+    text = (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+
+    assert text.endswith("\n")
+    samples = {}
+    declared = set()
+    for line in text.splitlines():
+        if line.startswith("# "):
+            kind, name = line.split()[1:3]
+            assert kind in ("HELP", "TYPE")
+            declared.add(name)
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        assert match.group(1) in declared
+        samples[(match.group(1), match.group(2))] = float(match.group(3))
+
+    # Repeated stages with the same labels are summed
+    assert samples[("finviz_stage_bytes", 'image="sec",script="analyze",stage="request"')] == 200
+    assert ("finviz_stage_duration_seconds", 'map="say \\"hi\\"\\\\",script="analyze",stage="goto"') in samples
+    assert ("finviz_stage_bytes", 'map="say \\"hi\\"\\\\",script="analyze",stage="goto"') not in samples
+    assert ("finviz_run_duration_seconds", 'script="analyze"') in samples
+    assert "# TYPE finviz_stage_duration_seconds gauge" in text
+
+
+@pytest.mark.parametrize("q, expected", [(0, 1.0), (0.5, 2.5), (0.9, 3.7), (1, 4.0)])
+def test_percentile(q, expected):
+    assert percentile([4.0, 1.0, 3.0, 2.0], q) == pytest.approx(expected)
+
+
+def test_percentile_of_one_value():
+    assert percentile([7.0], 0.95) == 7.0
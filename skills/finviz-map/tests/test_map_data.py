@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from analyze_map import load_map_data
+from capture_canvas_playwright import normalize_map_data, save_map_data
+from conftest import FIXTURES_DIR, SKILL_DIR, fixture_map_data
+
+
+def touch(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_saved_data_is_loaded_for_its_image(tmp_path):
+    image = tmp_path / "spy.png"
+    image.write_bytes(b"png")
+    data = fixture_map_data()
+
+    assert save_map_data(data, tmp_path / "spy.json") > 0
+    assert load_map_data(image) == data
+
+
+def test_data_older_than_image_is_ignored(tmp_path):
+    image = tmp_path / "spy.png"
+    save_map_data(fixture_map_data(), tmp_path / "spy.json")
+    image.write_bytes(b"png")
+    touch(tmp_path / "spy.json", 1_000_000)
+    touch(image, 2_000_000)
+
+    assert load_map_data(image) is None
+
+
+def test_capture_without_tiles_removes_stale_data(tmp_path):
+    data_path = tmp_path / "spy.json"
+    save_map_data(fixture_map_data(), data_path)
+
+    assert save_map_data(normalize_map_data("sec", []), data_path) == 0
+    assert not data_path.exists()
+
+    save_map_data(fixture_map_data(), data_path)
+    assert save_map_data(None, data_path) == 0
+    assert not data_path.exists()
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fixture_site():
+    """Base URL of fixtures/ served over HTTP"""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(FIXTURES_DIR)))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_capture_saves_the_fixture_page_data(fixture_site, tmp_path):
+    sync_api = pytest.importorskip("playwright.sync_api")
+    with sync_api.sync_playwright() as playwright:
+        try:
+            playwright.chromium.launch().close()
+        except sync_api.Error:
+            pytest.skip("Chromium isn't installed (python -m playwright install chromium)")
+
+    # The script writes next to the repo root four levels up, so run a copy
+    scripts = tmp_path / "skills" / "finviz-map" / "scripts"
+    shutil.copytree(SKILL_DIR / "scripts", scripts, ignore=shutil.ignore_patterns("__pycache__"))
+    result = subprocess.run(
+        [sys.executable, str(scripts / "capture_canvas_playwright.py"), "--url", f"{fixture_site}/map.html",
+         "--data", "--no-html", "--no-state-cache", "--timeout", "60"],
+        cwd=tmp_path, capture_output=True, text=True, timeout=180,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    with open(tmp_path / "spy.json", "r", encoding="utf-8") as f:
+        captured = json.load(f)
+    expected = fixture_map_data()
+    # Only the capture time and the full URLs of the payloads differ
+    assert sorted(url.split("?")[0].rsplit("/", 1)[1] for url in captured.pop("sources")) == sorted(expected.pop("sources"))
+    del captured["captured_at"], expected["captured_at"]
+    assert captured == expected
+    assert (tmp_path / "spy.png").exists()
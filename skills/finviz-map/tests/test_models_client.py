@@ -0,0 +1,54 @@
+import asyncio
+import re
+import subprocess
+import sys
+
+from conftest import SAMPLE_IMAGE, SKILL_DIR
+from mock_models_server import load_losers
+from models_client import analyze_images
+from rate_limiter import RateLimiter
+
+
+def test_maps_share_pooled_connections(mock_server):
+    server = mock_server("--delay", "0.2")
+    images = {name: SAMPLE_IMAGE for name in ("sec", "world", "etf", "crypto")}
+
+    results = asyncio.run(analyze_images(images, "test", server.url, concurrency=2,
+                                         limiter=RateLimiter(0)))
+
+    assert results == {name: load_losers() for name in images}
+    connections = [int(n) for n in re.findall(r"(\d+) connections total", server.log())]
+    assert len(connections) == 4
+    assert max(connections) <= 2
+
+
+def test_failed_map_keeps_the_others(mock_server, tmp_path):
+    server = mock_server()
+    images = {"sec": SAMPLE_IMAGE, "missing": tmp_path / "missing.png"}
+
+    results = asyncio.run(analyze_images(images, "test", server.url, limiter=RateLimiter(0)))
+
+    assert results["sec"] == load_losers()
+    assert isinstance(results["missing"], FileNotFoundError)
+
+
+def test_client_import_does_not_load_numpy():
+    code = "import sys, models_client; print('numpy' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=SKILL_DIR / "scripts",
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False"
+
+
+def test_cached_answers_are_per_endpoint(mock_server, tmp_path):
+    from analysis_cache import AnalysisCache
+
+    cache = AnalysisCache(tmp_path / "cache")
+    first, second = mock_server(), mock_server()
+
+    for server in (first, second, first):
+        asyncio.run(analyze_images({"sec": SAMPLE_IMAGE}, "test", server.url, cache=cache,
+                                   limiter=RateLimiter(0)))
+
+    # The second endpoint misses the first one's entry; the first is then a hit
+    assert (cache.misses, cache.hits) == (2, 1)
+    assert "connections total" in second.log()
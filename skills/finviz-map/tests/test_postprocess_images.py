@@ -0,0 +1,82 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from postprocess_images import postprocess_images
+
+
+def write_map(path, compress_level=9, shade=0):
+    """A small map-like PNG; compress_level 0 leaves room for the optimizer"""
+    pixels = np.zeros((120, 200, 3), dtype=np.uint8)
+    pixels[:, :100] = (246, 53, 56)
+    pixels[:, 100:] = (47, 158, 79)
+    pixels[10:20, 10:60] = 255 - shade
+    Image.fromarray(pixels).save(path, optimize=compress_level == 9, compress_level=compress_level)
+    return path
+
+
+def run(tmp_path, *images, force=False):
+    return postprocess_images(images, tmp_path / "img", tmp_path, workers=1, force=force)
+
+
+def png_entry(manifest, stem):
+    return next(v for v in manifest["maps"][stem]["variants"] if v["format"] == "png")
+
+
+def test_variants_and_manifest(tmp_path):
+    manifest = run(tmp_path, write_map(tmp_path / "spy.png", compress_level=0))
+
+    variants = manifest["maps"]["spy"]["variants"]
+    assert {v["path"] for v in variants} >= {"img/spy/spy.png", "img/spy/spy-thumb.webp"}
+    for variant in variants:
+        assert (tmp_path / variant["path"]).stat().st_size == variant["bytes"]
+    assert png_entry(manifest, "spy")["bytes"] < manifest["maps"]["spy"]["source_bytes"]
+    assert json.loads((tmp_path / "img" / "manifest.json").read_text(encoding="utf-8")) == manifest
+    assert not list((tmp_path / "img").rglob("*.tmp"))
+
+
+def test_png_the_optimizer_cant_shrink_points_at_the_source(tmp_path):
+    source = write_map(tmp_path / "spy.png")
+    (tmp_path / "img" / "spy").mkdir(parents=True)
+    (tmp_path / "img" / "spy" / "spy.png").write_bytes(b"left by an older run")
+
+    entry = png_entry(run(tmp_path, source), "spy")
+
+    assert entry["path"] == "spy.png"
+    assert entry["bytes"] == source.stat().st_size
+    # No duplicate copy is kept next to the other variants
+    assert not (tmp_path / "img" / "spy" / "spy.png").exists()
+
+
+def test_unchanged_maps_are_skipped_unless_forced(tmp_path, capsys):
+    source = write_map(tmp_path / "spy.png")
+    first = run(tmp_path, source)
+    capsys.readouterr()
+
+    assert run(tmp_path, source) == first
+    assert "Unchanged since last run" in capsys.readouterr().out
+
+    forced = run(tmp_path, source, force=True)
+    output = capsys.readouterr().out
+    assert "Unchanged since last run" not in output
+    assert f"{len(first['maps']['spy']['variants'])} variants encoded" in output
+    assert forced["maps"]["spy"]["source_sha256"] == first["maps"]["spy"]["source_sha256"]
+
+
+@pytest.mark.parametrize("change", ["source", "variant"])
+def test_changed_source_or_missing_variant_is_re_encoded(tmp_path, capsys, change):
+    source = write_map(tmp_path / "spy.png")
+    first = run(tmp_path, source)
+    if change == "source":
+        write_map(source, shade=40)
+    else:
+        (tmp_path / first["maps"]["spy"]["variants"][-1]["path"]).unlink()
+    capsys.readouterr()
+
+    second = run(tmp_path, source)
+
+    assert "Unchanged since last run" not in capsys.readouterr().out
+    assert all((tmp_path / v["path"]).exists() for v in second["maps"]["spy"]["variants"])
+    assert (second["maps"]["spy"]["source_sha256"] != first["maps"]["spy"]["source_sha256"]) == (change == "source")
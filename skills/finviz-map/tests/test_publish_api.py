@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import json
+
+from conftest import analysis_result, fixture_map_data
+from publish_api import publish_api
+
+
+def read(api_dir, name):
+    return json.loads((api_dir / name).read_bytes())
+
+
+def test_shards_and_manifest(store, tmp_path):
+    api_dir = tmp_path / "api"
+    store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-9.34%")), "models")
+    store.record("sec", analysis_result("2026-10-16T14:30:00Z", ("META", "-1.00%")), "map_data",
+                 tiles=fixture_map_data()["tiles"])
+
+    manifest, written = publish_api(store, api_dir)
+
+    assert written == len(manifest["files"])
+    assert manifest["last_snapshot_id"] == 2
+    assert read(api_dir, "latest.json")["maps"]["sec"]["date"] == "2026-10-16"
+    assert read(api_dir, "daily/2026-10-15.json")["maps"]["sec"]["top_losers"][0]["ticker"] == "META"
+    assert read(api_dir, "tickers/META.json")["maps"]["sec"] == [["2026-10-15", -9.34], ["2026-10-16", -9.34]]
+    assert read(api_dir, "tickers/MSFT.json")["maps"]["sec"] == [["2026-10-16", 16.5]]
+    for name, entry in manifest["files"].items():
+        data = (api_dir / name).read_bytes()
+        assert hashlib.sha256(data).hexdigest() == entry["sha256"]
+        assert entry["bytes"] == len(data)
+        gz = api_dir / (name + ".gz")
+        assert gz.exists() == ("gzip_bytes" in entry)
+        if gz.exists():
+            assert gzip.decompress(gz.read_bytes()) == data
+
+
+def test_only_shards_touched_by_new_snapshots_are_written(store, tmp_path):
+    api_dir = tmp_path / "api"
+    store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-9.34%"), ("INTU", "-6.81%")),
+                 "models")
+    publish_api(store, api_dir)
+    assert publish_api(store, api_dir)[1] == 0
+
+    store.record("sec", analysis_result("2026-10-16T14:30:00Z", ("META", "-2.00%")), "models")
+    manifest, written = publish_api(store, api_dir)
+
+    # latest.json, the new day and META; INTU and the old day are kept
+    assert written == 3
+    assert set(manifest["files"]) == {"latest.json", "daily/2026-10-15.json", "daily/2026-10-16.json",
+                                      "tickers/META.json", "tickers/INTU.json"}
+    assert read(api_dir, "tickers/META.json")["maps"]["sec"] == [["2026-10-15", -9.34], ["2026-10-16", -2.0]]
+
+
+def test_tampered_shard_rebuilds_everything(store, tmp_path):
+    api_dir = tmp_path / "api"
+    store.record("sec", analysis_result("2026-10-15T14:30:00Z", ("META", "-9.34%")), "models")
+    publish_api(store, api_dir)
+    (api_dir / "tickers" / "META.json").write_text('{"maps":{}}', encoding="utf-8")
+
+    store.record("sec", analysis_result("2026-10-16T14:30:00Z", ("META", "-2.00%")), "models")
+    publish_api(store, api_dir)
+
+    assert read(api_dir, "tickers/META.json")["maps"]["sec"] == [["2026-10-15", -9.34], ["2026-10-16", -2.0]]
+
+
+def test_empty_history(store, tmp_path):
+    manifest, written = publish_api(store, tmp_path / "api")
+
+    assert (manifest["files"], manifest["last_snapshot_id"], written) == ({}, 0, 0)
+    assert (tmp_path / "api" / "manifest.json").exists()
@@ -0,0 +1,67 @@
+import math
+
+from conftest import fixture_map_data
+from rankings import TileTable, rank_tiles, top_k
+
+
+def test_top_k_matches_a_full_sort():
+    tiles = fixture_map_data()["tiles"]
+    table = TileTable.from_tiles(tiles)
+
+    losers, gainers, _ = top_k(table, k=10)
+
+    # Ties (ADSK and CRM at -4.78%) keep the order of the input, like a stable sort
+    by_change = sorted(range(len(tiles)), key=lambda i: tiles[i]["change"])
+    assert losers == [i for i in by_change if tiles[i]["change"] < 0][:10]
+    by_gain = sorted(range(len(tiles)), key=lambda i: -tiles[i]["change"])
+    assert gainers == [i for i in by_gain if tiles[i]["change"] > 0][:10]
+
+
+def test_k_larger_than_the_map_and_missing_values():
+    table = TileTable.from_tiles([
+        {"ticker": "A", "change": -1.0, "market_cap": 100.0},
+        {"ticker": "B", "change": None, "market_cap": 500.0},
+        {"ticker": "C", "change": 2.0},
+        {"ticker": "D", "change": 0.0, "market_cap": 50.0},
+    ])
+
+    losers, gainers, movers = top_k(table, k=10)
+
+    assert (losers, gainers, movers) == ([0], [2], [0])
+    ranked = rank_tiles(table)
+    assert ranked["breadth"] == {"tiles": 3, "advancers": 1, "decliners": 1, "unchanged": 1}
+    assert ranked["biggest_movers"][0]["market_cap_change"] == -1
+
+
+def test_sector_aggregates_cover_every_tile():
+    tiles = fixture_map_data()["tiles"]
+    sectors = rank_tiles(TileTable.from_tiles(tiles))["sectors"]
+
+    assert sum(sector["count"] for sector in sectors) == len(tiles)
+    weighted = [sector["weighted_change"] for sector in sectors]
+    assert weighted == sorted(weighted)
+    technology = next(sector for sector in sectors if sector["sector"] == "Technology")
+    assert technology["worst"] == {"ticker": "INTU", "change": "-6.81%"}
+    caps = [(t["market_cap"], t["change"]) for t in tiles if t["sector"] == "Technology"]
+    expected = sum(cap * change for cap, change in caps) / sum(cap for cap, _ in caps)
+    assert math.isclose(technology["weighted_change"], round(expected, 2))
+
+
+def test_sector_without_market_caps_uses_average():
+    sectors = rank_tiles(TileTable.from_tiles([
+        {"ticker": "A", "change": -2.0},
+        {"ticker": "B", "change": 1.0},
+    ]))["sectors"]
+
+    assert sectors == [{
+        "sector": "Unknown", "count": 2, "average_change": -0.5, "weighted_change": None,
+        "market_cap": 0.0, "advancers": 1, "decliners": 1,
+        "worst": {"ticker": "A", "change": "-2.00%"},
+    }]
+
+
+def test_empty_map():
+    ranked = rank_tiles(TileTable.from_tiles([]))
+
+    assert ranked["top_losers"] == [] and ranked["sectors"] == []
+    assert ranked["breadth"]["tiles"] == 0
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from conftest import SAMPLE_IMAGE
+from mock_models_server import load_losers
+from models_client import analyze_images
+from rate_limiter import RateLimiter, RateLimitExceeded, parse_duration
+
+
+def analyze(server, names=("sec",), **options):
+    options.setdefault("limiter", RateLimiter(0))
+    return asyncio.run(analyze_images({name: SAMPLE_IMAGE for name in names}, "test", server.url,
+                                      concurrency=1, **options))
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("20", 20.0),
+    ("1m30s", 90.0),
+    ("250ms", 0.25),
+    ("soon", None),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+def test_5xx_is_retried_with_backoff(mock_server):
+    server = mock_server("--fail-every", "2")
+
+    results = analyze(server, ("sec", "world"))
+
+    assert results == {"sec": load_losers(), "world": load_losers()}
+    assert server.log().count("503 simulated failure") == 1
+    assert server.log().count("📨 POST") == 3
+
+
+def test_5xx_gives_up_after_max_retries(mock_server):
+    server = mock_server("--fail-every", "1")
+
+    result = analyze(server, max_retries=1)["sec"]
+
+    assert isinstance(result, httpx.HTTPStatusError)
+    assert result.response.status_code == 503
+    assert server.log().count("📨 POST") == 2
+
+
+def test_429_waits_for_retry_after(mock_server):
+    server = mock_server("--rpm", "1", "--window", "1")
+    started = time.monotonic()
+
+    results = analyze(server, ("sec", "world"))
+
+    assert results == {"sec": load_losers(), "world": load_losers()}
+    assert server.log().count("429 rate limited, Retry-After 1s") == 1
+    assert time.monotonic() - started >= 0.9
+
+
+def test_429_longer_than_max_wait_fails_fast(mock_server):
+    server = mock_server("--rpm", "1")
+    started = time.monotonic()
+
+    results = analyze(server, ("sec", "world"), limiter=RateLimiter(0, max_wait=5))
+
+    assert results["sec"] == load_losers()
+    assert isinstance(results["world"], httpx.HTTPStatusError)
+    assert results["world"].response.status_code == 429
+    assert time.monotonic() - started < 5
+
+
+def test_limiter_refuses_waits_past_max_wait():
+    limiter = RateLimiter(0, max_wait=1)
+    limiter.pause(30)
+
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(limiter.acquire())
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from conftest import fixture_map_data
+from snapshot_formats import read_columnar, read_ndjson, write_snapshot
+
+RESULT = {"generated_at": "2026-10-16T14:30:00Z", "source": "map_data"}
+
+
+def test_columnar_round_trip(tmp_path):
+    tiles = fixture_map_data()["tiles"]
+    tiles[0] = {**tiles[0], "industry": None, "market_cap": None}
+    path = tmp_path / "spy.fcol"
+
+    assert write_snapshot(path, "columnar", RESULT, "sec", tiles) == path.stat().st_size
+    header, table = read_columnar(path)
+
+    assert header["rows"] == len(tiles)
+    assert (header["map_type"], header["generated_at"], header["source"]) == ("sec", *RESULT.values())
+    assert [table.row(i) for i in range(len(table))] == [
+        {"ticker": t["ticker"], "sector": t["sector"], "industry": t["industry"],
+         "market_cap": t["market_cap"], "change": t["change"]}
+        for t in tiles
+    ]
+    # Numeric columns are views into the file, aligned for zero-copy reads
+    assert not table.change.flags.writeable
+    assert all(buffer["offset"] % 8 == 0 for buffer in header["buffers"].values())
+
+
+def test_ndjson_round_trip(tmp_path):
+    tiles = fixture_map_data()["tiles"]
+    path = tmp_path / "spy.ndjson"
+
+    write_snapshot(path, "ndjson", RESULT, "sec", tiles)
+    records = list(read_ndjson(path))
+
+    assert len(records) == len(tiles)
+    assert records[0] == {"map_type": "sec", **RESULT, **tiles[0]}
+
+
+def test_without_map_data_writes_top_losers(tmp_path):
+    result = {**RESULT, "top_losers": [{"ticker": "META", "change": "-9.34%"}, {"ticker": None, "change": "n/a"}]}
+
+    write_snapshot(tmp_path / "spy.fcol", "columnar", result, "sec")
+    _, table = read_columnar(tmp_path / "spy.fcol")
+
+    assert table.tickers.tolist() == ["META", ""]
+    assert table.change[0] == -9.34 and np.isnan(table.change[1])
+    assert table.sectors.tolist() == ["Unknown"]
+
+
+@pytest.mark.parametrize("fmt", ["columnar", "ndjson"])
+def test_empty_and_missing_top_losers(tmp_path, fmt):
+    for result in ({**RESULT, "top_losers": []}, {**RESULT, "top_losers": None}, RESULT):
+        path = tmp_path / f"spy.{fmt}"
+        write_snapshot(path, fmt, result, "sec")
+        if fmt == "columnar":
+            assert len(read_columnar(path)[1]) == 0
+        else:
+            assert list(read_ndjson(path)) == []
+
+
+def test_unknown_file_and_format_are_rejected(tmp_path):
+    path = tmp_path / "spy.fcol"
+    path.write_bytes(b"not a snapshot")
+
+    with pytest.raises(ValueError):
+        read_columnar(path)
+    with pytest.raises(ValueError):
+        write_snapshot(tmp_path / "spy.csv", "csv", RESULT, "sec")
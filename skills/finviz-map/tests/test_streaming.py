@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+from conftest import SAMPLE_IMAGE
+from mock_models_server import load_losers
+from models_client import analyze_images
+from rate_limiter import RateLimiter
+from stream_parser import TopLosersStreamParser
+
+
+def analyze_streaming(server, **options):
+    results = asyncio.run(analyze_images({"sec": SAMPLE_IMAGE}, "test", server.url, stream=True,
+                                         limiter=RateLimiter(0), **options))
+    if isinstance(results["sec"], Exception):
+        raise results["sec"]
+    return results["sec"]
+
+
+def test_parser_finds_entries_split_across_chunks():
+    content = "```json\n" + json.dumps(load_losers(), indent=2) + "\n```"
+    parser = TopLosersStreamParser()
+    for i in range(0, len(content), 3):
+        parser.feed(content[i:i + 3])
+
+    assert parser.entries == load_losers()["top_losers"]
+
+
+def test_stream_stops_once_limit_is_reached(mock_server):
+    server = mock_server("--token-delay", "0.05")
+
+    result = analyze_streaming(server, stream_limit=3)
+
+    assert result == {"top_losers": load_losers()["top_losers"][:3]}
+    assert server.wait_for_log("client closed the stream")
+    assert "streamed all" not in server.log()
+
+
+def test_stream_below_limit_stops_at_end_of_array(mock_server):
+    server = mock_server("--token-delay", "0.05")
+
+    assert analyze_streaming(server, stream_limit=20) == load_losers()
+    # The closing fence after "]" is never read
+    assert server.wait_for_log("client closed the stream")
+    assert "streamed all" not in server.log()
+
+
+def test_stream_cut_off_partway_keeps_parsed_entries(mock_server):
+    server = mock_server("--token-delay", "0", "--cut-after", "30")
+
+    result = analyze_streaming(server, stream_limit=20)
+
+    expected = load_losers()["top_losers"]
+    assert 0 < len(result["top_losers"]) < len(expected)
+    assert result["top_losers"] == expected[:len(result["top_losers"])]
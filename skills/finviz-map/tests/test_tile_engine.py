@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from conftest import SAMPLE_IMAGE
+from tile_engine import BACKGROUND, COLOR_SCALE, color_to_change, segment_tiles, top_losers_from_tiles
+
+
+def synthetic_map():
+    """Three tiles under an industry header, split by 1px background lines"""
+    pixels = np.full((80, 121, 3), BACKGROUND, dtype=np.uint8)
+    pixels[0:12, 0:121] = (90, 90, 90)             # industry header across all tiles
+    pixels[12:80, 0:60] = (246, 53, 56)            # -3% or worse
+    pixels[12:40, 61:121] = (139, 68, 78)          # -1%
+    pixels[41:80, 61:121] = (47, 158, 79)          # +2%
+    pixels[20:30, 10:40] = (255, 255, 255)         # label text
+    return pixels
+
+
+@pytest.mark.parametrize("change, color", COLOR_SCALE)
+def test_scale_colors_map_to_their_change(change, color):
+    assert color_to_change(color) == (change, 0.0)
+
+
+def test_tiles_are_found_and_sorted_by_change():
+    tiles = segment_tiles(synthetic_map())
+
+    assert [(tile["change"], tile["saturated"]) for tile in tiles] == [(-3.0, True), (-1.0, False), (2.0, False)]
+    # The header above the tiles isn't part of them
+    assert [tile["bbox"] for tile in tiles] == [[0, 12, 60, 80], [61, 12, 121, 40], [61, 41, 121, 80]]
+    assert tiles[0]["coverage"] < 1 and tiles[1]["coverage"] == 1
+
+
+def test_top_losers_from_tiles():
+    result = top_losers_from_tiles(segment_tiles(synthetic_map()), limit=5)
+
+    assert [entry["change"] for entry in result["top_losers"]] == ["-3.00%", "-1.00%"]
+    assert result["top_losers"][0]["ticker"] is None and result["top_losers"][0]["saturated"]
+    assert result["tiles_found"] == 3
+
+
+def test_blank_map_has_no_tiles():
+    blank = np.full((50, 50, 3), BACKGROUND, dtype=np.uint8)
+
+    assert segment_tiles(blank) == []
+    assert top_losers_from_tiles([])["top_losers"] == []
+
+
+def test_sample_map():
+    tiles = segment_tiles(SAMPLE_IMAGE)
+
+    assert len(tiles) > 400
+    changes = [tile["change"] for tile in tiles]
+    assert changes == sorted(changes)
+    # META's tile (the biggest loser) is saturated red
+    meta = next(tile for tile in tiles if tile["bbox"][0] <= 850 < tile["bbox"][2]
+                and tile["bbox"][1] <= 170 < tile["bbox"][3])
+    assert meta["saturated"] and meta["change"] == -3.0
@@ -0,0 +1,38 @@
+import pytest
+
+from tile_ocr import cross_check, parse_ocr_text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("META\n-9.34%", ("META", -9.34)),
+    ("BRK.B +0.5%", ("BRK.B", 0.5)),
+    # Only the first ticker and percentage count
+    ("INTU -6.81% ADSK -4.78%", ("INTU", -6.81)),
+    ("", (None, None)),
+    # Lowercase noise, a bare number and a token too long to be a ticker
+    ("meta 934 TOOLONGX", (None, None)),
+    ("-1.25%", (None, -1.25)),
+])
+def test_parse_ocr_text(text, expected):
+    assert parse_ocr_text(text) == expected
+
+
+def tile(change, saturated=False):
+    return {"change": change, "saturated": saturated}
+
+
+@pytest.mark.parametrize("color, ticker, change, verified", [
+    (tile(-1.0), "MSFT", -1.2, True),
+    (tile(-1.0), "MSFT", -1.5, False),
+    (tile(-1.0), "MSFT", None, False),
+    # Saturated tiles only need a reading beyond the saturation point
+    (tile(-3.0, saturated=True), "META", -9.34, True),
+    (tile(-3.0, saturated=True), "META", -2.5, False),
+    (tile(-3.0, saturated=True), "META", 9.34, False),
+    # A percentage alone doesn't verify a tile
+    (tile(-1.0), None, -1.0, False),
+    (tile(-1.0), "", -1.0, False),
+    (tile(-1.0), "meta", -1.0, False),
+])
+def test_cross_check(color, ticker, change, verified):
+    assert cross_check(color, ticker, change) is verified
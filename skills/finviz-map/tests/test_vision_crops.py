@@ -0,0 +1,50 @@
+import json
+
+from conftest import FIXTURES_DIR, SAMPLE_IMAGE
+from tile_engine import load_pixels
+from vision_crops import candidate_tiles, shrink_images
+
+# Where each of the corpus map's ten biggest losers has its label (x, y)
+LABEL_POSITIONS = {
+    "META": (850, 170),
+    "INTU": (412, 685),
+    "ACN": (447, 810),
+    "ADBE": (415, 645),
+    "NOW": (375, 642),
+    "AJG": (828, 795),
+    "PSA": (1283, 818),
+    "ADSK": (412, 717),
+    "CRM": (440, 605),
+    "ADP": (375, 680),
+}
+
+
+def expected_tickers():
+    with open(FIXTURES_DIR / "corpus" / "manifest.json", "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return [entry["ticker"] for entry in manifest["maps"][0]["top_losers"]]
+
+
+def contains(bbox, point):
+    x0, y0, x1, y1 = bbox
+    x, y = point
+    return x0 <= x < x1 and y0 <= y < y1
+
+
+def test_mosaic_covers_the_top_ten_losers():
+    assert sorted(LABEL_POSITIONS) == sorted(expected_tickers())
+
+    candidates = candidate_tiles(load_pixels(SAMPLE_IMAGE))
+    missing = [
+        ticker for ticker, point in LABEL_POSITIONS.items()
+        if not any(contains(tile["bbox"], point) for tile, _ in candidates)
+    ]
+    assert missing == []
+    # Every labelled saturated tile is sent, not just the largest ones
+    assert len(candidates) > 15
+    assert all(tile["saturated"] for tile, _ in candidates)
+
+
+def test_too_many_saturated_tiles_fall_back_to_full_image():
+    assert shrink_images(SAMPLE_IMAGE, maximum=10) == []
+    assert len(shrink_images(SAMPLE_IMAGE)) == 1